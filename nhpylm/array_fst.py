@@ -0,0 +1,826 @@
+## ----------------------------------------------------------------------------
+##
+##   File: array_fst.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+"""
+In-process weighted finite state transducers in the tropical semiring.
+
+All fsts used here provide the same minimal interface: the attribute start,
+final(state) returning the final weight (inf for non-final states) and
+arcs(state) returning a list of (ilabel, olabel, weight, dst) tuples. This
+allows lazy fsts (e.g. ComposeFST or LanguageModelFST) to be used wherever
+an ArrayFST is used.
+"""
+
+from collections import namedtuple, OrderedDict
+from heapq import heappush, heappop
+from math import inf
+import struct
+import numpy as np
+from nhpylm import fst
+
+ArrayArc = namedtuple('ArrayArc', ['ilabel', 'olabel', 'weight', 'dst'])
+
+SYMBOL_TABLE_MAGIC_NUMBER = 2125658996
+FST_HEADER_FLAGS = {'isymbols': 0x1, 'osymbols': 0x2, 'aligned': 0x4}
+
+
+class ArrayFST:
+    """
+    FST stored in arrays with arcs ordered by source state (CSR offsets)
+    """
+
+    def __init__(self, num_states, start, src, dst, ilabel, olabel,
+                 weight=None, final_states=(), final_weights=None):
+        """
+        Construct FST from arc arrays
+
+        :param num_states: number of states
+        :param start: start state id (-1: no start state)
+        :param src: array with source state id of each arc
+        :param dst: array with destination state id of each arc
+        :param ilabel: array with input label of each arc
+        :param olabel: array with output label of each arc
+        :param weight: array with weight of each arc (None: zero weights)
+        :param final_states: list of final state ids
+        :param final_weights: list of final weights (None: zero weights)
+        """
+
+        src = np.asarray(src, dtype=np.int64)
+        order = np.argsort(src, kind='stable')
+        self.num_states = num_states
+        self.start = start
+        self.dst = np.asarray(dst, dtype=np.int32)[order]
+        self.ilabel = np.asarray(ilabel, dtype=np.int32)[order]
+        self.olabel = np.asarray(olabel, dtype=np.int32)[order]
+        if weight is None:
+            self.weight = np.zeros(len(src), dtype=np.float32)
+        else:
+            self.weight = np.asarray(weight, dtype=np.float32)[order]
+        self.offsets = np.zeros(num_states + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_states),
+                  out=self.offsets[1:])
+        self.finals = np.full(num_states, inf, dtype=np.float32)
+        self.finals[np.asarray(final_states, dtype=np.int64)] = \
+            0 if final_weights is None else final_weights
+        self.sort_type = None
+        self._arcs = dict()
+        self._label_index = {'ilabel': dict(), 'olabel': dict()}
+
+    @classmethod
+    def from_simple_fst(cls, simple_fst):
+        """
+        Convert a SimpleFST
+
+        :param simple_fst: SimpleFST instance
+        :return: ArrayFST instance
+        """
+
+        final_states = [final_state.state_id
+                        for final_state in simple_fst.final_states]
+        final_weights = [final_state.weight or 0
+                         for final_state in simple_fst.final_states]
+        start = simple_fst.start_state
+        if start is None:
+            start = -1
+        if isinstance(simple_fst, fst.CompactSimpleFST):
+            arcs, _ = simple_fst.get_arc_arrays()
+            return cls(simple_fst.num_states, start, arcs['src'], arcs['dst'],
+                       arcs['ilabel'], arcs['olabel'],
+                       np.nan_to_num(arcs['weight']), final_states,
+                       final_weights)
+
+        arcs = [arc for state_id in range(simple_fst.num_states)
+                for arc in simple_fst.get_arcs(state_id)]
+        return cls(
+            simple_fst.num_states, start,
+            [arc.src for arc in arcs], [arc.dst for arc in arcs],
+            [arc.ilabel for arc in arcs], [arc.olabel for arc in arcs],
+            [arc.weight or 0 for arc in arcs], final_states, final_weights)
+
+    @classmethod
+    def read(cls, filename):
+        """
+        Read fst in OpenFst binary format (VectorFst with StdArc)
+
+        :param filename: fst in binary format
+        :return: ArrayFST instance
+        """
+
+        with open(filename, 'rb') as fid:
+            data = fid.read()
+
+        magic, = struct.unpack_from('<i', data, 0)
+        if magic != fst.FST_MAGIC_NUMBER:
+            raise Exception('{} is not an OpenFst binary'.format(filename))
+        offset = 4
+        fst_strings = list()
+        for _ in range(2):
+            length, = struct.unpack_from('<i', data, offset)
+            fst_strings.append(data[offset + 4:offset + 4 + length].decode())
+            offset += 4 + length
+        if fst_strings != ['vector', 'standard']:
+            raise Exception('Unsupported fst type {} with arc type {}!'
+                            .format(*fst_strings))
+        _, flags, _, start, num_states, _ = \
+            struct.unpack_from('<iiQqqq', data, offset)
+        offset += 40
+        if flags & FST_HEADER_FLAGS['aligned']:
+            raise Exception('Aligned fsts are not supported!')
+        for symbols in ['isymbols', 'osymbols']:
+            if flags & FST_HEADER_FLAGS[symbols]:
+                offset = _skip_symbol_table(data, offset)
+
+        # state: final weight, number of arcs (int64), arcs (4 x 32 bit)
+        words = memoryview(data[offset:]).cast('i')
+        state_begin = np.empty(num_states, dtype=np.int64)
+        num_arcs_per_state = np.empty(num_states, dtype=np.int64)
+        position = 0
+        for state in range(num_states):
+            state_begin[state] = position
+            num_arcs_per_state[state] = (words[position + 1] & 0xffffffff) \
+                + (words[position + 2] << 32)
+            position += 3 + 4 * int(num_arcs_per_state[state])
+        words = np.frombuffer(data, dtype='<i4', offset=offset,
+                              count=position)
+
+        finals = words[state_begin].view('<f4')
+        src = np.repeat(np.arange(num_states), num_arcs_per_state)
+        arcs_begin = np.cumsum(num_arcs_per_state) - num_arcs_per_state
+        arc_begin = state_begin[src] + 3 + 4 * (np.arange(len(src)) -
+                                                arcs_begin[src])
+        final_states = np.flatnonzero(np.isfinite(finals))
+        return cls(num_states, start, src, words[arc_begin + 3],
+                   words[arc_begin], words[arc_begin + 1],
+                   words[arc_begin + 2].view('<f4'), final_states,
+                   finals[final_states])
+
+    def write(self, filename, sort_type='ilabel'):
+        """
+        Write fst in OpenFst binary format (VectorFst with StdArc)
+
+        :param filename: filename to write to
+        :param sort_type: sort arcs, e.g. 'ilabel', 'olabel' or None
+        """
+
+        final_states = np.flatnonzero(np.isfinite(self.finals))
+        fst.write_vector_fst(
+            filename, self.src, self.dst, self.ilabel, self.olabel,
+            self.weight, self.start, final_states, self.finals[final_states],
+            self.num_states, sort_type)
+
+    @property
+    def src(self):
+        """
+        Return source state id of each arc
+
+        :return: array with source state ids
+        """
+
+        return np.repeat(np.arange(self.num_states), np.diff(self.offsets))
+
+    @property
+    def num_arcs(self):
+        """
+        Return number of arcs
+
+        :return: Number of arcs
+        """
+
+        return len(self.dst)
+
+    def arcsort(self, sort_type='ilabel'):
+        """
+        Sort the arcs of each state by input or output label
+
+        :param sort_type: sort type, 'ilabel' or 'olabel'
+        """
+
+        if sort_type not in ['ilabel', 'olabel']:
+            raise Exception('Unknown sort_type {}!'.format(sort_type))
+
+        labels = self.ilabel if sort_type == 'ilabel' else self.olabel
+        order = np.lexsort((labels, self.src))
+        self.dst, self.ilabel, self.olabel, self.weight = \
+            self.dst[order], self.ilabel[order], self.olabel[order], \
+            self.weight[order]
+        self.sort_type = sort_type
+        self._arcs = dict()
+        self._label_index = {'ilabel': dict(), 'olabel': dict()}
+
+    def add_self_loops(self, ilabels, olabels):
+        """
+        Add self loops with the given labels to each state
+        (like fstaddselfloops for linear input fsts)
+
+        :param ilabels: list of input labels
+        :param olabels: list of corresponding output labels
+        :return: new ArrayFST with self loops
+        """
+
+        states = np.arange(self.num_states)
+        src = np.concatenate([self.src] + len(ilabels) * [states])
+        dst = np.concatenate([self.dst] + len(ilabels) * [states])
+        ilabel = np.concatenate(
+            [self.ilabel] + [np.full(self.num_states, label)
+                             for label in ilabels])
+        olabel = np.concatenate(
+            [self.olabel] + [np.full(self.num_states, label)
+                             for label in olabels])
+        weight = np.concatenate(
+            [self.weight, np.zeros(len(ilabels) * self.num_states)])
+        final_states = np.flatnonzero(np.isfinite(self.finals))
+        return ArrayFST(self.num_states, self.start, src, dst, ilabel, olabel,
+                        weight, final_states, self.finals[final_states])
+
+    def final(self, state):
+        """
+        Return final weight of state (inf if the state is not final)
+
+        :param state: state id
+        :return: final weight
+        """
+
+        return float(self.finals[state])
+
+    def arcs(self, state):
+        """
+        Get all arcs originating from state
+
+        :param state: state id
+        :return: list of ArrayArc tuples (ilabel, olabel, weight, dst)
+        """
+
+        arcs = self._arcs.get(state)
+        if arcs is None:
+            begin, end = self.offsets[state], self.offsets[state + 1]
+            arcs = list(map(ArrayArc._make, zip(
+                self.ilabel[begin:end].tolist(),
+                self.olabel[begin:end].tolist(),
+                self.weight[begin:end].tolist(),
+                self.dst[begin:end].tolist())))
+            self._arcs[state] = arcs
+        return arcs
+
+    def matches(self, state, label, side='ilabel'):
+        """
+        Get all arcs originating from state with the given input
+        or output label
+
+        :param state: state id
+        :param label: label to match
+        :param side: 'ilabel' or 'olabel'
+        :return: list of ArrayArc tuples (ilabel, olabel, weight, dst)
+        """
+
+        label_index = self._label_index[side].get(state)
+        if label_index is None:
+            label_index = dict()
+            for arc in self.arcs(state):
+                label_index.setdefault(getattr(arc, side), []).append(arc)
+            self._label_index[side][state] = label_index
+        return label_index.get(label, [])
+
+
+class ComposeFST:
+    """
+    Lazy composition of two fsts. The output labels of the left fst are
+    matched with the input labels of the right fst. States are tuples of
+    (left state, right state, filter state) and are expanded on demand.
+
+    Epsilon moves are filtered like the OpenFst sequence filter: a left
+    epsilon output move is not allowed after a right epsilon input move
+    (filter state 1) until the next matching move, so each path is
+    generated only once.
+
+    Like LanguageModelFST only the max_states most recently used states are
+    kept expanded, so a composition reused for many utterances does not
+    grow without bound.
+    """
+
+    def __init__(self, left, right, phi=None, eps=0, max_states=100000):
+        """
+        Construct lazy composition
+
+        :param left: left fst
+        :param right: right fst (needs matches(state, label, 'ilabel'))
+        :param phi: phi (failure) input label of the right fst. A phi
+                    transition is only followed if there is no match for a
+                    label. Final weights are propagated through phi
+                    transitions. None: no phi composition
+        :param eps: epsilon label
+        :param max_states: maximum number of expanded states kept in memory
+        """
+
+        self.left = left
+        self.right = right
+        self.phi = phi
+        self.eps = eps
+        self.start = (left.start, right.start, 0)
+        self.max_states = max_states
+        self._arcs = OrderedDict()
+
+    def final(self, state):
+        """
+        Return final weight of state (inf if the state is not final)
+
+        :param state: composed state
+        :return: final weight
+        """
+
+        left_final = self.left.final(state[0])
+        if left_final == inf:
+            return inf
+        return left_final + self._right_final(state[1])
+
+    def _right_final(self, right_state):
+        right_final = self.right.final(right_state)
+        weight = 0
+        visited = {right_state}
+        while right_final == inf and self.phi is not None:
+            phi_arcs = self.right.matches(right_state, self.phi)
+            if not phi_arcs or phi_arcs[0].dst in visited:
+                break
+            weight += phi_arcs[0].weight
+            right_state = phi_arcs[0].dst
+            visited.add(right_state)
+            right_final = self.right.final(right_state)
+        return weight + right_final
+
+    def _right_matches(self, right_state, label):
+        if self.phi is None or label == self.phi:
+            return self.right.matches(right_state, label)
+
+        weight = 0
+        visited = {right_state}
+        while True:
+            matches = self.right.matches(right_state, label)
+            if matches:
+                if weight == 0:
+                    return matches
+                return [arc._replace(weight=arc.weight + weight)
+                        for arc in matches]
+            phi_arcs = self.right.matches(right_state, self.phi)
+            if not phi_arcs or phi_arcs[0].dst in visited:
+                return []
+            weight += phi_arcs[0].weight
+            right_state = phi_arcs[0].dst
+            visited.add(right_state)
+
+    def arcs(self, state):
+        """
+        Get all arcs originating from state
+
+        :param state: composed state
+        :return: list of ArrayArc tuples (ilabel, olabel, weight, dst)
+        """
+
+        arcs = self._arcs.get(state)
+        if arcs is not None:
+            self._arcs.move_to_end(state)
+            return arcs
+
+        left_state, right_state, filter_state = state
+        arcs = list()
+        for left_arc in self.left.arcs(left_state):
+            if left_arc.olabel == self.eps:
+                if filter_state == 0:
+                    arcs.append(ArrayArc(left_arc.ilabel, self.eps,
+                                         left_arc.weight,
+                                         (left_arc.dst, right_state, 0)))
+            else:
+                for right_arc in self._right_matches(right_state,
+                                                     left_arc.olabel):
+                    arcs.append(ArrayArc(left_arc.ilabel, right_arc.olabel,
+                                         left_arc.weight + right_arc.weight,
+                                         (left_arc.dst, right_arc.dst, 0)))
+        for right_arc in self.right.matches(right_state, self.eps):
+            arcs.append(ArrayArc(self.eps, right_arc.olabel, right_arc.weight,
+                                 (left_state, right_arc.dst, 1)))
+
+        self._arcs[state] = arcs
+        if len(self._arcs) > self.max_states:
+            self._arcs.popitem(last=False)
+        return arcs
+
+    def matches(self, state, label, side='ilabel'):
+        """
+        Get all arcs originating from state with the given input
+        or output label
+
+        :param state: composed state
+        :param label: label to match
+        :param side: 'ilabel' or 'olabel'
+        :return: list of ArrayArc tuples (ilabel, olabel, weight, dst)
+        """
+
+        return [arc for arc in self.arcs(state)
+                if getattr(arc, side) == label]
+
+
+class LanguageModelFST:
+    """
+    Lazy language model fst backed by a NHPYLM_wrapper. States are the
+    context ids of the language model, the arcs of a state (including the
+    phi back-off arcs and the transitions into and out of the character
+    model) are calculated on demand by the language model. Only the
+    max_states most recently used states are kept expanded, which allows to
+    search language models too large to be exported as a whole (see
+    NHPYLM_wrapper.to_fst_arrays). The language model must not be changed
+    while the fst is used.
+    """
+
+    def __init__(self, lm, sow=None, eow=None, eos_word=None,
+                 return_to_start=False, context_map=None, max_states=100000):
+        """
+        Construct lazy language model fst
+
+        :param lm: NHPYLM_wrapper instance
+        :param sow: label used to enter the character model
+                    (see NHPYLM_wrapper.to_fst_arrays)
+        :param eow: label used to leave the character model
+        :param eos_word: label used for the sentence end
+        :param return_to_start: return to the start context at sentence end
+        :param context_map: map from context id to the context id to be used
+                            (see NHPYLM_wrapper.get_pruned_context_map)
+        :param max_states: maximum number of expanded states kept in memory
+        """
+
+        self.lm = lm
+        self.label_kwargs = dict(sow=sow, eow=eow, eos_word=eos_word,
+                                 return_to_start=return_to_start,
+                                 context_map=context_map)
+        self.start = lm.start_context_id
+        if return_to_start:
+            self.final_state = lm.start_context_id
+        else:
+            self.final_state = lm.final_context_id
+        self.max_states = max_states
+        self.num_expansions = 0
+        # state -> (arcs, input label -> arcs)
+        self._states = OrderedDict()
+
+    def final(self, state):
+        """
+        Return final weight of state (inf if the state is not final)
+
+        :param state: context id
+        :return: final weight
+        """
+
+        return 0. if state == self.final_state else inf
+
+    def _expand(self, state):
+        expanded = self._states.get(state)
+        if expanded is not None:
+            self._states.move_to_end(state)
+            return expanded
+
+        labels, dsts, weights = self.lm.get_transition_arrays(
+            state, **self.label_kwargs)
+        labels = labels.tolist()
+        arcs = list(map(ArrayArc._make, zip(labels, labels, weights.tolist(),
+                                            dsts.tolist())))
+        label_index = dict()
+        for arc in arcs:
+            label_index.setdefault(arc.ilabel, []).append(arc)
+        expanded = (arcs, label_index)
+        self.num_expansions += 1
+        self._states[state] = expanded
+        if len(self._states) > self.max_states:
+            self._states.popitem(last=False)
+        return expanded
+
+    def arcs(self, state):
+        """
+        Get all arcs originating from state
+
+        :param state: context id
+        :return: list of ArrayArc tuples (ilabel, olabel, weight, dst)
+        """
+
+        return self._expand(state)[0]
+
+    def matches(self, state, label, side='ilabel'):
+        """
+        Get all arcs originating from state with the given input
+        or output label (input and output labels are the same)
+
+        :param state: context id
+        :param label: label to match
+        :param side: 'ilabel' or 'olabel'
+        :return: list of ArrayArc tuples (ilabel, olabel, weight, dst)
+        """
+
+        return self._expand(state)[1].get(label, [])
+
+
+def _skip_symbol_table(data, offset):
+    magic, = struct.unpack_from('<i', data, offset)
+    if magic != SYMBOL_TABLE_MAGIC_NUMBER:
+        raise Exception('Could not read symbol table!')
+    length, = struct.unpack_from('<i', data, offset + 4)
+    offset += 8 + length + 8
+    size, = struct.unpack_from('<q', data, offset)
+    offset += 8
+    for _ in range(size):
+        length, = struct.unpack_from('<i', data, offset)
+        offset += 4 + length + 8
+    return offset
+
+
+def compose(left, right, phi=None, eps=0, connect=True):
+    """
+    Compose two fsts into a new ArrayFST
+
+    :param left: left fst
+    :param right: right fst
+    :param phi: phi label for phi composition (see ComposeFST)
+    :param eps: epsilon label
+    :param connect: remove states not leading to a final state
+    :return: ArrayFST instance of the composition
+    """
+
+    composed = ComposeFST(left, right, phi, eps)
+    state_ids = {composed.start: 0}
+    queue = [composed.start]
+    src, dst, ilabel, olabel, weight = list(), list(), list(), list(), list()
+    final_states, final_weights = list(), list()
+    while queue:
+        state = queue.pop()
+        final_weight = composed.final(state)
+        if final_weight != inf:
+            final_states.append(state_ids[state])
+            final_weights.append(final_weight)
+        for arc in composed.arcs(state):
+            if arc.dst not in state_ids:
+                state_ids[arc.dst] = len(state_ids)
+                queue.append(arc.dst)
+            src.append(state_ids[state])
+            dst.append(state_ids[arc.dst])
+            ilabel.append(arc.ilabel)
+            olabel.append(arc.olabel)
+            weight.append(arc.weight)
+
+    composed_fst = ArrayFST(len(state_ids), 0, src, dst, ilabel, olabel,
+                            weight, final_states, final_weights)
+    if connect:
+        composed_fst = _connect(composed_fst)
+    return composed_fst
+
+
+def _connect(array_fst):
+    # states from which a final state can be reached
+    src = array_fst.src
+    coaccessible = np.isfinite(array_fst.finals)
+    num_coaccessible = -1
+    while num_coaccessible != coaccessible.sum():
+        num_coaccessible = coaccessible.sum()
+        coaccessible[src[coaccessible[array_fst.dst]]] = True
+
+    if not coaccessible[array_fst.start]:
+        return ArrayFST(0, -1, [], [], [], [])
+
+    state_ids = np.cumsum(coaccessible) - 1
+    keep = coaccessible[src] & coaccessible[array_fst.dst]
+    final_states = np.flatnonzero(np.isfinite(array_fst.finals))
+    return ArrayFST(int(num_coaccessible), int(state_ids[array_fst.start]),
+                    state_ids[src[keep]], state_ids[array_fst.dst[keep]],
+                    array_fst.ilabel[keep], array_fst.olabel[keep],
+                    array_fst.weight[keep], state_ids[final_states],
+                    array_fst.finals[final_states])
+
+
+def shortest_paths(input_fst, nshortest=1):
+    """
+    Find the n shortest paths through a (possibly lazy) fst. The weights are
+    expected to be non-negative (e.g. negative log probabilities). Each state
+    is expanded at most nshortest times.
+
+    :param input_fst: fst providing start, final(state) and arcs(state)
+    :param nshortest: number of shortest paths
+    :return: list of (weight, path) tuples sorted by weight, path is a list
+             of ArrayArc tuples (ilabel, olabel, weight, dst)
+    """
+
+    if input_fst.start == -1:
+        return []
+
+    # queue entries: (weight, counter, state, back pointer, is final)
+    # back pointer: (arc, previous back pointer)
+    counter = 0
+    queue = [(0., counter, input_fst.start, None, False)]
+    num_expansions = dict()
+    paths = list()
+    while queue and len(paths) < nshortest:
+        weight, _, state, back_pointer, is_final = heappop(queue)
+        if is_final:
+            path = list()
+            while back_pointer is not None:
+                arc, back_pointer = back_pointer
+                path.append(arc)
+            paths.append((weight, path[::-1]))
+            continue
+
+        num_expansions[state] = num_expansions.get(state, 0) + 1
+        if num_expansions[state] > nshortest:
+            continue
+
+        final_weight = input_fst.final(state)
+        if final_weight != inf:
+            counter += 1
+            heappush(queue, (weight + final_weight, counter, state,
+                             back_pointer, True))
+        for arc in input_fst.arcs(state):
+            counter += 1
+            heappush(queue, (weight + arc.weight, counter, arc.dst,
+                             (arc, back_pointer), False))
+
+    return paths
+
+
+def viterbi_beam_search(input_fst, log_likelihoods, observation_labels=None,
+                        beam=16., max_active=7000, acoustic_scale=1., eps=0,
+                        disambig=(), max_states=100000):
+    """
+    Frame synchronous token passing Viterbi search through a (possibly lazy)
+    fst whose input labels are observation ids (e.g. a monophone fst
+    composed with a lexicon and a language model). Each non epsilon input
+    arc consumes one frame and is scored with the negative scaled log
+    likelihood of its observation id in that frame. Epsilon input arcs and
+    arcs with disambiguation input labels (e.g. the end of word self loops of
+    the monophone fst) are followed within a frame. Tokens worse than the
+    best token of a frame plus beam are pruned and at most max_active tokens
+    are expanded per frame. The arcs of the max_states most recently visited
+    states are kept split into emitting and non emitting arcs.
+
+    :param input_fst: fst providing start, final(state) and arcs(state)
+    :param log_likelihoods: NumPy array (frames x observations) with the
+                            observation log likelihoods of each frame
+    :param observation_labels: input label of each column of log_likelihoods
+                               (None: the column index is the input label)
+    :param beam: pruning beam
+    :param max_active: maximum number of tokens expanded per frame
+                       (None: no limit)
+    :param acoustic_scale: scale of the log likelihoods
+    :param eps: epsilon label
+    :param disambig: input labels which do not consume a frame
+    :param max_states: maximum number of states with split arcs kept in
+                       memory
+    :return: (weight, path) tuple of the best path ending in a final state
+             after the last frame, path is a list of ArrayArc tuples
+             (ilabel, olabel, weight, dst). None if no final state survived
+             the pruning.
+    """
+
+    if input_fst.start == -1:
+        return None
+
+    if observation_labels is None:
+        columns = None
+    else:
+        columns = {label: column
+                   for column, label in enumerate(observation_labels)}
+
+    non_emitting = set(disambig) | {eps}
+
+    # state: (non emitting arcs, [(column, arc)] of emitting arcs)
+    split_arcs = OrderedDict()
+
+    def get_split_arcs(state):
+        arcs = split_arcs.get(state)
+        if arcs is not None:
+            split_arcs.move_to_end(state)
+            return arcs
+
+        non_emitting_arcs = list()
+        emitting_arcs = list()
+        for arc in input_fst.arcs(state):
+            if arc.ilabel in non_emitting:
+                non_emitting_arcs.append(arc)
+            elif columns is None:
+                emitting_arcs.append((arc.ilabel, arc))
+            elif arc.ilabel in columns:
+                emitting_arcs.append((columns[arc.ilabel], arc))
+            else:
+                raise ValueError('Input label {} of state {} is not in '
+                                 'observation_labels'.format(arc.ilabel,
+                                                             state))
+        arcs = (non_emitting_arcs, emitting_arcs)
+        split_arcs[state] = arcs
+        if len(split_arcs) > max_states:
+            split_arcs.popitem(last=False)
+        return arcs
+
+    # tokens: state -> (cost, back pointer), back pointer: (arc, previous)
+    tokens = {input_fst.start: (0., None)}
+    _process_epsilon_arcs(tokens, get_split_arcs, beam)
+    for frame in np.asarray(log_likelihoods):
+        # only tokens in states with emitting arcs compete for max_active
+        tokens = [(cost, back_pointer, get_split_arcs(state)[1])
+                  for state, (cost, back_pointer) in tokens.items()
+                  if get_split_arcs(state)[1]]
+        cutoff = _get_cutoff([cost for cost, _, _ in tokens], beam,
+                             max_active)
+        frame_costs = (-acoustic_scale * frame).tolist()
+        next_tokens = dict()
+        next_cutoff = inf
+        for cost, back_pointer, emitting_arcs in tokens:
+            if cost > cutoff:
+                continue
+            for column, arc in emitting_arcs:
+                next_cost = cost + arc.weight + frame_costs[column]
+                if next_cost >= next_cutoff:
+                    continue
+                if next_cost + beam < next_cutoff:
+                    next_cutoff = next_cost + beam
+                token = next_tokens.get(arc.dst)
+                if token is None or next_cost < token[0]:
+                    next_tokens[arc.dst] = (next_cost, (arc, back_pointer))
+        tokens = next_tokens
+        _process_epsilon_arcs(tokens, get_split_arcs, beam)
+
+    best = None
+    for state, (cost, back_pointer) in tokens.items():
+        final_weight = input_fst.final(state)
+        if final_weight != inf and \
+                (best is None or cost + final_weight < best[0]):
+            best = (cost + final_weight, back_pointer)
+    if best is None:
+        return None
+
+    weight, back_pointer = best
+    path = list()
+    while back_pointer is not None:
+        arc, back_pointer = back_pointer
+        path.append(arc)
+    return weight, path[::-1]
+
+
+def _get_cutoff(costs, beam, max_active):
+    if not costs:
+        return inf
+    costs = np.array(costs)
+    cutoff = costs.min() + beam
+    if max_active is not None and len(costs) > max_active:
+        cutoff = min(cutoff, np.partition(costs, max_active - 1)[
+            max_active - 1])
+    return cutoff
+
+
+def _process_epsilon_arcs(tokens, get_split_arcs, beam):
+    if not tokens:
+        return
+    cutoff = min(cost for cost, _ in tokens.values()) + beam
+    queue = list(tokens)
+    while queue:
+        state = queue.pop()
+        cost, back_pointer = tokens[state]
+        for arc in get_split_arcs(state)[0]:
+            next_cost = cost + arc.weight
+            if next_cost > cutoff:
+                continue
+            token = tokens.get(arc.dst)
+            if token is None or next_cost < token[0]:
+                tokens[arc.dst] = (next_cost, (arc, back_pointer))
+                queue.append(arc.dst)
@@ -41,6 +41,8 @@
    Author: Oliver Walter
 */
 // ----------------------------------------------------------------------------
+#include <algorithm>
+#include <fstream>
 #include "Dictionary.hpp"
 
 /** construct dictionary **/
@@ -218,6 +220,95 @@ std::vector<std::vector<std::string>>
 }
 
 
+/** return character ids of all words with id >= FirstWordId (sorted by
+ *  word id) as compressed sparse rows: the characters of WordIds[i] are
+ *  CharacterIds[Offsets[i]] ... CharacterIds[Offsets[i + 1] - 1] **/
+void Dictionary::GetWordCharacterArrays(int FirstWordId,
+                                        std::vector<int> *WordIds,
+                                        std::vector<int> *Offsets,
+                                        std::vector<int> *CharacterIds) const
+{
+  WordIds->clear();
+  for (const auto& Word: Id2Word) {
+    if (Word.first >= FirstWordId) {
+      WordIds->push_back(Word.first);
+    }
+  }
+  std::sort(WordIds->begin(), WordIds->end());
+
+  Offsets->assign(1, 0);
+  Offsets->reserve(WordIds->size() + 1);
+  CharacterIds->clear();
+  for (const auto& WordId: *WordIds) {
+    const std::vector<int> &WordVector = Id2Word.find(WordId)->second;
+    CharacterIds->insert(CharacterIds->end(),
+                         WordVector.begin() + CHPYLMContextLength,
+                         WordVector.end() - 1);
+    Offsets->push_back(CharacterIds->size());
+  }
+}
+
+/** write symbol table in OpenFst text format (symbol id), the first
+ *  NumPrefixedSymbols symbols (characters) are prefixed with Prefix to
+ *  distinguish them from words, ids without symbol are skipped **/
+bool Dictionary::WriteSymbolTable(const std::string &FileName,
+                                  int NumPrefixedSymbols,
+                                  const std::string &Prefix) const
+{
+  std::ofstream SymbolTable(FileName);
+  for (int Id = 0; Id < MaxId; ++Id) {
+    Id2CharacterSequenceHashmap::const_iterator it =
+      Id2CharacterSequence.find(Id);
+    if (it == Id2CharacterSequence.end() || it->second.empty()) {
+      continue;
+    }
+    if (Id < NumPrefixedSymbols) {
+      SymbolTable << Prefix;
+    }
+    SymbolTable << it->second << ' ' << Id << '\n';
+  }
+  SymbolTable.close();
+  return !SymbolTable.fail();
+}
+
+/** write the words and their ids **/
+void Dictionary::Save(std::ostream &Stream) const
+{
+  WriteValue<int>(Stream, MaxId);
+  WriteVector(Stream, std::vector<int>(FreedIds.begin(), FreedIds.end()));
+  WriteValue<bool>(Stream, SortFreedIds);
+  WriteValue<uint64_t>(Stream, Id2Word.size());
+  for (Id2WordHashmap::const_iterator Word = Id2Word.begin(); Word != Id2Word.end(); ++Word) {
+    WriteValue<int>(Stream, Word->first);
+    WriteVector(Stream, std::vector<int>(Word->second.begin() + CHPYLMContextLength, Word->second.end() - 1));
+  }
+}
+
+/** replace the words by the ones written with Save **/
+void Dictionary::Load(std::istream &Stream)
+{
+  for (Id2WordHashmap::const_iterator Word = Id2Word.begin(); Word != Id2Word.end(); ++Word) {
+    Id2CharacterSequence.erase(Word->first);
+  }
+  Word2Id.clear();
+  Id2Word.clear();
+
+  MaxId = ReadValue<int>(Stream);
+  std::vector<int> FreedIdsVector = ReadVector<int>(Stream);
+  FreedIds.assign(FreedIdsVector.begin(), FreedIdsVector.end());
+  SortFreedIds = ReadValue<bool>(Stream);
+  uint64_t NumWords = ReadValue<uint64_t>(Stream);
+  for (uint64_t WordIdx = 0; WordIdx < NumWords; WordIdx++) {
+    int WordId = ReadValue<int>(Stream);
+    std::vector<int> WordVector = ReadVector<int>(Stream);
+    Word2Id[WordVector] = WordId;
+    Id2Word[WordId] = std::vector<int>(CHPYLMContextLength, EOW);
+    Id2Word[WordId].insert(Id2Word[WordId].end(), WordVector.begin(), WordVector.end());
+    Id2Word[WordId].push_back(EOW);
+    AddWordToId2CharacterSequence(WordVector.begin(), WordVector.size(), WordId);
+  }
+}
+
 /** return maximum numer of words **/
 int Dictionary::GetMaxNumWords() const
 {
@@ -94,6 +94,13 @@ public:
   int GetMaxNumWords() const;                                                                         // return maximum number of words
   int GetWordsBegin() const;                                                                          // get first word id
   const std::vector<int> &GetWordVector(int WordId) const;                                            // return stored word vector from lexicon
+  void GetWordCharacterArrays(int FirstWordId, std::vector<int> *WordIds,
+                              std::vector<int> *Offsets,
+                              std::vector<int> *CharacterIds) const;                                  // return character ids of all words as compressed sparse rows
+  bool WriteSymbolTable(const std::string &FileName, int NumPrefixedSymbols,
+                        const std::string &Prefix) const;                                             // write OpenFst text symbol table
+  void Save(std::ostream &Stream) const;                                                              // write the words and their ids
+  void Load(std::istream &Stream);                                                                    // replace the words by the ones written with Save
 };
 
 #endif
@@ -41,7 +41,11 @@
    Author: Oliver Walter
 */
 // ----------------------------------------------------------------------------
+#include <algorithm>
 #include <chrono>
+#include <numeric>
+#include <sstream>
+#include <stdexcept>
 #include "HPYLM.hpp"
 
 std::default_random_engine HPYLM::RandomGenerator(std::chrono::system_clock::now().time_since_epoch().count());
@@ -155,11 +159,14 @@ WordRemoveStatus HPYLM::RemoveWordRecursively(const const_witerator &Word, unsig
 {
   /* check if end of tree is reached */
   if (level < Order) {
-    /* find restaurant for given context and recursively remove word from the tree */
+    /* find restaurant for given context and recursively remove word from the tree
+     * (the context may be missing or may not hold the word if it has been pruned) */
     ContextsHashmap::iterator it = CurrentRestaurant->NextContext.find(*(Word - level));
-    if (RemoveWordRecursively(Word, level + 1, it->second) == NONEREMOVED) {
-      /* finish recursive removing */
-      return NONEREMOVED;
+    if ((it != CurrentRestaurant->NextContext.end()) && (it->second->ThisRestaurant.GetWordCount(*Word) > 0)) {
+      if (RemoveWordRecursively(Word, level + 1, it->second) == NONEREMOVED) {
+        /* finish recursive removing */
+        return NONEREMOVED;
+      }
     }
   }
 //   /* debug */
@@ -186,6 +193,86 @@ WordRemoveStatus HPYLM::RemoveWordRecursively(const const_witerator &Word, unsig
   return Removed;
 }
 
+unsigned int HPYLM::AddWords(const const_witerator &Word, double BaseProbability, unsigned int NumCustomers, bool *AddedToBase)
+{
+  *AddedToBase = false;
+
+  /* find or create the restaurants of all contexts of the word (shortest
+   * first) and get their base probabilities */
+  std::vector<ContextRestaurant *> Restaurants(1, &RestaurantTree);
+  std::vector<double> BaseProbabilities(1, BaseProbability);
+  for (unsigned int level = 1; level < Order; level++) {
+    ContextRestaurant *CurrentRestaurant = Restaurants.back();
+    BaseProbabilities.push_back(CurrentRestaurant->ThisRestaurant.WordProbability(*Word, BaseProbabilities.back()));
+    ContextsHashmap::iterator it = CurrentRestaurant->NextContext.find(*(Word - level));
+    if (it == CurrentRestaurant->NextContext.end()) {
+      int ContextId = GetNextAvailableContextId();
+      ContextRestaurant *NextContext = new ContextRestaurant(Parameters.Discount[level], Parameters.Concentration[level], CurrentRestaurant, ContextId, std::vector<int>(Word - level, Word));
+      ContextIdToContext.insert(std::make_pair(ContextId, NextContext));
+      it = CurrentRestaurant->NextContext.insert(std::make_pair(*(Word - level), NextContext)).first;
+    }
+    Restaurants.push_back(it->second);
+  }
+
+  for (unsigned int Customer = 0; Customer < NumCustomers; Customer++) {
+    /* seat the customer in the longest context, a new table sends a
+     * customer to the next shorter context */
+    int level = Restaurants.size() - 1;
+    while ((level >= 0) && Restaurants[level]->ThisRestaurant.IncrementWordCount(*Word, BaseProbabilities[level])) {
+      level--;
+    }
+    if (level < 0) {
+      *AddedToBase = true;
+      return Customer + 1;
+    }
+
+    /* the base probabilities of the longer contexts changed */
+    for (unsigned int NextLevel = level + 1; NextLevel < Restaurants.size(); NextLevel++) {
+      BaseProbabilities[NextLevel] = Restaurants[NextLevel - 1]->ThisRestaurant.WordProbability(*Word, BaseProbabilities[NextLevel - 1]);
+    }
+  }
+  return NumCustomers;
+}
+
+unsigned int HPYLM::RemoveWords(const const_witerator &Word, unsigned int NumCustomers)
+{
+  if (NumCustomers == 0) {
+    return 0;
+  }
+  return RemoveWordsRecursively(Word, 1, &RestaurantTree, NumCustomers);
+}
+
+unsigned int HPYLM::RemoveWordsRecursively(const const_witerator &Word, unsigned int level, ContextRestaurant *CurrentRestaurant, unsigned int NumCustomers)
+{
+  /* check if end of tree is reached */
+  if (level < Order) {
+    /* remove the customers held by the longer context (it may be missing or
+     * hold fewer customers if it has been pruned), the others and the
+     * removed tables of the longer context are removed from this one */
+    ContextsHashmap::iterator it = CurrentRestaurant->NextContext.find(*(Word - level));
+    if (it != CurrentRestaurant->NextContext.end()) {
+      unsigned int NextNumCustomers = std::min<unsigned int>(NumCustomers, it->second->ThisRestaurant.GetWordCount(*Word));
+      if (NextNumCustomers > 0) {
+        NumCustomers = NumCustomers - NextNumCustomers + RemoveWordsRecursively(Word, level + 1, it->second, NextNumCustomers);
+      }
+    }
+    if (NumCustomers == 0) {
+      return 0;
+    }
+  }
+  unsigned int NumRemovedTables = CurrentRestaurant->ThisRestaurant.RemoveCustomers(*Word, NumCustomers);
+
+  /* remove current context (and the reference to it from the previous one) if it became empty */
+  if ((CurrentRestaurant->ThisRestaurant.GetTotalWordCount() == 0) && (level != 1)) {
+    CurrentRestaurant->PreviousContext->NextContext.erase(*(Word - level + 1));
+    ContextIdToContext.erase(CurrentRestaurant->ContextId);
+    FreedIds.push_back(CurrentRestaurant->ContextId);
+    SortFreedIds = true;
+    delete CurrentRestaurant;
+  }
+  return NumRemovedTables;
+}
+
 double HPYLM::WordProbability(const const_witerator &Word, double BaseProbability) const
 {
   return WordProbabilityRecursively(Word, 1, RestaurantTree, BaseProbability);
@@ -470,6 +557,186 @@ void HPYLM::SetDiscount(int Level, double Value)
   Parameters.Discount[Level] = Value;
 }
 
+std::vector< int > HPYLM::GetPrunedContextMap(unsigned int MinCustomers, double Threshold, const google::dense_hash_map< int, double > &BaseProbabilities)
+{
+  std::vector<int> BackoffContextIds(NextUnusedContextId);
+  std::iota(BackoffContextIds.begin(), BackoffContextIds.end(), 0);
+  PruneContextsRecursively(1, &RestaurantTree, MinCustomers, Threshold, BaseProbabilities, false, &BackoffContextIds);
+
+  /* follow the backoff chain to the first context which has not been pruned */
+  for (std::vector<int>::iterator ContextId = BackoffContextIds.begin(); ContextId != BackoffContextIds.end(); ++ContextId) {
+    while (BackoffContextIds[*ContextId] != *ContextId) {
+      *ContextId = BackoffContextIds[*ContextId];
+    }
+  }
+  return BackoffContextIds;
+}
+
+void HPYLM::PruneContexts(unsigned int MinCustomers, double Threshold, const google::dense_hash_map< int, double > &BaseProbabilities)
+{
+  PruneContextsRecursively(1, &RestaurantTree, MinCustomers, Threshold, BaseProbabilities, true, nullptr);
+}
+
+bool HPYLM::PruneContextsRecursively(unsigned int level, HPYLM::ContextRestaurant *CurrentRestaurant, unsigned int MinCustomers, double Threshold, const google::dense_hash_map< int, double > &BaseProbabilities, bool InPlace, std::vector< int > *BackoffContextIds)
+{
+  /* prune longer contexts first, a context can only be pruned if all longer contexts are pruned */
+  bool AllNextContextsPruned = true;
+  std::vector<int> PrunedNextContexts;
+  for (ContextsHashmap::iterator NextContextIterator = CurrentRestaurant->NextContext.begin(); NextContextIterator != CurrentRestaurant->NextContext.end(); ++NextContextIterator) {
+    if (PruneContextsRecursively(level + 1, NextContextIterator->second, MinCustomers, Threshold, BaseProbabilities, InPlace, BackoffContextIds)) {
+      PrunedNextContexts.push_back(NextContextIterator->first);
+    } else {
+      AllNextContextsPruned = false;
+    }
+  }
+
+  /* remove pruned contexts after their customers have been moved to the current context */
+  if (InPlace) {
+    for (std::vector<int>::const_iterator NextContextKey = PrunedNextContexts.begin(); NextContextKey != PrunedNextContexts.end(); ++NextContextKey) {
+      ContextsHashmap::iterator NextContextIterator = CurrentRestaurant->NextContext.find(*NextContextKey);
+      ContextRestaurant *PrunedRestaurant = NextContextIterator->second;
+      CurrentRestaurant->NextContext.erase(NextContextIterator);
+      ContextIdToContext.erase(PrunedRestaurant->ContextId);
+      FreedIds.push_back(PrunedRestaurant->ContextId);
+      SortFreedIds = true;
+      delete PrunedRestaurant;
+    }
+  }
+
+  /* the root context is never pruned */
+  if ((level == 1) || !AllNextContextsPruned) {
+    return false;
+  }
+
+  if ((CurrentRestaurant->ThisRestaurant.GetTotalWordCount() >= MinCustomers) && (BackoffRelativeEntropy(*CurrentRestaurant, BaseProbabilities) >= Threshold)) {
+    return false;
+  }
+
+  if (InPlace) {
+    /* fold the customers into the backoff context: each table already is a customer there */
+    std::vector<std::pair<int, int> > NumCustomersOnTables = CurrentRestaurant->ThisRestaurant.GetNumCustomersOnTables();
+    for (std::vector<std::pair<int, int> >::const_iterator Word = NumCustomersOnTables.begin(); Word != NumCustomersOnTables.end(); ++Word) {
+      CurrentRestaurant->PreviousContext->ThisRestaurant.AddCustomersToExistingTables(Word->first, Word->second);
+    }
+  } else {
+    (*BackoffContextIds)[CurrentRestaurant->ContextId] = CurrentRestaurant->PreviousContext->ContextId;
+  }
+  return true;
+}
+
+double HPYLM::BackoffRelativeEntropy(const HPYLM::ContextRestaurant &CurrentRestaurant, const google::dense_hash_map< int, double > &BaseProbabilities) const
+{
+  /* get probabilities of the words in the context in the backoff context */
+  std::vector<int> Words = CurrentRestaurant.ThisRestaurant.GetWords(std::vector<bool>());
+  std::vector<double> BackoffProbabilities;
+  BackoffProbabilities.reserve(Words.size());
+  for (std::vector<int>::const_iterator Word = Words.begin(); Word != Words.end(); ++Word) {
+    google::dense_hash_map<int, double>::const_iterator it = BaseProbabilities.find(*Word);
+    BackoffProbabilities.push_back((it != BaseProbabilities.end()) ? it->second : 0);
+  }
+  WordVectorProbability(CurrentRestaurant.PreviousContext->ContextSequence, Words, &BackoffProbabilities);
+
+  /* relative entropy D(p(.|context) || p(.|backoff context)):
+   * words not in the context have the constant ratio of the backoff weight */
+  double RelativeEntropy = 0;
+  double BackoffProbabilitySum = 0;
+  for (unsigned int IdxWord = 0; IdxWord < Words.size(); IdxWord++) {
+    double Probability = CurrentRestaurant.ThisRestaurant.WordProbability(Words[IdxWord], BackoffProbabilities[IdxWord]);
+    if ((Probability > 0) && (BackoffProbabilities[IdxWord] > 0)) {
+      RelativeEntropy += Probability * log(Probability / BackoffProbabilities[IdxWord]);
+    }
+    BackoffProbabilitySum += BackoffProbabilities[IdxWord];
+  }
+  double BackoffWeight = CurrentRestaurant.ThisRestaurant.WordProbability(PHI, 0);
+  double UnseenProbability = BackoffWeight * std::max(0.0, 1 - BackoffProbabilitySum);
+  if ((UnseenProbability > 0) && (BackoffWeight > 0)) {
+    RelativeEntropy += UnseenProbability * log(BackoffWeight);
+  }
+  return RelativeEntropy;
+}
+
+void HPYLM::Save(std::ostream &Stream) const
+{
+  WriteValue<unsigned int>(Stream, Order);
+  WriteVector(Stream, Parameters.Discount);
+  WriteVector(Stream, Parameters.Concentration);
+  WriteVector(Stream, BaseProbabilitiesScale);
+  WriteValue<int>(Stream, NextUnusedContextId);
+  WriteVector(Stream, std::vector<int>(FreedIds.begin(), FreedIds.end()));
+  WriteValue<bool>(Stream, SortFreedIds);
+  SaveRestaurantTreeRecursively(Stream, RestaurantTree);
+}
+
+void HPYLM::SaveRestaurantTreeRecursively(std::ostream &Stream, const HPYLM::ContextRestaurant &CurrentRestaurant) const
+{
+  CurrentRestaurant.ThisRestaurant.Save(Stream);
+  WriteValue<uint64_t>(Stream, CurrentRestaurant.NextContext.size());
+  for (ContextsHashmap::const_iterator NextContext = CurrentRestaurant.NextContext.begin(); NextContext != CurrentRestaurant.NextContext.end(); ++NextContext) {
+    WriteValue<int>(Stream, NextContext->second->ContextId);
+    WriteVector(Stream, NextContext->second->ContextSequence);
+    SaveRestaurantTreeRecursively(Stream, *NextContext->second);
+  }
+}
+
+void HPYLM::Load(std::istream &Stream)
+{
+  if (ReadValue<unsigned int>(Stream) != Order) {
+    throw std::runtime_error("HPYLM state has a different order");
+  }
+  /* the restaurants hold references to the parameters, so they are
+   * overwritten in place */
+  std::vector<double> Discount = ReadVector<double>(Stream);
+  std::vector<double> Concentration = ReadVector<double>(Stream);
+  std::copy(Discount.begin(), Discount.end(), Parameters.Discount.begin());
+  std::copy(Concentration.begin(), Concentration.end(), Parameters.Concentration.begin());
+  BaseProbabilitiesScale = ReadVector<double>(Stream);
+  NextUnusedContextId = ReadValue<int>(Stream);
+  std::vector<int> FreedIdsVector = ReadVector<int>(Stream);
+  FreedIds.assign(FreedIdsVector.begin(), FreedIdsVector.end());
+  SortFreedIds = ReadValue<bool>(Stream);
+
+  /* replace the restaurant tree */
+  DestructRestaurantTreeRecursively(&RestaurantTree);
+  RestaurantTree.NextContext.clear();
+  ContextIdToContext.clear();
+  ContextIdToContext.insert(std::make_pair(RestaurantTree.ContextId, &RestaurantTree));
+  LoadRestaurantTreeRecursively(Stream, 0, &RestaurantTree);
+}
+
+void HPYLM::LoadRestaurantTreeRecursively(std::istream &Stream, unsigned int level, HPYLM::ContextRestaurant *CurrentRestaurant)
+{
+  CurrentRestaurant->ThisRestaurant.Load(Stream);
+  uint64_t NumNextContexts = ReadValue<uint64_t>(Stream);
+  for (uint64_t ContextIdx = 0; ContextIdx < NumNextContexts; ContextIdx++) {
+    int ContextId = ReadValue<int>(Stream);
+    std::vector<int> ContextSequence = ReadVector<int>(Stream);
+    ContextRestaurant *NextContext = new ContextRestaurant(Parameters.Discount[level + 1], Parameters.Concentration[level + 1], CurrentRestaurant, ContextId, ContextSequence);
+    ContextIdToContext.insert(std::make_pair(ContextId, NextContext));
+    CurrentRestaurant->NextContext.insert(std::make_pair(ContextSequence.front(), NextContext));
+    LoadRestaurantTreeRecursively(Stream, level + 1, NextContext);
+  }
+}
+
+void HPYLM::SaveRandomState(std::ostream &Stream)
+{
+  std::ostringstream State;
+  State << RandomGenerator << ' ' << GammaDistribution << ' ' << DiscreteDistribution;
+  WriteString(Stream, State.str());
+}
+
+void HPYLM::LoadRandomState(std::istream &Stream)
+{
+  std::istringstream State(ReadString(Stream));
+  State >> RandomGenerator >> GammaDistribution >> DiscreteDistribution;
+}
+
+void HPYLM::SeedRandomState(unsigned int Seed)
+{
+  RandomGenerator.seed(Seed);
+  GammaDistribution.reset();
+  DiscreteDistribution.reset();
+}
+
 HPYLM::ContextRestaurant::ContextRestaurant(const double &Discount_, const double &Concentration_, ContextRestaurant *PreviousContext_, int ContextId_, const std::vector< int > &ContextSequence_) :
   ContextId(ContextId_),
   ContextSequence(ContextSequence_),
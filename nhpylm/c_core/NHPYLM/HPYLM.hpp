@@ -170,6 +170,15 @@ class HPYLM {
     double BaseProbability
   );
 
+  // internal function to recursively remove customers of a word from the
+  // restaurant tree, returns the number of removed tables in CurrentRestaurant
+  unsigned int RemoveWordsRecursively(
+    const const_witerator &Word,
+    unsigned int level,
+    HPYLM::ContextRestaurant *CurrentRestaurant,
+    unsigned int NumCustomers
+  );
+
   // internal function to get the next availabe context id
   int GetNextAvailableContextId();
 
@@ -250,6 +259,38 @@ class HPYLM {
     const std::vector< double > &BaseProbabilities
   ) const;
 
+  // internal function to calculate the relative entropy between the
+  // distribution of a context and the distribution of its backoff context
+  double BackoffRelativeEntropy(
+    const HPYLM::ContextRestaurant &CurrentRestaurant,
+    const google::dense_hash_map< int, double > &BaseProbabilities
+  ) const;
+
+  // internal function to recursively find (and optionally remove) contexts
+  // which can be pruned, returns true if the current context was pruned
+  bool PruneContextsRecursively(
+    unsigned int level,
+    HPYLM::ContextRestaurant *CurrentRestaurant,
+    unsigned int MinCustomers,
+    double Threshold,
+    const google::dense_hash_map< int, double > &BaseProbabilities,
+    bool InPlace,
+    std::vector< int > *BackoffContextIds
+  );
+
+  // internal function to recursively write the restaurant tree
+  void SaveRestaurantTreeRecursively(
+    std::ostream &Stream,
+    const HPYLM::ContextRestaurant &CurrentRestaurant
+  ) const;
+
+  // internal function to recursively read the restaurant tree
+  void LoadRestaurantTreeRecursively(
+    std::istream &Stream,
+    unsigned int level,
+    HPYLM::ContextRestaurant *CurrentRestaurant
+  );
+
 public:
   /* constructors/destructors */
   // construct hpylm of given order
@@ -269,6 +310,24 @@ public:
     const const_witerator &Word
   );
 
+  // add up to NumCustomers customers of a word to the hpylm. The customers
+  // are seated one after another until one is added to the base
+  // distribution (AddedToBase is set), so that the caller can update the
+  // base probability. Returns the number of added customers.
+  unsigned int AddWords(
+    const const_witerator &Word,
+    double BaseProbability,
+    unsigned int NumCustomers,
+    bool *AddedToBase
+  );
+
+  // remove NumCustomers customers of a word from the hpylm, returns the
+  // number of customers removed from the base distribution
+  unsigned int RemoveWords(
+    const const_witerator &Word,
+    unsigned int NumCustomers
+  );
+
   // calculate the probability of a word in the hpylm
   double WordProbability(
     const const_witerator &Word,
@@ -348,6 +407,50 @@ public:
     int Level,
     double Value
   );
+
+  // get map from context id to the context id used after pruning
+  // contexts with less than MinCustomers customers or a relative
+  // entropy to their backoff context below Threshold
+  std::vector< int > GetPrunedContextMap(
+    unsigned int MinCustomers,
+    double Threshold,
+    const google::dense_hash_map< int, double > &BaseProbabilities
+  );
+
+  // remove contexts with less than MinCustomers customers or a relative
+  // entropy to their backoff context below Threshold, the customers of
+  // removed contexts are moved to their backoff context
+  void PruneContexts(
+    unsigned int MinCustomers,
+    double Threshold,
+    const google::dense_hash_map< int, double > &BaseProbabilities
+  );
+
+  // write the parameters and the restaurant tree
+  void Save(
+    std::ostream &Stream
+  ) const;
+
+  // replace the parameters and the restaurant tree by the ones written
+  // with Save (of a hpylm with the same order)
+  void Load(
+    std::istream &Stream
+  );
+
+  // write the state of the random generator and distributions
+  static void SaveRandomState(
+    std::ostream &Stream
+  );
+
+  // restore the state written with SaveRandomState
+  static void LoadRandomState(
+    std::istream &Stream
+  );
+
+  // seed the random generator and reset the distributions
+  static void SeedRandomState(
+    unsigned int Seed
+  );
 };
 
 #endif
\ No newline at end of file
@@ -41,10 +41,20 @@
    Author: Oliver Walter
 */
 // ----------------------------------------------------------------------------
+#include <algorithm>
+#include <atomic>
+#include <chrono>
 #include <iomanip>
 #include <iostream>
+#include <limits>
+#include <numeric>
+#include <sstream>
+#include <stdexcept>
+#include <thread>
 #include "NHPYLM.hpp"
 
+std::default_random_engine NHPYLM::RandomGenerator(std::chrono::system_clock::now().time_since_epoch().count());
+
 NHPYLM::NHPYLM(
   unsigned int CHPYLMOrder_,
   unsigned int WHPYLMOrder_,
@@ -210,6 +220,81 @@ void NHPYLM::RemoveCharacterSequenceFromCHPYLM(const std::vector<int> &Character
   WHPYLMBaseProbabilities.clear();
 }
 
+void NHPYLM::AddWordToLm(const const_witerator &Word, unsigned int NumCopies)
+{
+  const std::vector<int> *CharacterSequence = nullptr;
+  if ((NumCharacters > 0) && (CHPYLMOrder > 0)) {
+    CharacterSequence = &GetWordVector(*Word);
+  }
+
+  /* seat the copies in the word model until one is added to the base
+   * distribution, which changes the base probability of the word */
+  while (NumCopies > 0) {
+    double BaseProbability;
+    if ((WordBaseProbability == 0.0) && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
+      BaseProbability = exp(CHPYLM.WordSequenceLoglikelihood(*CharacterSequence, CHPYLMBaseProbabilities));
+    } else {
+      BaseProbability = WordBaseProbability;
+    }
+    bool AddedToBase;
+    NumCopies -= WHPYLM.AddWords(Word, BaseProbability, NumCopies, &AddedToBase);
+    if (AddedToBase && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
+      AddCharacterSequenceToCHPYLM(*CharacterSequence);
+    }
+  }
+}
+
+void NHPYLM::RemoveWordFromLm(const const_witerator &Word, unsigned int NumCopies)
+{
+  unsigned int NumBaseCustomers = WHPYLM.RemoveWords(Word, NumCopies);
+  if ((NumBaseCustomers > 0) && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
+    RemoveCharacterSequenceFromCHPYLM(GetWordVector(*Word), NumBaseCustomers);
+  }
+}
+
+void NHPYLM::AddWordSequenceToLm(const std::vector< int > &WordSequence, unsigned int NumCopies)
+{
+  for (const_witerator it = WordSequence.begin() + WHPYLMOrder - 1; it != WordSequence.end(); ++it) {
+    AddWordToLm(it, NumCopies);
+  }
+}
+
+void NHPYLM::RemoveWordSequenceFromLm(const std::vector< int > &WordSequence, unsigned int NumCopies)
+{
+  for (const_witerator it = WordSequence.begin() + WHPYLMOrder - 1; it != WordSequence.end(); ++it) {
+    RemoveWordFromLm(it, NumCopies);
+  }
+}
+
+void NHPYLM::AddWordSequencesToLm(
+  const std::vector<int> &WordIds,
+  const std::vector<int> &SequenceOffsets,
+  const std::vector<int> &Counts,
+  bool Remove
+)
+{
+  for (unsigned int SequenceId = 0; SequenceId + 1 < SequenceOffsets.size(); SequenceId++) {
+    std::vector<int> WordSequence(WordIds.begin() + SequenceOffsets[SequenceId],
+                                  WordIds.begin() + SequenceOffsets[SequenceId + 1]);
+    if (Remove) {
+      RemoveWordSequenceFromLm(WordSequence, Counts[SequenceId]);
+    } else {
+      AddWordSequenceToLm(WordSequence, Counts[SequenceId]);
+    }
+  }
+}
+
+void NHPYLM::RemoveCharacterSequenceFromCHPYLM(const std::vector<int> &CharacterSequence, unsigned int NumCopies)
+{
+  /* remove the copies of each character of a word from the character language model */
+  for (const_citerator it = CharacterSequence.begin() + CHPYLMOrder - 1; it != CharacterSequence.end(); ++it) {
+    CHPYLM.RemoveWords(it, NumCopies);
+  }
+
+  /* reset word base probabilities */
+  WHPYLMBaseProbabilities.clear();
+}
+
 double NHPYLM::WordProbability(const const_witerator &Word) const
 {
   /* get base probability for character sequence represting word and calculate word probability */
@@ -291,6 +376,82 @@ double NHPYLM::WordSequenceLoglikelihood(const std::vector< int > &WordSequence)
   return WHPYLM.WordSequenceLoglikelihood(WordSequence, WHPYLMBaseProbabilities);
 }
 
+std::vector<double> NHPYLM::WordSequencesLoglikelihoods(
+  const std::vector< int > &WordIds,
+  const std::vector< int > &SequenceOffsets,
+  unsigned int NumThreads
+) const
+{
+  return WordSequencesLoglikelihoods(WordIds, SequenceOffsets, std::vector<int>(), std::vector<int>(1, 0), NumThreads);
+}
+
+std::vector<double> NHPYLM::WordSequencesLoglikelihoods(
+  const std::vector< int > &WordIds,
+  const std::vector< int > &SequenceOffsets,
+  const std::vector< int > &UnknownCharacters,
+  const std::vector< int > &UnknownOffsets,
+  unsigned int NumThreads
+) const
+{
+  if (SequenceOffsets.size() < 2) {
+    return std::vector<double>();
+  }
+  unsigned int NumSequences = SequenceOffsets.size() - 1;
+  std::lock_guard<std::mutex> lck(mtx);
+
+  /* calculate base probabilities of the unknown words, their ids are not
+   * used by any word in the dictionary or the restaurants */
+  int UnknownWordsBegin = GetMaxNumWords();
+  for (unsigned int UnknownWordIdx = 0; UnknownWordIdx + 1 < UnknownOffsets.size(); UnknownWordIdx++) {
+    double BaseProbability = WordBaseProbability;
+    if ((WordBaseProbability == 0.0) && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
+      std::vector<int> CharacterSequence(CHPYLMOrder - 1, EOW);
+      CharacterSequence.insert(CharacterSequence.end(), UnknownCharacters.begin() + UnknownOffsets[UnknownWordIdx],
+                               UnknownCharacters.begin() + UnknownOffsets[UnknownWordIdx + 1]);
+      CharacterSequence.push_back(EOW);
+      BaseProbability = exp(CHPYLM.WordSequenceLoglikelihood(CharacterSequence, CHPYLMBaseProbabilities));
+    }
+    WHPYLMBaseProbabilities[UnknownWordsBegin + UnknownWordIdx] = BaseProbability;
+  }
+
+  /* calculate base probabilities (the cache is not modified afterwards) */
+  for (const_witerator Word = WordIds.begin(); Word != WordIds.end(); ++Word) {
+    if (WHPYLMBaseProbabilities.find(*Word) != WHPYLMBaseProbabilities.end()) {
+      continue;
+    }
+    if ((WordBaseProbability == 0.0) && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
+      WHPYLMBaseProbabilities.insert(std::make_pair(*Word, exp(CHPYLM.WordSequenceLoglikelihood(GetWordVector(*Word), CHPYLMBaseProbabilities))));
+    } else {
+      WHPYLMBaseProbabilities.insert(std::make_pair(*Word, WordBaseProbability));
+    }
+  }
+
+  /* calculate the sequence log likelihoods in parallel */
+  std::vector<double> Loglikelihoods(NumSequences);
+  std::atomic<unsigned int> NextSequenceId(0);
+  auto CalculateLoglikelihoods = [&]() {
+    for (unsigned int SequenceId = NextSequenceId++; SequenceId < NumSequences; SequenceId = NextSequenceId++) {
+      std::vector<int> WordSequence(WordIds.begin() + SequenceOffsets[SequenceId],
+                                    WordIds.begin() + SequenceOffsets[SequenceId + 1]);
+      Loglikelihoods[SequenceId] = WHPYLM.WordSequenceLoglikelihood(WordSequence, WHPYLMBaseProbabilities);
+    }
+  };
+  std::vector<std::thread> Threads;
+  for (unsigned int ThreadIdx = 1; ThreadIdx < std::min(NumThreads, NumSequences); ThreadIdx++) {
+    Threads.push_back(std::thread(CalculateLoglikelihoods));
+  }
+  CalculateLoglikelihoods();
+  for (std::vector<std::thread>::iterator Thread = Threads.begin(); Thread != Threads.end(); ++Thread) {
+    Thread->join();
+  }
+
+  /* the ids of the unknown words may be given to new words later */
+  for (unsigned int UnknownWordIdx = 0; UnknownWordIdx + 1 < UnknownOffsets.size(); UnknownWordIdx++) {
+    WHPYLMBaseProbabilities.erase(UnknownWordsBegin + UnknownWordIdx);
+  }
+  return Loglikelihoods;
+}
+
 void NHPYLM::ResampleHyperParameters()
 {
   if ((WordBaseProbability == 0.0) && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
@@ -612,6 +773,533 @@ void NHPYLM::SetParameter(const std::string &LM, const std::string &Parameter, i
   }
 }
 
+void NHPYLM::UpdateWHPYLMBaseProbabilities() const
+{
+  std::lock_guard<std::mutex> lck(mtx);
+
+  for (Id2WordHashmap::const_iterator Id2Word = GetId2Word().begin(); Id2Word != GetId2Word().end(); ++Id2Word) {
+    if ((WordBaseProbability == 0.0) && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
+      if (WHPYLMBaseProbabilities.find(Id2Word->first) == WHPYLMBaseProbabilities.end()) {
+        WHPYLMBaseProbabilities.insert(std::make_pair(Id2Word->first, exp(CHPYLM.WordSequenceLoglikelihood(Id2Word->second, CHPYLMBaseProbabilities))));
+      }
+    } else {
+      WHPYLMBaseProbabilities.insert(std::make_pair(Id2Word->first, WordBaseProbability));
+    }
+  }
+}
+
+std::vector<int> NHPYLM::GetPrunedContextMap(const std::string &LM, unsigned int MinCustomers, double Threshold)
+{
+  int WordContextIdOffset = GetRootContextId();
+  std::vector<int> ContextMap(GetFinalContextId() + 1);
+  std::iota(ContextMap.begin(), ContextMap.end(), 0);
+
+  if ((LM == "CHPYLM") && (WordContextIdOffset > 0)) {
+    std::vector<int> CHPYLMContextMap = CHPYLM.GetPrunedContextMap(MinCustomers, Threshold, CHPYLMBaseProbabilities);
+    std::copy(CHPYLMContextMap.begin(), CHPYLMContextMap.end(), ContextMap.begin());
+  } else if (LM == "WHPYLM") {
+    UpdateWHPYLMBaseProbabilities();
+    std::vector<int> WHPYLMContextMap = WHPYLM.GetPrunedContextMap(MinCustomers, Threshold, WHPYLMBaseProbabilities);
+    for (unsigned int ContextId = 0; ContextId < WHPYLMContextMap.size(); ContextId++) {
+      ContextMap[ContextId + WordContextIdOffset] = WHPYLMContextMap[ContextId] + WordContextIdOffset;
+    }
+  }
+  return ContextMap;
+}
+
+void NHPYLM::PruneContexts(const std::string &LM, unsigned int MinCustomers, double Threshold)
+{
+  if ((LM == "CHPYLM") && (GetRootContextId() > 0)) {
+    CHPYLM.PruneContexts(MinCustomers, Threshold, CHPYLMBaseProbabilities);
+
+    /* reset word base probabilities */
+    WHPYLMBaseProbabilities.clear();
+  } else if (LM == "WHPYLM") {
+    UpdateWHPYLMBaseProbabilities();
+    WHPYLM.PruneContexts(MinCustomers, Threshold, WHPYLMBaseProbabilities);
+  }
+}
+
+double NHPYLM::GetWHPYLMBaseProbability(int WordId) const
+{
+  if ((WordBaseProbability == 0.0) && (NumCharacters > 0) && (CHPYLMOrder > 0)) {
+    std::lock_guard<std::mutex> lck(mtx);
+    google::dense_hash_map<int, double>::const_iterator it = WHPYLMBaseProbabilities.find(WordId);
+    if (it == WHPYLMBaseProbabilities.end()) {
+      double BaseProbability = exp(CHPYLM.WordSequenceLoglikelihood(GetWordVector(WordId), CHPYLMBaseProbabilities));
+      WHPYLMBaseProbabilities.insert(std::make_pair(WordId, BaseProbability));
+      return BaseProbability;
+    }
+    return it->second;
+  } else {
+    return WordBaseProbability;
+  }
+}
+
+void NHPYLM::GetSubstringBaseProbabilities(const const_citerator &Sentence, unsigned int SentenceLength, unsigned int MaxLength, std::vector<double> *BaseProbabilities) const
+{
+  const unsigned int NumLengths = MaxLength + 1;
+  BaseProbabilities->assign((SentenceLength + 1) * NumLengths, 0);
+  if (!((WordBaseProbability == 0.0) && (NumCharacters > 0) && (CHPYLMOrder > 0))) {
+    for (unsigned int End = 1; End <= SentenceLength; End++) {
+      for (unsigned int Length = 1; Length <= std::min(MaxLength, End); Length++) {
+        BaseProbabilities->at(End * NumLengths + Length) = WordBaseProbability;
+      }
+    }
+    return;
+  }
+
+  const std::vector<double> &BaseProbabilitiesScale = CHPYLM.GetBaseProbabilitiesScale();
+  const double EOWBaseProbability = CHPYLMBaseProbabilities.find(EOW)->second;
+  std::vector<int> CharacterSequence(CHPYLMOrder + MaxLength, EOW);
+  const citerator WordBegin = CharacterSequence.begin() + CHPYLMOrder - 1;
+  for (unsigned int Begin = 0; Begin < SentenceLength; Begin++) {
+    unsigned int MaxEnd = std::min(Begin + MaxLength, SentenceLength);
+    std::copy(Sentence + Begin, Sentence + MaxEnd, WordBegin);
+
+    /* walk through the characters of the longest substring and end
+     * the word after each character */
+    double Loglikelihood = 0;
+    for (unsigned int Length = 1; Length <= MaxEnd - Begin; Length++) {
+      citerator Character = WordBegin + Length - 1;
+      Loglikelihood += log(CHPYLM.WordProbability(Character, CHPYLMBaseProbabilities.find(*Character)->second));
+
+      int NextCharacter = *(Character + 1);
+      *(Character + 1) = EOW;
+      double BaseProbability = exp(Loglikelihood) * CHPYLM.WordProbability(Character + 1, EOWBaseProbability);
+      *(Character + 1) = NextCharacter;
+      if (!BaseProbabilitiesScale.empty()) {
+        BaseProbability *= (BaseProbabilitiesScale.size() > Length + 1) ? BaseProbabilitiesScale[Length + 1] : 0;
+      }
+      BaseProbabilities->at((Begin + Length) * NumLengths + Length) = BaseProbability;
+    }
+  }
+}
+
+std::vector<double> NHPYLM::GetSubstringWordProbabilities(
+  const std::vector<int> &Characters,
+  const std::vector<int> &SentenceOffsets,
+  const std::vector<int> &ContextWordIds,
+  unsigned int MaxWordLength,
+  unsigned int NumThreads
+) const
+{
+  const unsigned int ContextLength = WHPYLMOrder - 1;
+  unsigned int NumSentences = (SentenceOffsets.size() > 0) ? SentenceOffsets.size() - 1 : 0;
+  unsigned int MaxSentenceLength = 0;
+  for (unsigned int SentenceId = 0; SentenceId < NumSentences; SentenceId++) {
+    MaxSentenceLength = std::max(MaxSentenceLength, static_cast<unsigned int>(SentenceOffsets[SentenceId + 1] - SentenceOffsets[SentenceId]));
+  }
+  std::vector<double> Probabilities(NumSentences * MaxSentenceLength * MaxWordLength, 0);
+
+  std::atomic<unsigned int> NextSentenceId(0);
+  auto GetProbabilitiesOfSentences = [&]() {
+    std::vector<double> BaseProbabilities;
+    std::vector<int> WordContext(ContextLength + 1);
+    for (unsigned int SentenceId = NextSentenceId++; SentenceId < NumSentences; SentenceId = NextSentenceId++) {
+      const_citerator Sentence = Characters.begin() + SentenceOffsets[SentenceId];
+      unsigned int SentenceLength = SentenceOffsets[SentenceId + 1] - SentenceOffsets[SentenceId];
+      unsigned int MaxLength = std::min(MaxWordLength, SentenceLength);
+      GetSubstringBaseProbabilities(Sentence, SentenceLength, MaxLength, &BaseProbabilities);
+      std::copy(ContextWordIds.begin() + SentenceId * ContextLength, ContextWordIds.begin() + (SentenceId + 1) * ContextLength, WordContext.begin());
+      for (unsigned int End = 1; End <= SentenceLength; End++) {
+        for (unsigned int Length = 1; Length <= std::min(MaxLength, End); Length++) {
+          WordContext[ContextLength] = GetWordId(Sentence + End - Length, Length);
+          Probabilities[(SentenceId * MaxSentenceLength + End - Length) * MaxWordLength + Length - 1] =
+            WHPYLM.WordProbability(WordContext.begin() + ContextLength, BaseProbabilities[End * (MaxLength + 1) + Length]);
+        }
+      }
+    }
+  };
+  std::vector<std::thread> Threads;
+  for (unsigned int ThreadIdx = 1; ThreadIdx < std::min(NumThreads, NumSentences); ThreadIdx++) {
+    Threads.push_back(std::thread(GetProbabilitiesOfSentences));
+  }
+  GetProbabilitiesOfSentences();
+  for (std::vector<std::thread>::iterator Thread = Threads.begin(); Thread != Threads.end(); ++Thread) {
+    Thread->join();
+  }
+
+  return Probabilities;
+}
+
+std::vector<int> NHPYLM::GetSegmentedSentenceWordIds(const const_citerator &Sentence, const const_iiterator &WordEnds, unsigned int SentenceLength, int SentEndWordId)
+{
+  std::vector<int> WordSequence(WHPYLMOrder - 1, SentEndWordId);
+  unsigned int WordBegin = 0;
+  for (unsigned int Position = 0; Position < SentenceLength; Position++) {
+    if (*(WordEnds + Position) || (Position + 1 == SentenceLength)) {
+      WordSequence.push_back(AddCharacterIdSequenceToDictionary(Sentence + WordBegin, Position + 1 - WordBegin).first);
+      WordBegin = Position + 1;
+    }
+  }
+  WordSequence.push_back(SentEndWordId);
+  return WordSequence;
+}
+
+double NHPYLM::SegmentSentence(
+  const const_citerator &Sentence,
+  unsigned int SentenceLength,
+  int SentEndWordId,
+  unsigned int MaxWordLength,
+  bool Viterbi,
+  std::default_random_engine *Generator,
+  std::vector<int> *WordLengths
+) const
+{
+  const double LogZero = -std::numeric_limits<double>::infinity();
+  const unsigned int ContextLength = WHPYLMOrder - 1;
+  const unsigned int MaxLength = std::min(MaxWordLength, SentenceLength);
+  const unsigned int NumLengths = MaxLength + 1;
+
+  /* a state holds the lengths of the last ContextLength words
+   * (length 0: sentence begin), the length of the last word is the
+   * least significant digit */
+  unsigned int NumStates = 1;
+  for (unsigned int ContextIdx = 0; ContextIdx < ContextLength; ContextIdx++) {
+    NumStates *= NumLengths;
+  }
+  const unsigned int OldestWordFactor = NumStates / NumLengths;
+
+  /* word ids and base probabilities of all substrings with
+   * index Position * NumLengths + Length for the substring ending at Position */
+  std::vector<int> SubstringIds((SentenceLength + 1) * NumLengths, SentEndWordId);
+  std::vector<double> SubstringBaseProbabilities;
+  GetSubstringBaseProbabilities(Sentence, SentenceLength, MaxLength, &SubstringBaseProbabilities);
+  for (unsigned int Position = 1; Position <= SentenceLength; Position++) {
+    for (unsigned int Length = 1; Length <= std::min(MaxLength, Position); Length++) {
+      SubstringIds[Position * NumLengths + Length] = GetWordId(Sentence + Position - Length, Length);
+    }
+  }
+
+  /* log probability of a word given the context words of a state
+   * at the beginning of the word */
+  std::vector<int> WordContext(ContextLength + 1);
+  auto WordLogProbability = [&](int WordId, double BaseProbability, unsigned int Position, unsigned int State) {
+    for (unsigned int ContextIdx = 1; ContextIdx <= ContextLength; ContextIdx++) {
+      unsigned int Length = State % NumLengths;
+      WordContext[ContextLength - ContextIdx] = SubstringIds[Position * NumLengths + Length];
+      Position -= Length;
+      State /= NumLengths;
+    }
+    WordContext[ContextLength] = WordId;
+    return log(WHPYLM.WordProbability(WordContext.begin() + ContextLength, BaseProbability));
+  };
+
+  /* possible transitions (previous position, previous state, word length)
+   * into State at Position with their log probabilities */
+  std::vector<unsigned int> PreviousPositions;
+  std::vector<unsigned int> PreviousStates;
+  std::vector<unsigned int> Lengths;
+  std::vector<double> LogProbabilities;
+  std::vector<double> LogAlpha((SentenceLength + 1) * NumStates, LogZero);
+  auto GetTransitions = [&](unsigned int Position, unsigned int State) {
+    PreviousPositions.clear();
+    PreviousStates.clear();
+    Lengths.clear();
+    LogProbabilities.clear();
+    unsigned int LengthsBegin = 1;
+    unsigned int LengthsEnd = std::min(MaxLength, Position) + 1;
+    if (ContextLength > 0) {
+      LengthsBegin = State % NumLengths;
+      LengthsEnd = LengthsBegin + 1;
+      if ((LengthsBegin == 0) || (LengthsBegin > Position)) {
+        return;
+      }
+    }
+    for (unsigned int Length = LengthsBegin; Length < LengthsEnd; Length++) {
+      unsigned int PreviousPosition = Position - Length;
+      for (unsigned int OldestLength = 0; OldestLength < NumLengths; OldestLength++) {
+        unsigned int PreviousState = 0;
+        if (ContextLength > 0) {
+          PreviousState = State / NumLengths + OldestLength * OldestWordFactor;
+        } else if (OldestLength > 0) {
+          break;
+        }
+        double PreviousLogAlpha = LogAlpha[PreviousPosition * NumStates + PreviousState];
+        if (PreviousLogAlpha == LogZero) {
+          continue;
+        }
+        PreviousPositions.push_back(PreviousPosition);
+        PreviousStates.push_back(PreviousState);
+        Lengths.push_back(Length);
+        LogProbabilities.push_back(PreviousLogAlpha + WordLogProbability(
+          SubstringIds[Position * NumLengths + Length],
+          SubstringBaseProbabilities[Position * NumLengths + Length],
+          PreviousPosition, PreviousState));
+      }
+    }
+  };
+
+  /* combine log probabilities (sum or maximum) */
+  auto Combine = [&]() {
+    double MaxLogProbability = LogZero;
+    for (std::vector<double>::iterator LogProbability = LogProbabilities.begin(); LogProbability != LogProbabilities.end(); ++LogProbability) {
+      MaxLogProbability = std::max(MaxLogProbability, *LogProbability);
+    }
+    if (Viterbi || (MaxLogProbability == LogZero)) {
+      return MaxLogProbability;
+    }
+    double Sum = 0;
+    for (std::vector<double>::iterator LogProbability = LogProbabilities.begin(); LogProbability != LogProbabilities.end(); ++LogProbability) {
+      Sum += exp(*LogProbability - MaxLogProbability);
+    }
+    return MaxLogProbability + log(Sum);
+  };
+
+  /* select a transition (sample or maximum) */
+  auto Select = [&]() {
+    std::vector<double>::iterator MaxLogProbability = std::max_element(LogProbabilities.begin(), LogProbabilities.end());
+    if (Viterbi) {
+      return static_cast<unsigned int>(MaxLogProbability - LogProbabilities.begin());
+    }
+    std::vector<double> Probabilities;
+    Probabilities.reserve(LogProbabilities.size());
+    for (std::vector<double>::iterator LogProbability = LogProbabilities.begin(); LogProbability != LogProbabilities.end(); ++LogProbability) {
+      Probabilities.push_back(exp(*LogProbability - *MaxLogProbability));
+    }
+    std::discrete_distribution<unsigned int> Distribution(Probabilities.begin(), Probabilities.end());
+    return Distribution(*Generator);
+  };
+
+  /* forward filtering */
+  LogAlpha[0] = 0;
+  for (unsigned int Position = 1; Position <= SentenceLength; Position++) {
+    for (unsigned int State = 0; State < NumStates; State++) {
+      GetTransitions(Position, State);
+      LogAlpha[Position * NumStates + State] = Combine();
+    }
+  }
+
+  /* transitions to the sentence end */
+  std::vector<unsigned int> FinalStates;
+  LogProbabilities.clear();
+  double SentEndBaseProbability = GetWHPYLMBaseProbability(SentEndWordId);
+  for (unsigned int State = 0; State < NumStates; State++) {
+    double FinalLogAlpha = LogAlpha[SentenceLength * NumStates + State];
+    if (FinalLogAlpha != LogZero) {
+      FinalStates.push_back(State);
+      LogProbabilities.push_back(FinalLogAlpha + WordLogProbability(SentEndWordId, SentEndBaseProbability, SentenceLength, State));
+    }
+  }
+  double Loglikelihood = Combine();
+
+  /* backward sampling */
+  WordLengths->clear();
+  unsigned int Position = SentenceLength;
+  unsigned int State = FinalStates.at(Select());
+  while (Position > 0) {
+    GetTransitions(Position, State);
+    unsigned int Transition = Select();
+    WordLengths->push_back(Lengths[Transition]);
+    Position = PreviousPositions[Transition];
+    State = PreviousStates[Transition];
+  }
+  std::reverse(WordLengths->begin(), WordLengths->end());
+
+  return Loglikelihood;
+}
+
+double NHPYLM::SegmentSentences(
+  const std::vector<int> &Characters,
+  const std::vector<int> &SentenceOffsets,
+  std::vector<int> *WordEnds,
+  int SentEndWordId,
+  unsigned int MaxWordLength,
+  bool SentencesInLm,
+  bool Viterbi,
+  unsigned int NumThreads,
+  unsigned int BlockSize
+)
+{
+  if (SentenceOffsets.size() < 2) {
+    return 0;
+  }
+  unsigned int NumSentences = SentenceOffsets.size() - 1;
+  WordEnds->resize(Characters.size(), 0);
+  NumThreads = std::max(NumThreads, 1u);
+  if (Viterbi) {
+    BlockSize = NumSentences;
+  } else if (BlockSize == 0) {
+    BlockSize = NumThreads;
+  }
+
+  /* visit sentences in random order when sampling */
+  std::vector<unsigned int> SentenceOrder(NumSentences);
+  std::iota(SentenceOrder.begin(), SentenceOrder.end(), 0);
+  if (!Viterbi) {
+    std::shuffle(SentenceOrder.begin(), SentenceOrder.end(), RandomGenerator);
+  }
+
+  std::vector<double> Loglikelihoods(NumSentences, 0);
+  std::vector<std::vector<int> > WordLengths(BlockSize);
+  std::vector<unsigned int> Seeds(BlockSize);
+  for (unsigned int BlockBegin = 0; BlockBegin < NumSentences; BlockBegin += BlockSize) {
+    unsigned int BlockEnd = std::min(BlockBegin + BlockSize, NumSentences);
+
+    /* remove the words of the sentences in this block */
+    for (unsigned int Idx = BlockBegin; Idx < BlockEnd; Idx++) {
+      unsigned int SentenceId = SentenceOrder[Idx];
+      Seeds[Idx - BlockBegin] = RandomGenerator();
+      if (SentencesInLm && !Viterbi) {
+        RemoveWordSequenceFromLm(GetSegmentedSentenceWordIds(
+          Characters.begin() + SentenceOffsets[SentenceId],
+          WordEnds->begin() + SentenceOffsets[SentenceId],
+          SentenceOffsets[SentenceId + 1] - SentenceOffsets[SentenceId],
+          SentEndWordId));
+      }
+    }
+
+    /* segment the sentences of this block in parallel
+     * (the language model is not modified meanwhile) */
+    std::atomic<unsigned int> NextIdx(BlockBegin);
+    auto SegmentSentencesOfBlock = [&]() {
+      for (unsigned int Idx = NextIdx++; Idx < BlockEnd; Idx = NextIdx++) {
+        unsigned int SentenceId = SentenceOrder[Idx];
+        std::default_random_engine Generator(Seeds[Idx - BlockBegin]);
+        Loglikelihoods[SentenceId] = SegmentSentence(
+          Characters.begin() + SentenceOffsets[SentenceId],
+          SentenceOffsets[SentenceId + 1] - SentenceOffsets[SentenceId],
+          SentEndWordId, MaxWordLength, Viterbi, &Generator,
+          &WordLengths[Idx - BlockBegin]);
+      }
+    };
+    std::vector<std::thread> Threads;
+    for (unsigned int ThreadIdx = 1; ThreadIdx < std::min(NumThreads, BlockEnd - BlockBegin); ThreadIdx++) {
+      Threads.push_back(std::thread(SegmentSentencesOfBlock));
+    }
+    SegmentSentencesOfBlock();
+    for (std::vector<std::thread>::iterator Thread = Threads.begin(); Thread != Threads.end(); ++Thread) {
+      Thread->join();
+    }
+
+    /* store the new segmentations and add their words */
+    for (unsigned int Idx = BlockBegin; Idx < BlockEnd; Idx++) {
+      unsigned int SentenceId = SentenceOrder[Idx];
+      iiterator SentenceWordEnds = WordEnds->begin() + SentenceOffsets[SentenceId];
+      std::fill(SentenceWordEnds, WordEnds->begin() + SentenceOffsets[SentenceId + 1], 0);
+      unsigned int Position = 0;
+      for (iiterator Length = WordLengths[Idx - BlockBegin].begin(); Length != WordLengths[Idx - BlockBegin].end(); ++Length) {
+        Position += *Length;
+        *(SentenceWordEnds + Position - 1) = 1;
+      }
+      if (!Viterbi) {
+        AddWordSequenceToLm(GetSegmentedSentenceWordIds(
+          Characters.begin() + SentenceOffsets[SentenceId],
+          SentenceWordEnds,
+          SentenceOffsets[SentenceId + 1] - SentenceOffsets[SentenceId],
+          SentEndWordId));
+      }
+    }
+  }
+
+  return std::accumulate(Loglikelihoods.begin(), Loglikelihoods.end(), 0.0);
+}
+
+void NHPYLM::ResegmentSentences(
+  const std::vector<int> &Characters,
+  const std::vector<int> &SentenceOffsets,
+  const std::vector<int> &OldWordEnds,
+  const std::vector<int> &NewWordEnds,
+  int SentEndWordId
+)
+{
+  for (unsigned int SentenceId = 0; SentenceId + 1 < SentenceOffsets.size(); SentenceId++) {
+    int Begin = SentenceOffsets[SentenceId];
+    unsigned int SentenceLength = SentenceOffsets[SentenceId + 1] - Begin;
+    if (SentenceLength == 0) {
+      continue;
+    }
+
+    /* the last character always ends a word */
+    if (!OldWordEnds.empty() && !NewWordEnds.empty() &&
+        std::equal(OldWordEnds.begin() + Begin, OldWordEnds.begin() + Begin + SentenceLength - 1, NewWordEnds.begin() + Begin)) {
+      continue;
+    }
+    if (!OldWordEnds.empty()) {
+      RemoveWordSequenceFromLm(GetSegmentedSentenceWordIds(
+        Characters.begin() + Begin, OldWordEnds.begin() + Begin,
+        SentenceLength, SentEndWordId));
+    }
+    if (!NewWordEnds.empty()) {
+      AddWordSequenceToLm(GetSegmentedSentenceWordIds(
+        Characters.begin() + Begin, NewWordEnds.begin() + Begin,
+        SentenceLength, SentEndWordId));
+    }
+  }
+}
+
+/* version of the binary state written by GetState */
+static const int StateVersion = 1;
+
+std::string NHPYLM::GetState() const
+{
+  std::lock_guard<std::mutex> lck(mtx);
+  std::ostringstream Stream;
+  WriteValue<int>(Stream, StateVersion);
+  Dictionary::Save(Stream);
+  CHPYLM.Save(Stream);
+  WHPYLM.Save(Stream);
+  WriteValue<uint64_t>(Stream, CHPYLMBaseProbabilities.size());
+  for (google::dense_hash_map<int, double>::const_iterator Probability = CHPYLMBaseProbabilities.begin(); Probability != CHPYLMBaseProbabilities.end(); ++Probability) {
+    WriteValue<int>(Stream, Probability->first);
+    WriteValue<double>(Stream, Probability->second);
+  }
+  return Stream.str();
+}
+
+void NHPYLM::SetState(const std::string &State)
+{
+  std::lock_guard<std::mutex> lck(mtx);
+  std::istringstream Stream(State);
+  Stream.exceptions(std::istream::failbit | std::istream::badbit);
+  if (ReadValue<int>(Stream) != StateVersion) {
+    throw std::runtime_error("Unsupported NHPYLM state version");
+  }
+  Dictionary::Load(Stream);
+  CHPYLM.Load(Stream);
+  WHPYLM.Load(Stream);
+  CHPYLMBaseProbabilities.clear();
+  uint64_t NumProbabilities = ReadValue<uint64_t>(Stream);
+  for (uint64_t ProbabilityIdx = 0; ProbabilityIdx < NumProbabilities; ProbabilityIdx++) {
+    int CharacterId = ReadValue<int>(Stream);
+    CHPYLMBaseProbabilities[CharacterId] = ReadValue<double>(Stream);
+  }
+  WHPYLMBaseProbabilities.clear();
+}
+
+std::string NHPYLM::GetRandomState()
+{
+  std::ostringstream Stream;
+  std::ostringstream Generator;
+  Generator << RandomGenerator;
+  WriteString(Stream, Generator.str());
+  HPYLM::SaveRandomState(Stream);
+  Restaurant::SaveRandomState(Stream);
+  return Stream.str();
+}
+
+void NHPYLM::SetRandomState(const std::string &State)
+{
+  std::istringstream Stream(State);
+  Stream.exceptions(std::istream::failbit | std::istream::badbit);
+  std::istringstream Generator(ReadString(Stream));
+  Generator >> RandomGenerator;
+  HPYLM::LoadRandomState(Stream);
+  Restaurant::LoadRandomState(Stream);
+}
+
+void NHPYLM::SeedRandomState(unsigned int Seed)
+{
+  /* derive independent seeds for the generators */
+  std::seed_seq SeedSequence{Seed};
+  std::vector<unsigned int> Seeds(3);
+  SeedSequence.generate(Seeds.begin(), Seeds.end());
+  RandomGenerator.seed(Seeds[0]);
+  HPYLM::SeedRandomState(Seeds[1]);
+  Restaurant::SeedRandomState(Seeds[2]);
+}
+
 NHPYLMParameters::NHPYLMParameters(const std::vector< double > &CHPYLMDiscount_, const std::vector< double > &CHPYLMConcentration_, const std::vector< double > &WHPYLMDiscount_, const std::vector< double > &WHPYLMConcentration_) :
   CHPYLMDiscount(CHPYLMDiscount_),
   CHPYLMConcentration(CHPYLMConcentration_),
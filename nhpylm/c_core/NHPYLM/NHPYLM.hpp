@@ -61,6 +61,7 @@
 #define _NHPYLM_HPP_
 
 #include <mutex>
+#include <random>
 #include "HPYLM.hpp"
 #include "Dictionary.hpp"
 
@@ -90,18 +91,67 @@ class NHPYLM: public Dictionary {
   mutable google::dense_hash_map<int, double> WHPYLMBaseProbabilities;
   // mutex to allow multi threading
   mutable std::mutex mtx;
+  // random generator for word segmentation
+  static std::default_random_engine RandomGenerator;
 
   /* some internal functions */
   // Add the character sequence of a word to the character language model
   void AddCharacterSequenceToCHPYLM(
     const std::vector<int> &CharacterSequence
   );
+
   
   // remove the character sequence of a word ftom the character language model
   void RemoveCharacterSequenceFromCHPYLM(
     const std::vector<int> &CharacterSequence
   );
 
+  // remove NumCopies copies of the character sequence of a word from the
+  // character language model
+  void RemoveCharacterSequenceFromCHPYLM(
+    const std::vector<int> &CharacterSequence,
+    unsigned int NumCopies
+  );
+
+  // calculate the base probabilities of all words in the dictionary
+  void UpdateWHPYLMBaseProbabilities() const;
+
+  // get base probability of a word in the dictionary
+  double GetWHPYLMBaseProbability(
+    int WordId
+  ) const;
+
+  // get base probabilities of all substrings of a character sentence up to
+  // MaxLength characters with index End * (MaxLength + 1) + Length,
+  // substrings with the same begin share the character model context walk
+  void GetSubstringBaseProbabilities(
+    const const_citerator &Sentence,
+    unsigned int SentenceLength,
+    unsigned int MaxLength,
+    std::vector<double> *BaseProbabilities
+  ) const;
+
+  // get the word id sequence (with sentence begin and end) for a segmented
+  // character sentence, words are added to the dictionary if necessary
+  std::vector<int> GetSegmentedSentenceWordIds(
+    const const_citerator &Sentence,
+    const const_iiterator &WordEnds,
+    unsigned int SentenceLength,
+    int SentEndWordId
+  );
+
+  // forward filtering backward sampling (or viterbi decoding) of the
+  // segmentation of one character sentence, returns the log likelihood
+  double SegmentSentence(
+    const const_citerator &Sentence,
+    unsigned int SentenceLength,
+    int SentEndWordId,
+    unsigned int MaxWordLength,
+    bool Viterbi,
+    std::default_random_engine *Generator,
+    std::vector<int> *WordLengths
+  ) const;
+
 public:
   /* constructor */
   // construct nested hierarchical pitman yor language model
@@ -134,6 +184,40 @@ public:
     const const_witerator &Word
   );
 
+  // add NumCopies copies of a word to language model
+  void AddWordToLm(
+    const const_witerator &Word,
+    unsigned int NumCopies
+  );
+
+  // remove NumCopies copies of a word from language model
+  void RemoveWordFromLm(
+    const const_witerator &Word,
+    unsigned int NumCopies
+  );
+
+  // add NumCopies copies of a sequence of words to language model
+  void AddWordSequenceToLm(
+    const std::vector<int> &WordSequence,
+    unsigned int NumCopies
+  );
+
+  // remove NumCopies copies of a sequence of words from language model
+  void RemoveWordSequenceFromLm(
+    const std::vector<int> &WordSequence,
+    unsigned int NumCopies
+  );
+
+  // add (or remove) sequences of words given in CSR format (WordIds,
+  // SequenceOffsets), each beginning with WHPYLMOrder - 1 context words,
+  // with the number of copies of each sequence given in Counts
+  void AddWordSequencesToLm(
+    const std::vector<int> &WordIds,
+    const std::vector<int> &SequenceOffsets,
+    const std::vector<int> &Counts,
+    bool Remove = false
+  );
+
   // calculate probability of a word
   double WordProbability(
     const const_witerator &Word
@@ -149,6 +233,28 @@ public:
   double WordSequenceLoglikelihood(
     const std::vector< int > &WordSequence
   ) const;
+
+  // calculate the log likelihoods of word sequences given in CSR format
+  // (WordIds, SequenceOffsets), each beginning with WHPYLMOrder - 1 context
+  // words, with NumThreads threads
+  std::vector<double> WordSequencesLoglikelihoods(
+    const std::vector< int > &WordIds,
+    const std::vector< int > &SequenceOffsets,
+    unsigned int NumThreads = 1
+  ) const;
+
+  // calculate the log likelihoods of word sequences with words that are not
+  // in the dictionary: the word ids GetMaxNumWords() + i refer to the
+  // character sequence i given in CSR format (UnknownCharacters,
+  // UnknownOffsets), whose base probability is given by the character model.
+  // The dictionary is not changed.
+  std::vector<double> WordSequencesLoglikelihoods(
+    const std::vector< int > &WordIds,
+    const std::vector< int > &SequenceOffsets,
+    const std::vector< int > &UnknownCharacters,
+    const std::vector< int > &UnknownOffsets,
+    unsigned int NumThreads
+  ) const;
   
   // Resample hyper parameters of the hierarchical models
   void ResampleHyperParameters();
@@ -218,6 +324,96 @@ public:
     int Level,
     double Value
   );
+
+  // get map from context id to the context id used after pruning contexts
+  // of the given LM ("CHPYLM"|"WHPYLM") with less than MinCustomers customers
+  // or a relative entropy to their backoff context below Threshold
+  std::vector<int> GetPrunedContextMap(
+    const std::string &LM,
+    unsigned int MinCustomers,
+    double Threshold
+  );
+
+  // remove contexts of the given LM ("CHPYLM"|"WHPYLM") with less than
+  // MinCustomers customers or a relative entropy to their backoff context
+  // below Threshold and move their customers to the backoff context
+  void PruneContexts(
+    const std::string &LM,
+    unsigned int MinCustomers,
+    double Threshold
+  );
+
+  // get the probabilities of all substrings up to MaxWordLength characters
+  // of character sentences given in CSR format (Characters, SentenceOffsets)
+  // to be a word given the context words of each sentence (WHPYLMOrder - 1
+  // word ids per sentence). Returns a flat tensor of size
+  // NumSentences x MaxSentenceLength x MaxWordLength with the probability of
+  // the substring of length Length + 1 beginning at Position at
+  // [Sentence][Position][Length] (0 for substrings beyond the sentence end).
+  std::vector<double> GetSubstringWordProbabilities(
+    const std::vector<int> &Characters,
+    const std::vector<int> &SentenceOffsets,
+    const std::vector<int> &ContextWordIds,
+    unsigned int MaxWordLength,
+    unsigned int NumThreads = 1
+  ) const;
+
+  // blocked gibbs sampling (or viterbi decoding) of the word segmentation
+  // of character sentences given in CSR format (Characters, SentenceOffsets).
+  // WordEnds marks each character ending a word. The words of sentences
+  // already in the language model are removed before sampling and the
+  // sampled words are added afterwards. Blocks of BlockSize sentences are
+  // segmented in parallel with NumThreads threads. Returns the sum of the
+  // sentence log likelihoods.
+  double SegmentSentences(
+    const std::vector<int> &Characters,
+    const std::vector<int> &SentenceOffsets,
+    std::vector<int> *WordEnds,
+    int SentEndWordId,
+    unsigned int MaxWordLength,
+    bool SentencesInLm,
+    bool Viterbi,
+    unsigned int NumThreads = 1,
+    unsigned int BlockSize = 0
+  );
+
+  // replace the segmentation OldWordEnds of character sentences given in CSR
+  // format (Characters, SentenceOffsets) by NewWordEnds: the words of the old
+  // segmentation are removed from the language model and the words of the
+  // new segmentation are added. Sentences whose segmentation is unchanged are
+  // skipped. Empty OldWordEnds: the sentences are only added, empty
+  // NewWordEnds: the sentences are only removed.
+  void ResegmentSentences(
+    const std::vector<int> &Characters,
+    const std::vector<int> &SentenceOffsets,
+    const std::vector<int> &OldWordEnds,
+    const std::vector<int> &NewWordEnds,
+    int SentEndWordId
+  );
+
+  // get the state of the model (dictionary, restaurants, hyper parameters
+  // and base probabilities) as binary string
+  std::string GetState() const;
+
+  // replace the state of the model by a state returned by GetState of a
+  // model constructed with the same arguments
+  void SetState(
+    const std::string &State
+  );
+
+  // get the state of the random generators of all models as binary string
+  static std::string GetRandomState();
+
+  // restore the state returned by GetRandomState
+  static void SetRandomState(
+    const std::string &State
+  );
+
+  // seed the random generators of all models (e.g. differently in each
+  // process forked after loading the models)
+  static void SeedRandomState(
+    unsigned int Seed
+  );
 };
 
 #endif
\ No newline at end of file
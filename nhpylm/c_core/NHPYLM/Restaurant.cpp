@@ -41,7 +41,9 @@
    Author: Oliver Walter
 */
 // ----------------------------------------------------------------------------
+#include <algorithm>
 #include <chrono>
+#include <sstream>
 #include "Restaurant.hpp"
 
 std::default_random_engine Restaurant::RandomGenerator(std::chrono::system_clock::now().time_since_epoch().count());
@@ -267,6 +269,136 @@ int Restaurant::GetTablesPerWord(int WordId) const
   }
 }
 
+int Restaurant::GetWordCount(int WordId) const
+{
+  WordsHashmap::const_iterator it = Words.find(WordId);
+  if (it != Words.end()) {
+    return it->second.Wordcount;
+  } else {
+    return 0;
+  }
+}
+
+void Restaurant::AddCustomersToExistingTables(int Word, unsigned int NumCustomers)
+{
+  /* find table group, customers can only be seated if there is at least one table */
+  WordsHashmap::iterator it = Words.find(Word);
+  if ((it == Words.end()) || (NumCustomers == 0)) {
+    return;
+  }
+  WordTableGroup &TableGroup = it->second;
+
+  /* adjust buffer for probabilities used for samling */
+  if (TableGroup.GroupTableCount > TableProbabilities.size()) {
+    TableProbabilities.resize(TableGroup.GroupTableCount);
+  }
+
+  /* sample existing table for each customer */
+  for (unsigned int Customer = 0; Customer < NumCustomers; Customer++) {
+    for (unsigned int i = 0; i < TableGroup.GroupTableCount; i++) {
+      TableProbabilities[i] = TableGroup.TableWordcount[i] - Discount;
+    }
+    unsigned int SampledTable = TableDistribution(RandomGenerator, std::discrete_distribution<unsigned int>::param_type(TableProbabilities.begin(), TableProbabilities.begin() + TableGroup.GroupTableCount));
+    TableGroup.TableWordcount[SampledTable]++;
+  }
+  TableGroup.Wordcount += NumCustomers;
+  TotalWordCount += NumCustomers;
+}
+
+unsigned int Restaurant::RemoveCustomers(int Word, unsigned int NumCustomers)
+{
+  WordsHashmap::iterator it = Words.find(Word);
+  if (it == Words.end()) {
+    return 0;
+  }
+  WordTableGroup &TableGroup = it->second;
+  NumCustomers = std::min(NumCustomers, TableGroup.Wordcount);
+  unsigned int NumRemovedTables = 0;
+
+  /* remove the customers one after another from tables sampled
+   * proportional to their number of customers */
+  for (unsigned int Customer = 0; Customer < NumCustomers; Customer++) {
+    unsigned int Sample = std::uniform_int_distribution<unsigned int>(0, TableGroup.Wordcount - 1)(RandomGenerator);
+    unsigned int Table = 0;
+    while (Sample >= TableGroup.TableWordcount[Table]) {
+      Sample -= TableGroup.TableWordcount[Table];
+      Table++;
+    }
+    TableGroup.TableWordcount[Table]--;
+    TableGroup.Wordcount--;
+    TotalWordCount--;
+    if (TableGroup.TableWordcount[Table] == 0) {
+      TableGroup.TableWordcount.erase(TableGroup.TableWordcount.begin() + Table);
+      TableGroup.GroupTableCount--;
+      TotalTableCount--;
+      NumRemovedTables++;
+    }
+  }
+
+  /* remove table group for word if empty */
+  if (TableGroup.Wordcount == 0) {
+    Words.erase(it);
+  }
+  return NumRemovedTables;
+}
+
+std::vector<std::pair<int, int> > Restaurant::GetNumCustomersOnTables() const
+{
+  std::vector<std::pair<int, int> > NumCustomersOnTables;
+  NumCustomersOnTables.reserve(Words.size());
+  for (WordsHashmap::const_iterator Word = Words.begin(); Word != Words.end(); ++Word) {
+    NumCustomersOnTables.push_back(std::make_pair(Word->first, Word->second.Wordcount - Word->second.GroupTableCount));
+  }
+  return NumCustomersOnTables;
+}
+
+void Restaurant::Save(std::ostream &Stream) const
+{
+  WriteValue<unsigned int>(Stream, TotalWordCount);
+  WriteValue<unsigned int>(Stream, TotalTableCount);
+  WriteValue<uint64_t>(Stream, Words.size());
+  for (WordsHashmap::const_iterator Word = Words.begin(); Word != Words.end(); ++Word) {
+    WriteValue<int>(Stream, Word->first);
+    WriteValue<unsigned int>(Stream, Word->second.Wordcount);
+    WriteVector(Stream, Word->second.TableWordcount);
+  }
+}
+
+void Restaurant::Load(std::istream &Stream)
+{
+  Words.clear();
+  TotalWordCount = ReadValue<unsigned int>(Stream);
+  TotalTableCount = ReadValue<unsigned int>(Stream);
+  uint64_t NumWords = ReadValue<uint64_t>(Stream);
+  for (uint64_t WordIdx = 0; WordIdx < NumWords; WordIdx++) {
+    WordTableGroup &TableGroup = Words[ReadValue<int>(Stream)];
+    TableGroup.Wordcount = ReadValue<unsigned int>(Stream);
+    TableGroup.TableWordcount = ReadVector<unsigned int>(Stream);
+    TableGroup.GroupTableCount = TableGroup.TableWordcount.size();
+  }
+}
+
+void Restaurant::SaveRandomState(std::ostream &Stream)
+{
+  std::ostringstream State;
+  State << RandomGenerator << ' ' << TableDistribution << ' ' << BernoulliDistribution << ' ' << GammaDistribution;
+  WriteString(Stream, State.str());
+}
+
+void Restaurant::LoadRandomState(std::istream &Stream)
+{
+  std::istringstream State(ReadString(Stream));
+  State >> RandomGenerator >> TableDistribution >> BernoulliDistribution >> GammaDistribution;
+}
+
+void Restaurant::SeedRandomState(unsigned int Seed)
+{
+  RandomGenerator.seed(Seed);
+  TableDistribution.reset();
+  BernoulliDistribution.reset();
+  GammaDistribution.reset();
+}
+
 Restaurant::WordTableGroup::WordTableGroup() :
   Wordcount(0),
   TableWordcount(),
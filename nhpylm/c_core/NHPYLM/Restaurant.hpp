@@ -107,6 +107,15 @@ public:
   double GetTotalWordCount() const;                                      // return total number of words in restaurant
   double GetTotalTableCount() const;                                     // return total number of tables in restaurant
   int GetTablesPerWord(int WordId) const;                                // return totoal number of tables per word
+  int GetWordCount(int WordId) const;                                    // return number of customers for given word
+  void AddCustomersToExistingTables(int Word, unsigned int NumCustomers); // seat customers at the existing tables of given word (no new tables)
+  unsigned int RemoveCustomers(int Word, unsigned int NumCustomers);     // remove customers of given word, returns number of removed tables
+  std::vector<std::pair<int, int> > GetNumCustomersOnTables() const;     // return (word, customers not opening a table) for all words
+  void Save(std::ostream &Stream) const;                                 // write the words and tables of the restaurant
+  void Load(std::istream &Stream);                                       // replace the words and tables by the ones written with Save
+  static void SaveRandomState(std::ostream &Stream);                     // write the state of the random generator and distributions
+  static void LoadRandomState(std::istream &Stream);                     // restore the state written with SaveRandomState
+  static void SeedRandomState(unsigned int Seed);                        // seed the random generator and reset the distributions
 };
 
 #endif
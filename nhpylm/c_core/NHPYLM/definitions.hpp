@@ -60,6 +60,11 @@
 #ifndef _DEFINITIONS_HPP_
 #define _DEFINITIONS_HPP_
 
+#include <cstdint>
+#include <istream>
+#include <ostream>
+#include <string>
+#include <vector>
 #include <sparsehash/dense_hash_map>
 #include <boost/functional/hash.hpp>
 
@@ -107,6 +112,47 @@ struct NHPYLMParameters {
     NHPYLMParameters(const std::vector< double > &CHPYLMDiscount_, const std::vector< double > &CHPYLMConcentration_, const std::vector< double > &WHPYLMDiscount_, const std::vector< double > &WHPYLMConcentration_); // initialize parameters
 };
 
+/* binary serialization of values and vectors of values (model state) */
+template<typename T>
+void WriteValue(std::ostream &Stream, const T &Value)
+{
+  Stream.write(reinterpret_cast<const char *>(&Value), sizeof(T));
+}
+
+template<typename T>
+T ReadValue(std::istream &Stream)
+{
+  T Value;
+  Stream.read(reinterpret_cast<char *>(&Value), sizeof(T));
+  return Value;
+}
+
+template<typename T>
+void WriteVector(std::ostream &Stream, const std::vector<T> &Values)
+{
+  WriteValue<uint64_t>(Stream, Values.size());
+  Stream.write(reinterpret_cast<const char *>(Values.data()), Values.size() * sizeof(T));
+}
+
+template<typename T>
+std::vector<T> ReadVector(std::istream &Stream)
+{
+  std::vector<T> Values(ReadValue<uint64_t>(Stream));
+  Stream.read(reinterpret_cast<char *>(Values.data()), Values.size() * sizeof(T));
+  return Values;
+}
+
+inline void WriteString(std::ostream &Stream, const std::string &Value)
+{
+  WriteVector(Stream, std::vector<char>(Value.begin(), Value.end()));
+}
+
+inline std::string ReadString(std::istream &Stream)
+{
+  std::vector<char> Value = ReadVector<char>(Stream);
+  return std::string(Value.begin(), Value.end());
+}
+
 /* transitions from one to the next context */
 struct ContextToContextTransitions {
     std::vector<int> Words;            // word ids for transitions
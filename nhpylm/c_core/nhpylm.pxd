@@ -86,12 +86,29 @@ cdef extern from "NHPYLM/NHPYLM.hpp":
         void AddWordToLm(const const_witerator & Word)
         void AddWordSequenceToLm(const vector[int] & WordSequence)
         void RemoveWordSequenceFromLm(const vector[int] & WordSequence)
+        void AddWordSequenceToLm(const vector[int] & WordSequence,
+                                 unsigned int NumCopies)
+        void RemoveWordSequenceFromLm(const vector[int] & WordSequence,
+                                      unsigned int NumCopies)
+        void AddWordSequencesToLm(const vector[int] & WordIds,
+                                  const vector[int] & SequenceOffsets,
+                                  const vector[int] & Counts, bool Remove)
         bool RemoveWordFromLm(const const_witerator & Word)
         double WordProbability(const const_witerator & Word) const
         vector[double] WordVectorProbability(
                 const vector[int] & ContextSequence,
                 const vector[int] & Words) const
         double WordSequenceLoglikelihood(const vector[int] & WordSequence) const
+        vector[double] WordSequencesLoglikelihoods(
+                const vector[int] & WordIds,
+                const vector[int] & SequenceOffsets,
+                unsigned int NumThreads) const
+        vector[double] WordSequencesLoglikelihoods(
+                const vector[int] & WordIds,
+                const vector[int] & SequenceOffsets,
+                const vector[int] & UnknownCharacters,
+                const vector[int] & UnknownOffsets,
+                unsigned int NumThreads) nogil const
         void ResampleHyperParameters()
         const NHPYLMParameters & GetNHPYLMParameters() const
         int GetContextId(const vector[int] & ContextSequence) const
@@ -120,6 +137,36 @@ cdef extern from "NHPYLM/NHPYLM.hpp":
         int GetWHPYLBaseTablesPerWord(int WordId) const
         void SetParameter(const string & LM, const string & Parameter,
                           int Level, double Value)
+        vector[int] GetPrunedContextMap(const string & LM,
+                                        unsigned int MinCustomers,
+                                        double Threshold)
+        void PruneContexts(const string & LM, unsigned int MinCustomers,
+                           double Threshold)
+        vector[double] GetSubstringWordProbabilities(
+                const vector[int] & Characters,
+                const vector[int] & SentenceOffsets,
+                const vector[int] & ContextWordIds,
+                unsigned int MaxWordLength, unsigned int NumThreads) const
+        double SegmentSentences(const vector[int] & Characters,
+                                const vector[int] & SentenceOffsets,
+                                vector[int] *WordEnds, int SentEndWordId,
+                                unsigned int MaxWordLength,
+                                bool SentencesInLm, bool Viterbi,
+                                unsigned int NumThreads,
+                                unsigned int BlockSize) except +
+        void ResegmentSentences(const vector[int] & Characters,
+                                const vector[int] & SentenceOffsets,
+                                const vector[int] & OldWordEnds,
+                                const vector[int] & NewWordEnds,
+                                int SentEndWordId) except +
+        string GetState() const
+        void SetState(const string & State) except +
+        @staticmethod
+        string GetRandomState()
+        @staticmethod
+        void SetRandomState(const string & State) except +
+        @staticmethod
+        void SeedRandomState(unsigned int Seed)
         # From Dictionary
         int GetMaxNumWords() const
         int GetWordsBegin() const
@@ -129,4 +176,9 @@ cdef extern from "NHPYLM/NHPYLM.hpp":
         vector[string] GetId2CharacterSequenceVector()
         vector[vector[string]] GetId2SeparatedCharacterSequenceVector()
         vector[int] GetWordVector(int id)
+        void GetWordCharacterArrays(int FirstWordId, vector[int] *WordIds,
+                                    vector[int] *Offsets,
+                                    vector[int] *CharacterIds) const
+        bool WriteSymbolTable(const string & FileName, int NumPrefixedSymbols,
+                              const string & Prefix) const
         void SetCharBaseProb(const int CharId, const double prob)
@@ -44,7 +44,7 @@
 
 from libcpp.string cimport string
 from libcpp.vector cimport vector
-from tqdm import tqdm
+import numpy as np
 
 cdef extern from "math.h":
     float log(float x) nogil
@@ -53,6 +53,95 @@ special_symbols = [
     'EPS', 'PHI', 'SOW', 'EOW', 'SOS', 'EOS', 'EOC', 'BLANK'
 ]
 
+def get_random_state():
+    """ Returns the state of the random generators of all language models
+
+    :return: state as bytes
+    """
+    return NHPYLM.GetRandomState()
+
+
+def set_random_state(state):
+    """ Restores a state returned by get_random_state
+
+    :param state: state as bytes
+    """
+    NHPYLM.SetRandomState(state)
+
+
+def seed_random_state(seed):
+    """ Seeds the random generators of all language models, e.g. differently
+    in processes forked after importing this module (which would otherwise
+    share the state of the random generators)
+
+    :param seed: unsigned 32 bit integer
+    """
+    NHPYLM.SeedRandomState(seed)
+
+
+def deduplicate_id_sentences(id_sentences):
+    """ Counts the repetitions of sentences of word ids
+
+    :param id_sentences: list of word id sentences
+    :return: tuple of the concatenated word ids of the unique sentences (in
+             order of their first occurrence), their offsets (number of unique
+             sentences + 1 entries) and the number of copies of each sentence
+    """
+
+    counts = dict()
+    for sentence in id_sentences:
+        sentence = tuple(sentence)
+        counts[sentence] = counts.get(sentence, 0) + 1
+    sentence_offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    sentence_offsets[1:] = np.cumsum([len(sentence) for sentence in counts])
+    word_ids = np.fromiter((word_id for sentence in counts
+                            for word_id in sentence), dtype=np.int32,
+                           count=sentence_offsets[-1])
+    return word_ids, sentence_offsets, \
+        np.fromiter(counts.values(), dtype=np.int32, count=len(counts))
+
+
+def _check_character_sentences(characters, sentence_offsets,
+                               word_ends=None, max_word_length=None):
+    """ Checks the consistency of character sentences in CSR format (see
+    NHPYLM_wrapper.segment_sentences)
+
+    :param characters: concatenated character ids of all sentences
+    :param sentence_offsets: offsets of the sentences in characters
+    :param word_ends: segmentation of the sentences (None: not checked)
+    :param max_word_length: maximum number of characters of a word
+                            (None: not checked)
+    """
+
+    if max_word_length is not None and max_word_length < 1:
+        raise ValueError('max_word_length must be at least 1, got {}'
+                         .format(max_word_length))
+    sentence_offsets = np.asarray(sentence_offsets)
+    if len(sentence_offsets) == 0 or sentence_offsets[0] != 0:
+        raise ValueError('sentence_offsets must begin with 0')
+    if np.any(np.diff(sentence_offsets) < 0):
+        raise ValueError('sentence_offsets must be non-decreasing')
+    if sentence_offsets[-1] != len(characters):
+        raise ValueError('sentence_offsets must end with the number of '
+                         'characters ({}), got {}'
+                         .format(len(characters), sentence_offsets[-1]))
+    if word_ends is not None and len(word_ends) != len(characters):
+        raise ValueError('word_ends must have one entry per character ({}), '
+                         'got {}'.format(len(characters), len(word_ends)))
+
+
+cdef _to_int_array(vector[int] & values):
+    if values.size() == 0:
+        return np.zeros(0, dtype=np.int32)
+    return np.array(<int[:values.size()]> values.data())
+
+
+cdef _to_float_array(vector[float] & values):
+    if values.size() == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.array(<float[:values.size()]> values.data())
+
+
 cdef class NHPYLM_wrapper:
     """ Wrapper for a hierarchical Pitman-Yor model.
 
@@ -65,9 +154,13 @@ cdef class NHPYLM_wrapper:
     cdef dict _sym_to_int
     cdef dict _int_to_sym
     cdef int _sentence_boundary_id
+    cdef tuple _init_args
     def __cinit__(self, symbols, word_model_order=2, character_model_order=8,
                   double word_base_probability=0., sentence_boundary_marker=['EOS']):
 
+        self._init_args = (list(symbols), word_model_order,
+                           character_model_order, word_base_probability,
+                           sentence_boundary_marker)
         symbols = special_symbols + symbols
         cdef int i
         self._sym_to_int = dict()
@@ -95,6 +188,28 @@ cdef class NHPYLM_wrapper:
         )
         return word_id
 
+    def get_state(self):
+        """ Returns the state of the language model (dictionary, restaurants,
+        hyperparameters and base probabilities).
+
+        :return: state as bytes
+        """
+        return self._lm.GetState()
+
+    def set_state(self, state):
+        """ Replaces the state of the language model by a state returned by
+        get_state of a language model created with the same arguments.
+
+        :param state: state as bytes
+        """
+        self._lm.SetState(state)
+
+    def __reduce__(self):
+        return NHPYLM_wrapper, self._init_args, self.get_state()
+
+    def __setstate__(self, state):
+        self.set_state(state)
+
     cpdef set_char_base_probs(self, char_prob_dict):
         for char_id, prob in char_prob_dict.items():
             self._lm.SetCharBaseProb(self._sym_to_int[char_id], prob)
@@ -193,23 +308,48 @@ cdef class NHPYLM_wrapper:
     @property
     def string_ids(self):
         cdef vector[string] syms = self._lm.GetId2CharacterSequenceVector()
-        strings = list()
-        for idx, sym in enumerate(syms):
-            if idx < len(self._sym_to_int):
-                strings.append('_{}'.format(sym.decode()))
-            else:
-                strings.append(sym.decode())
-        return strings
+        num_symbols = len(self._sym_to_int)
+        return ['_' + sym.decode() if idx < num_symbols else sym.decode()
+                for idx, sym in enumerate(syms)]
 
     @property
     def list_ids(self):
         return self._lm.GetId2SeparatedCharacterSequenceVector()
 
+    def get_lexicon_arrays(self):
+        """ Returns the character ids of all words (except the sentence
+        boundary) with a single call as compressed sparse rows
+
+        :return: tuple of arrays (word ids, offsets, character ids), the
+                 characters of word_ids[i] are
+                 character_ids[offsets[i]:offsets[i + 1]]
+        """
+
+        cdef vector[int] word_ids
+        cdef vector[int] offsets
+        cdef vector[int] character_ids
+        self._lm.GetWordCharacterArrays(self._lm.GetWordsBegin() + 1,
+                                        &word_ids, &offsets, &character_ids)
+        return (_to_int_array(word_ids), _to_int_array(offsets),
+                _to_int_array(character_ids))
+
     def get_word_id_to_char_id(self):
-        word_id_to_char_id = dict()
-        for word_id in range(self._lm.GetWordsBegin() + 1, self._lm.GetMaxNumWords()):
-            word_id_to_char_id[word_id] = self.id2word(word_id)[self.character_order-1:-1]
-        return word_id_to_char_id
+        word_ids, offsets, character_ids = self.get_lexicon_arrays()
+        offsets = offsets.tolist()
+        character_ids = character_ids.tolist()
+        return {word_id: character_ids[offsets[idx]:offsets[idx + 1]]
+                for idx, word_id in enumerate(word_ids.tolist())}
+
+    def write_symbol_table(self, filename):
+        """ Writes the symbol table (see string_ids) in OpenFst text format,
+        ids without symbol (e.g. of removed words) are skipped
+
+        :param filename: symbol table file to write
+        """
+
+        if not self._lm.WriteSymbolTable(filename.encode(),
+                                         len(self._sym_to_int), b'_'):
+            raise IOError('Could not write symbol table {}'.format(filename))
 
     def get_char_ids(self):
         return list(range(len(special_symbols), len(self._int_to_sym)))
@@ -249,47 +389,129 @@ cdef class NHPYLM_wrapper:
             id_lists.append(self.word_list_to_id_list(word_list))
         return id_lists
 
-    cpdef add_id_sentence_to_lm(self, vector[int] sentence):
+    cpdef add_id_sentence_to_lm(self, vector[int] sentence, int count=1):
         """ Adds a sentence of word ids to the language model.
 
         The sentence has to be represented by a number of integer word ids.
+        With count > 1 the copies of each word are seated in one call, which
+        only updates the base probabilities when a copy is added to the base
+        distribution.
 
         :param sentence: Sentence to add
+        :param count: number of copies of the sentence to add
         """
         # cdef vector[int] word_vec = sentence
-        self._lm.AddWordSequenceToLm(sentence)
+        if count < 0:
+            raise ValueError('count must not be negative, got {}'
+                             .format(count))
+        if count == 1:
+            self._lm.AddWordSequenceToLm(sentence)
+        else:
+            self._lm.AddWordSequenceToLm(sentence, count)
 
-    cpdef rm_id_sentence_from_lm(self, sentence):
+    cpdef rm_id_sentence_from_lm(self, sentence, int count=1):
         """ Removes a sentence of word ids from the language model.
 
         The sentence has to be represented by a number of integer word ids.
 
         :param sentence: Sentence to remove
+        :param count: number of copies of the sentence to remove
         """
+        if count < 0:
+            raise ValueError('count must not be negative, got {}'
+                             .format(count))
         cdef vector[int] word_vec = sentence
-        self._lm.RemoveWordSequenceFromLm(word_vec)
+        if count == 1:
+            self._lm.RemoveWordSequenceFromLm(word_vec)
+        else:
+            self._lm.RemoveWordSequenceFromLm(word_vec, count)
+
+    cpdef add_weighted_id_sentences_to_lm(self, word_ids, sentence_offsets,
+                                          counts, remove=False):
+        """ Adds (or removes) sentences of word ids with the number of copies
+        of each sentence to the language model (see add_id_sentence_to_lm).
+
+        The sentences are given in CSR format as returned by
+        deduplicate_id_sentences.
+
+        :param word_ids: concatenated word ids of all sentences
+        :param sentence_offsets: offsets of the sentences in word_ids
+                                 (number of sentences + 1 entries)
+        :param counts: number of copies of each sentence
+        :param remove: remove the sentences instead of adding them
+        """
+        if len(counts) != max(len(sentence_offsets) - 1, 0):
+            raise ValueError('counts must have one entry per sentence ({}), '
+                             'got {}'.format(max(len(sentence_offsets) - 1, 0),
+                                             len(counts)))
+        if np.any(np.asarray(counts) < 0):
+            raise ValueError('counts must not be negative')
+        cdef vector[int] c_word_ids = word_ids
+        cdef vector[int] c_sentence_offsets = sentence_offsets
+        cdef vector[int] c_counts = counts
+        self._lm.AddWordSequencesToLm(c_word_ids, c_sentence_offsets,
+                                      c_counts, remove)
 
     cpdef add_id_sentence_list_to_lm(self, sentences):
-        """ Adds several sentences of word ids to the language model
+        """ Adds several sentences of word ids to the language model.
+        Repeated sentences are added with one call (see
+        add_weighted_id_sentences_to_lm).
 
         :param sentences: List of word id sentences
         """
-        for sentence in sentences:
-            self.add_id_sentence_to_lm(sentence)
+        self.add_weighted_id_sentences_to_lm(
+            *deduplicate_id_sentences(sentences))
 
-    cpdef train_with_list_of_sentences(self, sentences, iterations=3):
+    cpdef train_with_list_of_sentences(self, sentences, iterations=3,
+                                       checkpointer=None, scheduler=None):
         """ Train the language model with a list of word sentences
 
         :param sentences:
+        :param iterations: (maximum) number of iterations
+        :param checkpointer: nhpylm.checkpoint.Checkpointer to write
+                             checkpoints with (including the state of the
+                             scheduler). Training resumes after the
+                             iteration of its latest checkpoint
+        :param scheduler: nhpylm.scheduler.ConvergenceScheduler deciding when
+                          to resample the hyperparameters and to stop.
+                          None: resample after each iteration
+        :return: number of finished iterations
         """
+        cdef int first_iteration = 0
+        extra = dict()
+        if checkpointer is not None:
+            first_iteration, extra = checkpointer.restore(self,
+                                                          return_extra=True)
         id_sentence_list = self.word_lists_to_id_lists(sentences)
-        self.add_id_sentence_list_to_lm(id_sentence_list)
+        if first_iteration == 0:
+            self.add_id_sentence_list_to_lm(id_sentence_list)
+        if scheduler is not None:
+            scheduler.start(self, first_iteration, extra.get('scheduler'))
         cdef int it
-        for it in range(iterations):
+        cdef int finished_iterations = first_iteration
+        for it in range(first_iteration, iterations):
             for sentence in id_sentence_list:
                 self.rm_id_sentence_from_lm(sentence)
                 self.add_id_sentence_to_lm(sentence)
-            self.resample_hyperparameters()
+            resample = scheduler is None or scheduler.should_resample(it + 1)
+            if resample:
+                self.resample_hyperparameters()
+            finished_iterations = it + 1
+            stop = scheduler is not None and scheduler.update(it + 1, self,
+                                                              resample)
+            if checkpointer is not None:
+                if scheduler is None:
+                    checkpointer.save(it + 1, self)
+                else:
+                    checkpointer.save(it + 1, self,
+                                      scheduler=scheduler.get_state())
+            if stop:
+                break
+        if scheduler is not None:
+            scheduler.wait()
+        if checkpointer is not None:
+            checkpointer.wait()
+        return finished_iterations
 
     cpdef resample_hyperparameters(self):
         """ Resamples the hyperparameters of the language model
@@ -308,6 +530,79 @@ cdef class NHPYLM_wrapper:
             id_sequence = id_sequence[:-1]
         return self._lm.WordSequenceLoglikelihood(id_sequence)
 
+    cpdef word_sequences_loglikelihoods(self, id_sentences, num_threads=1):
+        """ Calculates the log likelihoods of sentences of word ids (as
+        returned by word_lists_to_id_lists, including the sentence end).
+
+        :param id_sentences: list of word id sentences
+        :param num_threads: number of threads
+        :return: array with the log likelihood of each sentence
+        """
+
+        cdef vector[int] word_ids
+        cdef vector[int] sentence_offsets = [0]
+        for sentence in id_sentences:
+            for word_id in sentence:
+                word_ids.push_back(word_id)
+            sentence_offsets.push_back(word_ids.size())
+        cdef vector[double] loglikelihoods = \
+            self._lm.WordSequencesLoglikelihoods(word_ids, sentence_offsets,
+                                                 num_threads)
+        if loglikelihoods.size() == 0:
+            return np.zeros(0)
+        return np.array(<double[:loglikelihoods.size()]> loglikelihoods.data())
+
+    cpdef word_lists_loglikelihoods(self, word_lists, num_threads=1):
+        """ Calculates the log likelihoods of sentences of words (including
+        the sentence end) without adding their words to the dictionary.
+
+        The base probability of words that are not in the dictionary is
+        given by the character model.
+
+        :param word_lists: list of lists of words
+        :param num_threads: number of threads
+        :return: array with the log likelihood of each sentence
+        """
+
+        cdef vector[int] word_ids
+        cdef vector[int] sentence_offsets = [0]
+        cdef vector[int] unknown_characters
+        cdef vector[int] unknown_offsets = [0]
+        cdef vector[int] char_vec
+        cdef int unknown_words_begin = self._lm.GetMaxNumWords()
+        cdef int word_id
+        unknown_word_ids = dict()
+        for word_list in word_lists:
+            for _ in range(self.word_order - 1):
+                word_ids.push_back(self._sentence_boundary_id)
+            for word in word_list:
+                char_vec = [self._sym_to_int[c] for c in word]
+                word_id = self._lm.GetWordId(char_vec.const_begin(),
+                                             char_vec.size())
+                if word_id < 0:  # not in the dictionary (UNKNOWN)
+                    word = tuple(char_vec)
+                    if word not in unknown_word_ids:
+                        unknown_word_ids[word] = \
+                            unknown_words_begin + len(unknown_word_ids)
+                        unknown_characters.insert(unknown_characters.end(),
+                                                  char_vec.begin(),
+                                                  char_vec.end())
+                        unknown_offsets.push_back(unknown_characters.size())
+                    word_id = unknown_word_ids[word]
+                word_ids.push_back(word_id)
+            word_ids.push_back(self._sentence_boundary_id)
+            sentence_offsets.push_back(word_ids.size())
+        cdef vector[double] loglikelihoods
+        cdef unsigned int c_num_threads = num_threads
+        # the gil is released, e.g. for evaluations in a background thread
+        with nogil:
+            loglikelihoods = self._lm.WordSequencesLoglikelihoods(
+                word_ids, sentence_offsets, unknown_characters,
+                unknown_offsets, c_num_threads)
+        if loglikelihoods.size() == 0:
+            return np.zeros(0)
+        return np.array(<double[:loglikelihoods.size()]> loglikelihoods.data())
+
     cpdef get_transitions_for_id(self, id, return_to_start=False):
         """ Calculates the transitions for a given id
 
@@ -324,19 +619,225 @@ cdef class NHPYLM_wrapper:
                                            self.start_context_id)
 
 
-    cpdef to_fst_text_format(self, sow=None, eow=None, eos_word=None,
-                             return_to_start=False):
-        cdef vector[string] fst_lines = vector[string]()
-        cdef vector[bool] visited_contexts = vector[bool](self.final_context_id, 0)
+    cpdef get_pruned_context_map(self, min_customers=0, threshold=0.,
+                                 lms=('WHPYLM',)):
+        """ Returns a map from each context id to the context id to be used
+        after pruning (the context itself or its first unpruned backoff).
+
+        A context is pruned if it has fewer than min_customers customers or
+        if the relative entropy between its distribution and the distribution
+        of its backoff context is below threshold. Contexts are only pruned if
+        all their longer contexts are pruned. The model is not changed.
+
+        :param min_customers: minimum number of customers to keep a context
+        :param threshold: minimum relative entropy to keep a context
+        :param lms: language models to prune ('CHPYLM' and/or 'WHPYLM')
+        :return: list with the context id to use for each context id
+        """
+
+        context_map = list(range(self.final_context_id + 1))
+        cdef vector[int] lm_context_map
+        for lm in lms:
+            lm_context_map = self._lm.GetPrunedContextMap(
+                lm.encode(), min_customers, threshold)
+            context_map = [lm_context_map[context_id]
+                           for context_id in context_map]
+        return context_map
+
+    cpdef prune_contexts(self, min_customers=0, threshold=0.,
+                         lms=('WHPYLM',)):
+        """ Prunes contexts from the language model (see
+        get_pruned_context_map). The customers of the pruned contexts are
+        moved to their backoff contexts.
+
+        :param min_customers: minimum number of customers to keep a context
+        :param threshold: minimum relative entropy to keep a context
+        :param lms: language models to prune ('CHPYLM' and/or 'WHPYLM')
+        """
+
+        for lm in lms:
+            self._lm.PruneContexts(lm.encode(), min_customers, threshold)
+
+    cpdef substring_word_probabilities(self, characters, sentence_offsets,
+                                       max_word_length=10, contexts=None,
+                                       num_threads=1):
+        """ Calculates the probabilities of all substrings of character
+        sentences to be a word in the given context.
+
+        The sentences are given in CSR format (see segment_sentences).
+
+        :param characters: concatenated character ids of all sentences
+        :param sentence_offsets: offsets of the sentences in characters
+                                 (number of sentences + 1 entries)
+        :param max_word_length: maximum number of characters of a substring
+        :param contexts: list with the context word ids (word_order - 1 ids)
+                         for each sentence. None: sentence begin context
+        :param num_threads: number of threads
+        :return: array of shape (number of sentences, maximum sentence length,
+                 max_word_length) with the probability of the substring
+                 beginning at position with length index + 1 (0 for
+                 substrings beyond the sentence end)
+        """
+
+        cdef vector[int] c_characters = characters
+        cdef vector[int] c_sentence_offsets = sentence_offsets
+        cdef vector[int] c_context_word_ids
+        num_sentences = max(len(sentence_offsets) - 1, 0)
+        if contexts is None:
+            c_context_word_ids = vector[int](
+                num_sentences * (self.word_order - 1),
+                self._sentence_boundary_id)
+        else:
+            c_context_word_ids = [word_id for context in contexts
+                                  for word_id in context]
+        cdef vector[double] probabilities = \
+            self._lm.GetSubstringWordProbabilities(
+                c_characters, c_sentence_offsets, c_context_word_ids,
+                max_word_length, num_threads)
+        if probabilities.size() == 0:
+            return np.zeros((num_sentences, 0, max_word_length))
+        return np.array(<double[:probabilities.size()]> probabilities.data())\
+            .reshape(num_sentences, -1, max_word_length)
+
+    cpdef segment_sentences(self, characters, sentence_offsets,
+                            word_ends=None, max_word_length=10,
+                            num_threads=1, block_size=0, viterbi=False):
+        """ Samples the word segmentation of unsegmented character sentences
+        (blocked gibbs sampling with forward filtering backward sampling).
+
+        The sentences are given in CSR format: the character ids of all
+        sentences concatenated and the offsets of the sentences. The words of
+        a given segmentation are removed from the language model before
+        sampling and the words of the sampled segmentation are added
+        afterwards. Blocks of block_size sentences are sampled in parallel.
+        With viterbi=True the most likely segmentation is returned and the
+        language model is not changed.
+
+        :param characters: concatenated character ids of all sentences
+        :param sentence_offsets: offsets of the sentences in characters
+                                 (number of sentences + 1 entries)
+        :param word_ends: current segmentation (1 for each character ending a
+                          word) whose words are in the language model.
+                          None: the sentences are not in the language model
+        :param max_word_length: maximum number of characters of a word
+        :param num_threads: number of threads
+        :param block_size: number of sentences sampled in parallel
+                           (0: num_threads)
+        :param viterbi: return most likely segmentation instead of sampling
+        :return: tuple of the new word_ends array and the sum of the log
+                 likelihoods of the sentences
+        """
+
+        _check_character_sentences(characters, sentence_offsets, word_ends,
+                                   max_word_length)
+        cdef vector[int] c_characters = characters
+        cdef vector[int] c_sentence_offsets = sentence_offsets
+        cdef vector[int] c_word_ends
+        if word_ends is not None:
+            c_word_ends = word_ends
+        loglikelihood = self._lm.SegmentSentences(
+            c_characters, c_sentence_offsets, &c_word_ends,
+            self._sentence_boundary_id, max_word_length,
+            word_ends is not None, viterbi, num_threads, block_size)
+        if c_word_ends.size() == 0:
+            return np.zeros(0, dtype=np.int32), loglikelihood
+        return np.array(<int[:c_word_ends.size()]> c_word_ends.data()), \
+            loglikelihood
+
+    cpdef resegment_sentences(self, characters, sentence_offsets,
+                              word_ends=None, old_word_ends=None):
+        """ Replaces the segmentation of character sentences in the language
+        model (see segment_sentences for the CSR format).
+
+        The words of the old segmentation are removed and the words of the
+        new segmentation are added. Sentences whose segmentation did not
+        change are skipped.
+
+        :param characters: concatenated character ids of all sentences
+        :param sentence_offsets: offsets of the sentences in characters
+                                 (number of sentences + 1 entries)
+        :param word_ends: new segmentation (1 for each character ending a
+                          word). None: the sentences are only removed
+        :param old_word_ends: segmentation of the sentences in the language
+                              model. None: the sentences are only added
+        """
+
+        _check_character_sentences(characters, sentence_offsets, word_ends)
+        if old_word_ends is not None:
+            _check_character_sentences(characters, sentence_offsets,
+                                       old_word_ends)
+        cdef vector[int] c_characters = characters
+        cdef vector[int] c_sentence_offsets = sentence_offsets
+        cdef vector[int] c_old_word_ends
+        cdef vector[int] c_word_ends
+        if old_word_ends is not None:
+            c_old_word_ends = old_word_ends
+        if word_ends is not None:
+            c_word_ends = word_ends
+        self._lm.ResegmentSentences(c_characters, c_sentence_offsets,
+                                    c_old_word_ends, c_word_ends,
+                                    self._sentence_boundary_id)
+
+    cdef int _fst_label(self, int cur_context, int label, sow, eow, eos_word):
+        if sow is not None and cur_context == self.root_context_id and label == 1:
+            label = sow  # Use specified sow to enter char model
+        if eow is not None and label == 3:
+            label = eow  # Use specified eow to leave char model
+        if eos_word is not None and label == self._sentence_boundary_id:
+            label = eos_word  # Use specified eos_word to finish sequence
+        return label
+
+    cpdef get_transition_arrays(self, int context_id, sow=None, eow=None,
+                                eos_word=None, return_to_start=False,
+                                context_map=None):
+        """ Calculates the transitions of a single context as fst arcs, e.g.
+        to expand the states of a lazy language model fst on demand (see
+        nhpylm.array_fst.LanguageModelFST)
+
+        :param context_id: Context for the transitions
+        :return: tuple of arrays (label, next context id, weight) with the
+                 same labels and weights as to_fst_arrays
+        """
+
+        cdef ContextToContextTransitions transitions = \
+            self.get_transitions_for_id(context_id, return_to_start)
+        cdef int num_transitions = transitions.Words.size()
+        labels = np.empty(num_transitions, dtype=np.int32)
+        next_context_ids = np.empty(num_transitions, dtype=np.int32)
+        weights = np.empty(num_transitions, dtype=np.float32)
+        cdef int[:] c_labels = labels
+        cdef int[:] c_next_context_ids = next_context_ids
+        cdef float[:] c_weights = weights
+        cdef int dest
+        cdef int i
+        for i in range(num_transitions):
+            dest = transitions.NextContextIds[i]
+            if context_map is not None and dest < len(context_map):
+                dest = context_map[dest]  # Skip pruned contexts
+            c_next_context_ids[i] = dest
+            c_labels[i] = self._fst_label(context_id, transitions.Words[i],
+                                          sow, eow, eos_word)
+            c_weights[i] = -log(transitions.Probabilities[i])
+        return labels, next_context_ids, weights
+
+    cdef _collect_fst_arcs(self, sow, eow, eos_word, return_to_start,
+                           context_map, vector[int] & src, vector[int] & dst,
+                           vector[int] & labels, vector[float] & weights):
+        """ Visits all contexts reachable from the start context and appends
+        their transitions as arcs (used by to_fst_arrays and
+        to_fst_text_format)
+        """
+
+        # final_context_id is the highest context id (destination only)
+        cdef vector[bool] visited_contexts = \
+            vector[bool](self.final_context_id + 1, 0)
         next_context = list()
         next_context.append(self.start_context_id)
-        arc_list = list()
         cdef int cur_context
         cdef int dest
-        cdef int label
-        cdef float weight
         cdef int i
         cdef ContextToContextTransitions transitions
+        from tqdm import tqdm
         progress = tqdm(desc='Visiting contexts',
                         total=self.final_context_id)
         while len(next_context) > 0:
@@ -347,24 +848,61 @@ cdef class NHPYLM_wrapper:
                                                           return_to_start)
                 for i in range(transitions.Words.size()):
                     dest = transitions.NextContextIds[i]
-                    label = transitions.Words[i]
-                    weight = -log(transitions.Probabilities[i])
-                    if sow is not None and cur_context == self.root_context_id and label == 1:
-                        label = sow  # Use specified sow to enter char model
-                    if eow is not None and label == 3:
-                        label = eow  # Use specified eow to leave char model
-                    if eos_word is not None and label == self._sentence_boundary_id:
-                        label = eos_word  # Use specified eos_word to finish sequence
-                    fst_lines.push_back(
-                            '{} {} {} {} {}'.format(
-                                    cur_context,
-                                    dest,
-                                    label, label,
-                                    weight).encode())
-                    arc_list.append((cur_context, dest, label, label, weight))
+                    if context_map is not None and dest < len(context_map):
+                        dest = context_map[dest]  # Skip pruned contexts
+                    src.push_back(cur_context)
+                    dst.push_back(dest)
+                    labels.push_back(self._fst_label(
+                        cur_context, transitions.Words[i], sow, eow, eos_word))
+                    weights.push_back(-log(transitions.Probabilities[i]))
                     if not visited_contexts[dest]:
                         next_context.append(dest)
                 progress.update()
+        progress.close()
+
+    cpdef to_fst_arrays(self, sow=None, eow=None, eos_word=None,
+                        return_to_start=False, context_map=None):
+        """ Exports the language model as arrays of arcs, e.g. to be written
+        with nhpylm.fst.write_vector_fst (see to_fst_text_format)
+
+        :return: tuple of arc arrays (src, dst, label, weight), start state
+                 and final state (input and output labels are the same)
+        """
+
+        cdef vector[int] src
+        cdef vector[int] dst
+        cdef vector[int] labels
+        cdef vector[float] weights
+        self._collect_fst_arcs(sow, eow, eos_word, return_to_start,
+                               context_map, src, dst, labels, weights)
+        if not return_to_start:
+            final_state = self.final_context_id
+        else:
+            final_state = self.start_context_id
+        arcs = (_to_int_array(src), _to_int_array(dst), _to_int_array(labels),
+                _to_float_array(weights))
+        return arcs, self.start_context_id, final_state
+
+    cpdef to_fst_text_format(self, sow=None, eow=None, eos_word=None,
+                             return_to_start=False, context_map=None):
+        cdef vector[string] fst_lines = vector[string]()
+        arc_list = list()
+        cdef vector[int] src
+        cdef vector[int] dst
+        cdef vector[int] labels
+        cdef vector[float] weights
+        cdef size_t i
+        self._collect_fst_arcs(sow, eow, eos_word, return_to_start,
+                               context_map, src, dst, labels, weights)
+        for i in range(src.size()):
+            fst_lines.push_back(
+                    '{} {} {} {} {}'.format(
+                            src[i],
+                            dst[i],
+                            labels[i], labels[i],
+                            weights[i]).encode())
+            arc_list.append((src[i], dst[i], labels[i], labels[i],
+                             weights[i]))
 #        if return_to_start and final_sequence is not None:
 #            for context_id, label in enumerate(final_sequence):
 #                if context_id == 0:
@@ -388,5 +926,4 @@ cdef class NHPYLM_wrapper:
         else:
             fst_lines.push_back('{}'.format(self.start_context_id).encode())
             arc_list.append((self.start_context_id,))
-        progress.close()
         return fst_lines, arc_list
@@ -0,0 +1,207 @@
+## ----------------------------------------------------------------------------
+##
+##   File: checkpoint.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+__author__ = 'walter'
+
+import os
+import pickle
+import re
+import tempfile
+import threading
+
+CHECKPOINT_FORMAT = '{prefix}-{iteration:08d}.pkl'
+
+
+class Checkpointer:
+    """
+    Writes checkpoints of a language model during training and restores the
+    latest one to resume training.
+
+    A checkpoint holds the state of the language model, the iteration and the
+    state of the random generators. The state is copied when save is called,
+    the checkpoint file is written in a background thread while training
+    continues (at most one checkpoint is written at a time).
+
+    :param directory: directory for the checkpoint files
+    :param interval: write a checkpoint every interval iterations
+    :param keep_last: number of checkpoints to keep (None: keep all)
+    :param prefix: prefix of the checkpoint file names
+    """
+
+    def __init__(self, directory, interval=1, keep_last=3,
+                 prefix='checkpoint'):
+        if keep_last is not None and keep_last < 1:
+            raise ValueError('keep_last must be at least 1 (None: keep all), '
+                             'got {}'.format(keep_last))
+        self.directory = directory
+        self.interval = interval
+        self.keep_last = keep_last
+        self.prefix = prefix
+        self._pattern = re.compile(re.escape(prefix) + r'-(\d+)\.pkl$')
+        self._thread = None
+        self._error = None
+        os.makedirs(directory, exist_ok=True)
+
+    def checkpoints(self):
+        """ Returns the checkpoints in the directory
+
+        :return: list of (iteration, path) sorted by iteration
+        """
+
+        checkpoints = list()
+        for file_name in os.listdir(self.directory):
+            match = self._pattern.match(file_name)
+            if match:
+                checkpoints.append((int(match.group(1)),
+                                    os.path.join(self.directory, file_name)))
+        return sorted(checkpoints)
+
+    def latest(self):
+        """ Returns the path of the latest checkpoint (None: no checkpoint) """
+
+        checkpoints = self.checkpoints()
+        return checkpoints[-1][1] if checkpoints else None
+
+    def save(self, iteration, lm, force=False, **extra):
+        """ Writes a checkpoint if iteration is a multiple of the interval
+
+        :param iteration: number of finished iterations
+        :param lm: NHPYLM_wrapper to save
+        :param force: write the checkpoint regardless of the interval
+        :param extra: additional picklable values to store
+        :return: True if a checkpoint is written
+        """
+
+        if not force and (self.interval < 1 or iteration % self.interval):
+            return False
+
+        from nhpylm.c_core.nhpylm import get_random_state
+
+        # consistent snapshot, the (slow) writing is done in the background
+        checkpoint = dict(iteration=iteration, lm=lm.__reduce__(),
+                          random_state=get_random_state(), extra=extra)
+        self.wait()
+        self._thread = threading.Thread(
+            target=self._write, args=(checkpoint,), daemon=True)
+        self._thread.start()
+        return True
+
+    def wait(self):
+        """ Waits until the pending checkpoint is written and raises the
+        error of the writing if it failed
+        """
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, checkpoint):
+        path = os.path.join(self.directory, CHECKPOINT_FORMAT.format(
+            prefix=self.prefix, iteration=checkpoint['iteration']))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                            prefix='.' + self.prefix)
+            try:
+                with os.fdopen(fd, 'wb') as fid:
+                    pickle.dump(checkpoint, fid, pickle.HIGHEST_PROTOCOL)
+                    fid.flush()
+                    os.fsync(fid.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            if self.keep_last is not None:
+                for _, old_path in self.checkpoints()[:-self.keep_last]:
+                    os.remove(old_path)
+        except Exception as error:
+            self._error = error
+
+    def _read(self, path):
+        self.wait()
+        if path is None:
+            path = self.latest()
+            if path is None:
+                return None
+        with open(path, 'rb') as fid:
+            return pickle.load(fid)
+
+    def load(self, path=None):
+        """ Loads a checkpoint
+
+        :param path: path of the checkpoint (None: latest checkpoint)
+        :return: dict with iteration, lm (NHPYLM_wrapper), random_state and
+                 extra (None: no checkpoint)
+        """
+
+        checkpoint = self._read(path)
+        if checkpoint is not None:
+            cls, args, state = checkpoint['lm']
+            checkpoint['lm'] = cls(*args)
+            checkpoint['lm'].set_state(state)
+        return checkpoint
+
+    def restore(self, lm, path=None, return_extra=False):
+        """ Restores the state of lm and of the random generators from a
+        checkpoint
+
+        :param lm: NHPYLM_wrapper created with the arguments of the saved one
+        :param path: path of the checkpoint (None: latest checkpoint)
+        :param return_extra: also return the extra values of the checkpoint
+        :return: iteration of the checkpoint (0: no checkpoint) and, with
+                 return_extra, the dict of extra values
+        """
+
+        from nhpylm.c_core.nhpylm import set_random_state
+
+        checkpoint = self._read(path)
+        if checkpoint is None:
+            return (0, dict()) if return_extra else 0
+        lm.set_state(checkpoint['lm'][2])
+        set_random_state(checkpoint['random_state'])
+        if return_extra:
+            return checkpoint['iteration'], checkpoint['extra']
+        return checkpoint['iteration']
@@ -0,0 +1,259 @@
+## ----------------------------------------------------------------------------
+##
+##   File: distributed.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+__author__ = 'walter'
+
+import os
+from multiprocessing.connection import Client, Listener
+import numpy as np
+
+
+def _shard_bounds(sentence_offsets, num_shards):
+    """ Splits the sentences into contiguous shards with about the same
+    number of characters.
+
+    :param sentence_offsets: offsets of the sentences in the characters
+    :param num_shards: number of shards
+    :return: list with (first sentence, end sentence) of each shard
+    """
+
+    num_characters = sentence_offsets[-1]
+    bounds = np.searchsorted(
+        sentence_offsets[:-1],
+        np.arange(num_shards + 1) * num_characters / num_shards)
+    bounds[-1] = len(sentence_offsets) - 1
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _shard(characters, sentence_offsets, word_ends, begin, end):
+    """ Returns the CSR arrays of the sentences begin to end (exclusive) """
+
+    first, last = sentence_offsets[begin], sentence_offsets[end]
+    return (characters[first:last], sentence_offsets[begin:end + 1] - first,
+            None if word_ends is None else word_ends[first:last])
+
+
+def run_worker(address, authkey):
+    """ Runs a worker of train_distributed: the worker keeps a replica of the
+    language model with the segmentation of all sentences, samples the
+    segmentation of its own shard of sentences and exchanges the changed
+    segmentations with the other workers on request of the coordinator.
+
+    Workers on other hosts can be started with this function (the address
+    of the coordinator has to be reachable).
+
+    :param address: (host, port) of the coordinator
+    :param authkey: authentication key of the coordinator
+    """
+
+    from nhpylm.c_core.nhpylm import NHPYLM_wrapper, seed_random_state
+
+    with Client(address, authkey=authkey) as connection:
+        (lm_kwargs, characters, sentence_offsets, word_ends, (begin, end),
+         max_word_length, num_threads, seed) = connection.recv()
+        # forked workers inherit the random state of the coordinator
+        seed_random_state(seed)
+        lm = NHPYLM_wrapper(**lm_kwargs)
+        if word_ends is not None:
+            lm.resegment_sentences(characters, sentence_offsets, word_ends)
+        shard_characters, shard_offsets, shard_word_ends = _shard(
+            characters, sentence_offsets, word_ends, begin, end)
+        synced_word_ends = shard_word_ends
+
+        while True:
+            command, *args = connection.recv()
+            if command == 'sweep':
+                # sample the own shard and send its change since the last sync
+                loglikelihood = 0.
+                for _ in range(args[0]):
+                    shard_word_ends, loglikelihood = lm.segment_sentences(
+                        shard_characters, shard_offsets, shard_word_ends,
+                        max_word_length, num_threads)
+                connection.send(((begin, end, synced_word_ends,
+                                  shard_word_ends), loglikelihood))
+                synced_word_ends = shard_word_ends
+            elif command == 'apply':
+                # add the changes of the other workers to the replica
+                for delta_begin, delta_end, old_word_ends, new_word_ends \
+                        in args[0]:
+                    delta_characters, delta_offsets, _ = _shard(
+                        characters, sentence_offsets, None, delta_begin,
+                        delta_end)
+                    lm.resegment_sentences(delta_characters, delta_offsets,
+                                           new_word_ends, old_word_ends)
+            elif command == 'resample_hyperparameters':
+                lm.resample_hyperparameters()
+                connection.send(lm.hyperparameter)
+            elif command == 'set_hyperparameter':
+                lm.set_hyperparameter(args[0])
+            elif command == 'hyperparameter':
+                connection.send(lm.hyperparameter)
+            elif command == 'word_model_word_count':
+                connection.send(lm.word_model_word_count)
+            elif command == 'stop':
+                break
+            else:
+                raise ValueError('Unknown command {}'.format(command))
+
+
+def train_distributed(lm_kwargs, characters, sentence_offsets,
+                      word_ends=None, iterations=10, num_workers=2,
+                      local_sweeps=1, max_word_length=10, num_threads=1,
+                      resample_hyperparameters=True, num_local_workers=None,
+                      address=('localhost', 0), authkey=None, seed=None):
+    """
+    Samples the word segmentation of unsegmented character sentences with
+    several worker processes (approximate distributed gibbs sampling).
+
+    Each worker keeps a replica of the language model and samples the
+    segmentation of a shard of the sentences (see segment_sentences of
+    NHPYLM_wrapper). After local_sweeps sweeps the workers exchange the
+    changes of their segmentations, i.e. the removed and added words, and add
+    them to their replicas. The hyperparameters are resampled by the first
+    worker and copied to the other workers. The sentences are given in CSR
+    format.
+
+    :param lm_kwargs: arguments of NHPYLM_wrapper to create the replicas
+                      (symbols, word_model_order, ...)
+    :param characters: concatenated character ids of all sentences
+    :param sentence_offsets: offsets of the sentences in characters
+                             (number of sentences + 1 entries)
+    :param word_ends: initial segmentation (1 for each character ending a
+                      word). None: sample the initial segmentation
+    :param iterations: number of synchronisations
+    :param num_workers: number of workers
+    :param local_sweeps: number of sweeps over the shard of a worker between
+                         synchronisations
+    :param max_word_length: maximum number of characters of a word
+    :param num_threads: number of threads of each worker
+    :param resample_hyperparameters: resample the hyperparameters after each
+                                     synchronisation
+    :param num_local_workers: number of workers started as local processes,
+                              the others have to be started with run_worker
+                              (None: num_workers)
+    :param address: (host, port) the coordinator listens on (port 0: any
+                    free port)
+    :param authkey: authentication key for the workers (None: random key,
+                    only possible with local workers)
+    :param seed: seed of the random generators of the first worker, worker i
+                 uses seed + i (None: random seeds)
+    :return: tuple of the language model with the final segmentation, the
+             final word_ends and the list of the sum of the sentence log
+             likelihoods of the last sweep of each iteration
+    """
+
+    from multiprocessing import Process
+    from nhpylm.c_core.nhpylm import NHPYLM_wrapper
+
+    characters = np.asarray(characters, dtype=np.int32)
+    sentence_offsets = np.asarray(sentence_offsets, dtype=np.int32)
+    if word_ends is not None:
+        word_ends = np.asarray(word_ends, dtype=np.int32)
+    if num_local_workers is None:
+        num_local_workers = num_workers
+    if authkey is None:
+        if num_local_workers < num_workers:
+            raise ValueError('An authkey is needed for remote workers')
+        authkey = os.urandom(32)
+
+    processes = []
+    connections = []
+    with Listener(address, authkey=authkey) as listener:
+        try:
+            for _ in range(num_local_workers):
+                process = Process(target=run_worker,
+                                  args=(listener.address, authkey))
+                process.start()
+                processes.append(process)
+            connections = [listener.accept() for _ in range(num_workers)]
+
+            shard_bounds = _shard_bounds(sentence_offsets, num_workers)
+            for worker, (connection, bounds) in enumerate(
+                    zip(connections, shard_bounds)):
+                if seed is None:
+                    worker_seed = int.from_bytes(os.urandom(4), 'little')
+                else:
+                    worker_seed = (seed + worker) % 2 ** 32
+                connection.send((lm_kwargs, characters, sentence_offsets,
+                                 word_ends, bounds, max_word_length,
+                                 num_threads, worker_seed))
+
+            if word_ends is None:
+                word_ends = np.zeros_like(characters)
+            loglikelihoods = []
+            for _ in range(iterations):
+                for connection in connections:
+                    connection.send(('sweep', local_sweeps))
+                deltas, shard_loglikelihoods = zip(
+                    *[connection.recv() for connection in connections])
+                loglikelihoods.append(sum(shard_loglikelihoods))
+                for worker, connection in enumerate(connections):
+                    connection.send(('apply', deltas[:worker] +
+                                     deltas[worker + 1:]))
+                for begin, end, _, new_word_ends in deltas:
+                    first, last = sentence_offsets[begin], \
+                        sentence_offsets[end]
+                    word_ends[first:last] = new_word_ends
+
+                if resample_hyperparameters:
+                    connections[0].send(('resample_hyperparameters',))
+                    hyperparameter = connections[0].recv()
+                    for connection in connections[1:]:
+                        connection.send(('set_hyperparameter',
+                                         hyperparameter))
+
+            connections[0].send(('hyperparameter',))
+            hyperparameter = connections[0].recv()
+            for connection in connections:
+                connection.send(('stop',))
+        finally:
+            for connection in connections:
+                connection.close()
+            for process in processes:
+                process.join()
+
+    lm = NHPYLM_wrapper(**lm_kwargs)
+    lm.resegment_sentences(characters, sentence_offsets, word_ends)
+    lm.set_hyperparameter(hyperparameter)
+    return lm, word_ends, loglikelihoods
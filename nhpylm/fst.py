@@ -42,21 +42,63 @@
 ##
 ## ----------------------------------------------------------------------------
 
-from os import path, rename
+from os import path, close, makedirs, remove, replace, scandir, utime
+from shutil import copyfile, copyfileobj, copymode
+from nhpylm import process_caller
 from nhpylm.process_caller import run_processes
-from nhpylm.display_pdf import PDF as _PDF
-import tempfile
 from nhpylm.kaldi import get_kaldi_env
-from collections import namedtuple
+from array import array
+from collections import namedtuple, OrderedDict
+from functools import partial
+from itertools import chain, repeat
 from math import log
+import struct
+import time
+import numpy as np
 
-KALDI_ENV = get_kaldi_env()
 State = namedtuple('State', ['name', 'arcs', 'id'])
 FinalState = namedtuple('FinalState', ['state_id', 'weight'])
 Arc = namedtuple('Arc', ['src', 'dst', 'ilabel', 'olabel', 'weight'])
 
+# OpenFst binary format (VectorFst with StdArc)
+FST_MAGIC_NUMBER = 2125659606
+VECTOR_FST_VERSION = 2
+FST_PROPERTIES = {'expanded': 0x1, 'mutable': 0x2,
+                  'ilabel': 0x10000000, 'olabel': 0x40000000}
 
-def run_cmd(cmds, inputs=None, env=KALDI_ENV):
+# minimum number of arcs of a state to index its arcs in SimpleFST.find_arc
+ARC_INDEX_MIN_ARCS = 16
+COMPACT_ARC_INDEX_MIN_ARCS = 128
+NAN = float('nan')
+# number of lines per chunk when writing or piping fsts in text format
+TXT_CHUNK_SIZE = 65536
+# content addressed cache for fst build steps (see set_fst_cache)
+FST_CACHE = None
+
+
+def _kaldi_env():
+    """ Returns the environment used for the kaldi/OpenFst binaries. It is set
+    up on first use (not on import) and can be replaced by setting KALDI_ENV.
+
+    :return: environment dict
+    """
+
+    global KALDI_ENV
+    try:
+        return KALDI_ENV
+    except NameError:
+        KALDI_ENV = get_kaldi_env()
+        return KALDI_ENV
+
+
+def __getattr__(name):
+    if name == 'KALDI_ENV':
+        return _kaldi_env()
+    raise AttributeError('module {} has no attribute {}'.format(__name__,
+                                                                 name))
+
+
+def run_cmd(cmds, inputs=None, env=None):
     """ Starts multiple processes, waits and returns the outputs when available
 
     :param cmds: A list with the commands to call
@@ -66,7 +108,8 @@ def run_cmd(cmds, inputs=None, env=KALDI_ENV):
     :return: Stdout, Stderr and return code for each process
     """
 
-    return run_processes(cmds, inputs=inputs, environment=env)
+    return run_processes(cmds, inputs=inputs,
+                         environment=_kaldi_env() if env is None else env)
 
 def _add_input_output(input_files=None, output_file=None, pipe=True):
     """ Add input and output files to command in the form
@@ -457,6 +500,310 @@ def fstcompose_cmd(left_fst=None, right_fst=None, out_fst=None,
     return cmd
 
 
+class FstCache:
+    """
+    Content addressed cache for fst build products. Each build step is keyed
+    on a hash of its command (including all options), the content of its
+    input files and its piped input. The outputs are stored in a local
+    directory, the least recently used outputs are removed if the size of the
+    cache exceeds max_size.
+    """
+
+    def __init__(self, directory, max_size=10 * 2 ** 30):
+        """
+        Construct cache
+
+        :param directory: cache directory (created if not existing)
+        :param max_size: maximum size of all cached fsts in bytes
+        """
+
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        makedirs(directory, exist_ok=True)
+
+    def run(self, build_cmd, output_file, input_files=(), inputs=None):
+        """
+        Run command building output_file or copy output_file from the cache
+
+        :param build_cmd: function returning the command for a list of input
+                          files and an output file
+        :param output_file: output fst in binary format
+        :param input_files: list of input files (None: not used)
+        :param inputs: input piped to the command (see run_processes)
+        """
+
+        import hashlib
+        from tempfile import TemporaryFile
+
+        placeholders = [None if input_file is None else
+                        '@FST_CACHE_INPUT_{}@'.format(idx)
+                        for idx, input_file in enumerate(input_files)]
+        cmd = build_cmd(placeholders, '@FST_CACHE_OUTPUT@')
+        # the key is a hash of the digests of the command and of each input,
+        # so the bytes of one input can not be moved to another one
+        key = hashlib.sha256(hashlib.sha256(cmd.encode()).digest())
+        for input_file in input_files:
+            input_hash = hashlib.sha256()
+            if input_file is not None:
+                with open(input_file, 'rb') as fid:
+                    for chunk in iter(lambda: fid.read(2 ** 20), b''):
+                        input_hash.update(chunk)
+            key.update(input_hash.digest())
+        input_hash = hashlib.sha256()
+        spool = None
+        if isinstance(inputs, str):
+            input_hash.update(inputs.encode())
+        elif inputs is not None:
+            # callables and chunks are only run or iterated once: keep their
+            # output to pipe it later
+            spool = TemporaryFile()
+            writer = _HashWriter(input_hash, spool)
+            if callable(inputs):
+                inputs(writer)
+            else:
+                for chunk in inputs:
+                    writer.write(chunk.encode() if isinstance(chunk, str)
+                                 else chunk)
+            spool.seek(0)
+            inputs = partial(copyfileobj, spool)
+        key.update(input_hash.digest())
+        cached_file = self.get_path(key.hexdigest())
+
+        try:
+            try:
+                copyfile(cached_file, output_file)
+            except FileNotFoundError:
+                pass
+            else:
+                utime(cached_file)
+                self.hits += 1
+                return
+
+            for placeholder, input_file in zip(placeholders, input_files):
+                if placeholder is not None:
+                    cmd = cmd.replace(placeholder, input_file)
+            run_processes(cmd.replace('@FST_CACHE_OUTPUT@', output_file),
+                          inputs=inputs, environment=_kaldi_env())
+            self.misses += 1
+            self.put(cached_file, output_file)
+        finally:
+            if spool is not None:
+                spool.close()
+
+    def get_path(self, key):
+        """
+        Get path of cached fst for given key
+
+        :param key: hash of build step
+        :return: file name
+        """
+
+        return path.join(self.directory, key[:2], key + '.fst')
+
+    def put(self, cached_file, output_file):
+        """
+        Add output_file to cache and remove least recently used fsts
+
+        :param cached_file: file name in cache (see get_path)
+        :param output_file: fst to add
+        """
+
+        from tempfile import mkstemp
+
+        makedirs(path.dirname(cached_file), exist_ok=True)
+        fid, tmp_file = mkstemp(suffix='.tmp',
+                                         dir=path.dirname(cached_file))
+        close(fid)
+        try:
+            copyfile(output_file, tmp_file)
+            replace(tmp_file, cached_file)
+        except BaseException:
+            remove(tmp_file)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used fsts until the cache size is at most
+        max_size
+        """
+
+        cached_files = [(entry.stat().st_mtime, entry.stat().st_size,
+                         entry.path)
+                        for sub_directory in scandir(self.directory)
+                        if sub_directory.is_dir()
+                        for entry in scandir(sub_directory.path)
+                        if entry.name.endswith('.fst')]
+        size = sum(cached_file[1] for cached_file in cached_files)
+        for _, file_size, cached_file in sorted(cached_files):
+            if size <= self.max_size:
+                break
+            try:
+                remove(cached_file)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+
+class _HashWriter:
+    """
+    Binary file object updating a hash with the written data and writing it
+    to another file object
+    """
+
+    def __init__(self, hash_object, fid):
+        self.hash_object = hash_object
+        self.fid = fid
+
+    def write(self, data):
+        self.hash_object.update(data)
+        return self.fid.write(data)
+
+
+def set_fst_cache(directory, max_size=10 * 2 ** 30):
+    """ Enable the content addressed cache for fst build steps (compose,
+    build_from_txt, build_from_fst and write_fst with post processing)
+
+    :param directory: cache directory, None: disable cache
+    :param max_size: maximum size of all cached fsts in bytes
+    :return: FstCache instance (None if disabled)
+    """
+
+    global FST_CACHE
+    FST_CACHE = None if directory is None else FstCache(directory, max_size)
+    return FST_CACHE
+
+
+def _run_cached(build_cmd, output_file, input_files=(), inputs=None):
+    """ Run command building output_file, using the fst cache if enabled
+
+    :param build_cmd: function returning the command for a list of input
+                      files and an output file
+    :param output_file: output fst in binary format (None: not cached)
+    :param input_files: list of input files (None: not used)
+    :param inputs: input piped to the command (see run_processes)
+    """
+
+    if FST_CACHE is None or output_file is None:
+        run_processes(build_cmd(input_files, output_file), inputs=inputs,
+                      environment=_kaldi_env())
+    else:
+        FST_CACHE.run(build_cmd, output_file, input_files, inputs)
+
+
+class FstPipeline:
+    """
+    Build steps (e.g. build_from_txt, build_from_fst, arcsort, compose or
+    writing an fst) declared as a dependency graph. Steps whose dependencies
+    are finished run in parallel using at most max_workers threads (the
+    steps usually wait for OpenFst commands). The start and end time of each
+    step are recorded.
+
+    Example: build L and G in parallel, compose when both are written
+
+    >>> pipeline = FstPipeline()
+    >>> pipeline.add_step('L', lexicon.write_fst, 'L.fst')
+    >>> pipeline.add_step('G', G_fst.write_fst, 'G.fst')
+    >>> pipeline.add_step('L_G', compose, 'L.fst', 'G.fst', 'L_G.fst',
+    ...                   depends_on=['L', 'G'], determinize=True)
+    >>> timings = pipeline.run()
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        Construct empty pipeline
+
+        :param max_workers: maximum number of steps running at the same time
+                            (None: process_caller.MAX_PARALLEL_PROCESSES)
+        """
+
+        if max_workers is None:
+            max_workers = process_caller.MAX_PARALLEL_PROCESSES
+        self.max_workers = max_workers
+        self.steps = OrderedDict()
+        self.results = dict()
+        self.timings = dict()
+
+    def add_step(self, name, function, *args, depends_on=(), **kwargs):
+        """
+        Add step calling function(*args, **kwargs) after all steps in
+        depends_on are finished
+
+        :param name: unique name of the step
+        :param function: function to call
+        :param args: arguments for function
+        :param depends_on: list of names of previously added steps
+        :param kwargs: keyword arguments for function
+        """
+
+        if name in self.steps:
+            raise ValueError('Step {} already exists'.format(name))
+        depends_on = [depends_on] if isinstance(depends_on, str)\
+            else list(depends_on)
+        for dependency in depends_on:
+            if dependency not in self.steps:
+                raise ValueError('Unknown dependency {} of step {} (steps '
+                                 'have to be added after their '
+                                 'dependencies)'.format(dependency, name))
+        self.steps[name] = (function, args, kwargs, depends_on)
+
+    def run(self):
+        """
+        Run all steps. If a step fails, no further steps are started and the
+        error is raised after the running steps are finished.
+
+        :return: dictionary with duration of each step in seconds
+        """
+
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, \
+            wait
+
+        self.results = dict()
+        self.timings = dict()
+        pending = OrderedDict(self.steps)
+        running = dict()
+        error = None
+        start_time = time.perf_counter()
+
+        def run_step(name, function, args, kwargs):
+            step_start_time = time.perf_counter() - start_time
+            result = function(*args, **kwargs)
+            self.timings[name] = (step_start_time,
+                                  time.perf_counter() - start_time)
+            return result
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name, (function, args, kwargs, depends_on) in list(
+                            pending.items()):
+                        if all(dependency in self.results
+                               for dependency in depends_on):
+                            del pending[name]
+                            running[executor.submit(
+                                run_step, name, function, args,
+                                kwargs)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = RuntimeError(
+                                'Step {} failed: {}'.format(name, e))
+                            error.__cause__ = e
+
+        if error is not None:
+            raise error
+        return {name: end - start
+                for name, (start, end) in self.timings.items()}
+
+
 def build_from_txt(transducer_as_txt, output_file, isym_table=None,
                    osym_table=None, determinize=True, minimize=True,
                    addselfloops=False, disambig_in=0, disambig_out=0,
@@ -474,24 +821,196 @@ def build_from_txt(transducer_as_txt, output_file, isym_table=None,
     :param disambig_out: list of corresponding output symbols
     :param rmepsilon: rmepsilons
     :param sort_type: sort type - ilabel or olabel
-    :param input_as_txt: optional input in text format
+    :param input_as_txt: optional input in text format, either a string or
+                         an iterable of text chunks piped to fstcompile
                          (only used if transducer_as_txt is None)
     """
 
-    if addselfloops:
-        cmd = fstcompile_cmd(transducer_as_txt, isym_table=isym_table,
-                             osym_table=osym_table, determinize=determinize,
-                             minimize=minimize, arcsort=False)
-        cmd += fstaddselfloops_cmd(out_fst=output_file, disambig_in=disambig_in,
-                                   disambig_out=disambig_out,
-                                   rmepsilon=rmepsilon, sort_type=sort_type)
+    def build_cmd(input_files, output_file):
+        transducer_as_txt, isym_table, osym_table = input_files
+        if addselfloops:
+            cmd = fstcompile_cmd(transducer_as_txt, isym_table=isym_table,
+                                 osym_table=osym_table,
+                                 determinize=determinize, minimize=minimize,
+                                 arcsort=False)
+            cmd += fstaddselfloops_cmd(out_fst=output_file,
+                                       disambig_in=disambig_in,
+                                       disambig_out=disambig_out,
+                                       rmepsilon=rmepsilon,
+                                       sort_type=sort_type)
+        else:
+            cmd = fstcompile_cmd(transducer_as_txt, output_file, isym_table,
+                                 osym_table, determinize=determinize,
+                                 minimize=minimize, rmepsilon=rmepsilon,
+                                 sort_type=sort_type)
+        return cmd
+
+    _run_cached(build_cmd, output_file,
+                [transducer_as_txt, isym_table, osym_table], input_as_txt)
+
+
+def build_from_fst(input_file, output_file, determinize=True, minimize=True,
+                   addselfloops=False, disambig_in=0, disambig_out=0,
+                   rmepsilon=False, sort_type="ilabel", input_as_binary=None):
+    """ post process transducer in binary format (see build_from_txt)
+
+    :param input_file: input fst in binary format (None: stdin)
+    :param output_file: output fst in binary format
+    :param determinize: determinize fst
+    :param minimize: minimize fst
+    :param addselfloops: add self loops to fst
+    :param disambig_in: list of input symbols
+    :param disambig_out: list of corresponding output symbols
+    :param rmepsilon: rmepsilons
+    :param sort_type: sort type - ilabel or olabel
+    :param input_as_binary: optional function writing the input fst in binary
+                            format to a file object, which is piped to the
+                            commands (only used if input_file is None)
+    """
+
+    def build_cmd(input_files, output_file):
+        if addselfloops:
+            cmd = fstpostprocess_cmd(input_files[0], determinize=determinize,
+                                     minimize=minimize, arcsort=False)
+            cmd += fstaddselfloops_cmd(out_fst=output_file,
+                                       disambig_in=disambig_in,
+                                       disambig_out=disambig_out,
+                                       rmepsilon=rmepsilon,
+                                       sort_type=sort_type)
+        else:
+            cmd = fstpostprocess_cmd(input_files[0], output_file,
+                                     determinize=determinize,
+                                     minimize=minimize, rmepsilon=rmepsilon,
+                                     sort_type=sort_type)
+        return cmd
+
+    _run_cached(build_cmd, output_file, [input_file], input_as_binary)
+
+
+def read_symbol_table(filename):
+    """ read symbol table in text format (one 'symbol id' pair per line)
+
+    :param filename: symbol table file
+    :return: dictionary mapping symbols to ids
+    """
+
+    symbol_table = dict()
+    with open(filename) as fid:
+        for line in fid:
+            split_line = line.split()
+            if len(split_line) == 2:
+                symbol_table[split_line[0]] = int(split_line[1])
+    return symbol_table
+
+
+def write_vector_fst(filename, src, dst, ilabel, olabel, weight=None,
+                     start=0, final_states=(), final_weights=None,
+                     num_states=None, sort_type='ilabel'):
+    """ write fst from arc arrays in OpenFst binary format (VectorFst with
+    StdArc), without calling fstcompile
+
+    :param filename: output fst in binary format (file name or binary file
+                     object, e.g. stdin of a process)
+    :param src: array with source state id of each arc
+    :param dst: array with destination state id of each arc
+    :param ilabel: array with input label of each arc
+    :param olabel: array with output label of each arc
+    :param weight: array with weight of each arc (None: zero weights)
+    :param start: start state id (-1: no start state)
+    :param final_states: list of final state ids
+    :param final_weights: list of final weights (None: zero weights)
+    :param num_states: number of states (None: derive from the arcs)
+    :param sort_type: sort arcs of each state: 'ilabel', 'olabel' or None
+    """
+
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype='<i4')
+    ilabel = np.asarray(ilabel, dtype='<i4')
+    olabel = np.asarray(olabel, dtype='<i4')
+    if weight is None:
+        weight = np.zeros(len(src), dtype='<f4')
     else:
-        cmd = fstcompile_cmd(transducer_as_txt, output_file, isym_table,
-                             osym_table, determinize=determinize,
-                             minimize=minimize, rmepsilon=rmepsilon,
-                             sort_type=sort_type)
+        weight = np.asarray(weight, dtype='<f4')
+    final_states = np.asarray(final_states, dtype=np.int64)
+    if num_states is None:
+        num_states = int(max([start + 1] + [array.max() + 1 for array in
+                                            (src, dst, final_states)
+                                            if len(array) > 0]))
+
+    # sort arcs by source state (and label), keeping the order otherwise
+    properties = FST_PROPERTIES['expanded'] | FST_PROPERTIES['mutable']
+    if sort_type is None:
+        order = np.argsort(src, kind='stable')
+    elif sort_type in ['ilabel', 'olabel']:
+        labels = ilabel if sort_type == 'ilabel' else olabel
+        order = np.lexsort((labels, src))
+        properties |= FST_PROPERTIES[sort_type]
+    else:
+        raise Exception('Unknown sort_type {}!'.format(sort_type))
+    src, dst, ilabel, olabel, weight = \
+        src[order], dst[order], ilabel[order], olabel[order], weight[order]
+
+    final = np.full(num_states, np.inf, dtype='<f4')
+    final[final_states] = 0 if final_weights is None else final_weights
+    num_arcs_per_state = np.bincount(src, minlength=num_states)
+    arcs_begin = np.cumsum(num_arcs_per_state) - num_arcs_per_state
+
+    # each state: final weight (float), number of arcs (int64) and its arcs
+    # (ilabel, olabel, weight, nextstate) - all fields are multiples of int32
+    words = np.empty(3 * num_states + 4 * len(src), dtype='<i4')
+    state_begin = 3 * np.arange(num_states) + 4 * arcs_begin
+    words[state_begin] = final.view('<i4')
+    num_arcs_words = num_arcs_per_state.astype('<i8').view('<i4')
+    words[state_begin + 1] = num_arcs_words[0::2]
+    words[state_begin + 2] = num_arcs_words[1::2]
+    arc_begin = state_begin[src] + 3 + 4 * (np.arange(len(src)) -
+                                            arcs_begin[src])
+    words[arc_begin] = ilabel
+    words[arc_begin + 1] = olabel
+    words[arc_begin + 2] = weight.view('<i4')
+    words[arc_begin + 3] = dst
+
+    if hasattr(filename, 'write'):
+        _write_vector_fst(filename, words, properties, start, num_states,
+                          len(src))
+    else:
+        with open(filename, 'wb') as fid:
+            _write_vector_fst(fid, words, properties, start, num_states,
+                              len(src))
+
+
+def _write_vector_fst(fid, words, properties, start, num_states, num_arcs):
+    """ write header and states of a VectorFst to binary file object
+
+    :param fid: binary file object (file or pipe)
+    :param words: states and arcs as int32 words (see write_vector_fst)
+    :param properties: fst properties
+    :param start: start state id (-1: no start state)
+    :param num_states: number of states
+    :param num_arcs: number of arcs
+    """
+
+    fid.write(struct.pack('<i', FST_MAGIC_NUMBER))
+    for fst_string in (b'vector', b'standard'):
+        fid.write(struct.pack('<i', len(fst_string)) + fst_string)
+    fid.write(struct.pack('<iiQqqq', VECTOR_FST_VERSION, 0, properties,
+                          start, num_states, num_arcs))
+    fid.write(words.data)
 
-    run_processes(cmd, inputs=input_as_txt, environment=KALDI_ENV)
+
+def write_language_model_fst(lm, filename, sort_type='ilabel', **kwargs):
+    """ write language model fst in OpenFst binary format without
+    going through the text format
+
+    :param lm: language model (NHPYLM_wrapper)
+    :param filename: output fst in binary format
+    :param sort_type: sort arcs of each state: 'ilabel', 'olabel' or None
+    :param kwargs: see NHPYLM_wrapper.to_fst_arrays
+    """
+
+    (src, dst, labels, weights), start, final = lm.to_fst_arrays(**kwargs)
+    write_vector_fst(filename, src, dst, labels, labels, weights, start,
+                     [final], sort_type=sort_type)
 
 
 def compose(fst1, fst2, output_file, phi=None, **kwargs):
@@ -504,8 +1023,8 @@ def compose(fst1, fst2, output_file, phi=None, **kwargs):
     :param kwargs: see fstpostprocess_cmd
     """
 
-    cmd = fstcompose_cmd(fst1, fst2, output_file, phi, **kwargs)
-    run_processes(cmd, environment=KALDI_ENV)
+    _run_cached(lambda input_files, output_file: fstcompose_cmd(
+        *input_files, output_file, phi, **kwargs), output_file, [fst1, fst2])
 
 
 def shortestpath(fst, output_file, nshortest=1, **kwargs):
@@ -518,7 +1037,7 @@ def shortestpath(fst, output_file, nshortest=1, **kwargs):
     """
 
     cmd = fstshortestpath_cmd(fst, output_file, nshortest, **kwargs)
-    run_processes(cmd, environment=KALDI_ENV)
+    run_processes(cmd, environment=_kaldi_env())
 
 
 def randgen(fst, output_file, select='log_prob', npath=1, **kwargs):
@@ -534,7 +1053,7 @@ def randgen(fst, output_file, select='log_prob', npath=1, **kwargs):
     """
 
     cmd = fstrandgen_cmd(fst, output_file, select, npath, **kwargs)
-    run_processes(cmd, environment=KALDI_ENV)
+    run_processes(cmd, environment=_kaldi_env())
 
 
 def arcsort(fst, sort_type='ilabel'):
@@ -544,10 +1063,21 @@ def arcsort(fst, sort_type='ilabel'):
     :param sort_type: sort type: ilabel or olabel
     """
 
-    fst_tmp = path.join(path.dirname(fst), 'fst.tmp')
-    cmd = fstarcsort_cmd(fst, fst_tmp, sort_type)
-    run_processes(cmd, environment=KALDI_ENV)
-    rename(fst_tmp, fst)
+    from tempfile import mkstemp
+
+    # unique temporary file next to fst, so concurrent sorts do not collide
+    fid, fst_tmp = mkstemp(
+        suffix='.tmp', prefix=path.basename(fst) + '.',
+        dir=path.dirname(path.abspath(fst)))
+    close(fid)
+    try:
+        cmd = fstarcsort_cmd(fst, fst_tmp, sort_type)
+        run_processes(cmd, environment=_kaldi_env())
+        copymode(fst, fst_tmp)
+        replace(fst_tmp, fst)
+    except BaseException:
+        remove(fst_tmp)
+        raise
 
 
 def draw(isym_table, osym_table, fst_file, output_file):
@@ -566,11 +1096,11 @@ def draw(isym_table, osym_table, fst_file, output_file):
     cmd += ' {}'.format(fst_file)
     run_processes(
         cmd + ' > {}'.format(output_file.replace('pdf', 'dot')),
-        environment=KALDI_ENV)
+        environment=_kaldi_env())
 
     cmd += ' | dot -Tpdf > {}'.format(output_file)
 
-    run_processes(cmd, environment=KALDI_ENV)
+    run_processes(cmd, environment=_kaldi_env())
 
 
 def print(fst_file, isym_table, osym_table):
@@ -581,8 +1111,10 @@ def print(fst_file, isym_table, osym_table):
     :param osym_table: output symbol table file
     :return: PDF object to display in notebook
     """
+    from nhpylm.display_pdf import PDF
+
     draw(isym_table, osym_table, fst_file, fst_file + '.pdf')
-    return _PDF(fst_file + '.pdf')
+    return PDF(fst_file + '.pdf')
 
 
 class SimpleFST:
@@ -598,6 +1130,10 @@ class SimpleFST:
         self.states = list()
         self.final_states = list()
         self.start_state = None
+        # per state: last arc for (ilabel, None, None), (ilabel, olabel, None)
+        # and (ilabel, olabel, dst), built on the first lookup in a state with
+        # at least ARC_INDEX_MIN_ARCS arcs
+        self.arc_index = list()
 
     def add_state(self, name=''):
         """
@@ -608,6 +1144,7 @@ class SimpleFST:
         """
 
         self.states.append(State(name, list(), len(self.states)))
+        self.arc_index.append(None)
         return len(self.states) - 1
 
     def add_arc(self, src, dst, ilabel, olabel, weight=None, mode='always'):
@@ -631,7 +1168,38 @@ class SimpleFST:
             if self.find_arc(src, ilabel, olabel, dst):
                 return
 
-        self.states[src].arcs.append(Arc(src, dst, ilabel, olabel, weight))
+        arc = Arc(src, dst, ilabel, olabel, weight)
+        self.states[src].arcs.append(arc)
+        if self.arc_index[src] is not None:
+            self._index_arc(self.arc_index[src], arc)
+
+    def add_arcs(self, src, dst, ilabels, olabels, weights=None):
+        """
+        Add multiple arcs. This is the same as calling add_arc for each arc
+        in the given order.
+
+        :param src: list of source state ids
+        :param dst: list of destination state ids
+        :param ilabels: list of input labels
+        :param olabels: list of output labels
+        :param weights: list of weights for transitions (None: no weights)
+        """
+
+        if weights is None:
+            weights = repeat(None)
+        states = self.states
+        arc_index = self.arc_index
+        for arc in map(Arc, src, dst, ilabels, olabels, weights):
+            assert arc.dst < len(states)
+            states[arc.src].arcs.append(arc)
+            if arc_index[arc.src] is not None:
+                self._index_arc(arc_index[arc.src], arc)
+
+    @staticmethod
+    def _index_arc(arc_index, arc):
+        arc_index[(arc.ilabel, None, None)] = arc
+        arc_index[(arc.ilabel, arc.olabel, None)] = arc
+        arc_index[(arc.ilabel, arc.olabel, arc.dst)] = arc
 
     def set_final(self, state_id, weight=None):
         """
@@ -642,7 +1210,7 @@ class SimpleFST:
         :param weight: weight of state to be final
         """
 
-        assert state_id < len(self.states)
+        assert state_id < self.num_states
         self.final_states.append(FinalState(state_id, weight))
 
     def set_start(self, state_id):
@@ -653,13 +1221,15 @@ class SimpleFST:
         :param state_id: id of state to be start state
         """
 
-        assert state_id < len(self.states)
+        assert state_id < self.num_states
         self.start_state = state_id
 
     def find_arc(self, src, ilabel=None, olabel=None, dst=None):
         """
         Find last arc originating from state src with input label ilabel
-        and output label olabel going to state dst
+        and output label olabel going to state dst. Lookups by ilabel,
+        (ilabel, olabel) or (ilabel, olabel, dst) in states with many arcs
+        use the arc index, all other lookups scan the arcs of the state.
 
         :param src: source state id
         :param ilabel: input label
@@ -669,6 +1239,13 @@ class SimpleFST:
         """
 
         assert src < len(self.states)
+        if ilabel is not None and (olabel is not None or dst is None) and \
+                len(self.states[src].arcs) >= ARC_INDEX_MIN_ARCS:
+            if self.arc_index[src] is None:
+                self.arc_index[src] = dict()
+                for arc in self.states[src].arcs:
+                    self._index_arc(self.arc_index[src], arc)
+            return self.arc_index[src].get((ilabel, olabel, dst))
         for arc in reversed(self.states[src].arcs):
             if ((ilabel is None) or (arc.ilabel == ilabel)) and\
                     ((olabel is None) or (arc.olabel == olabel)) and\
@@ -718,17 +1295,34 @@ class SimpleFST:
 
         :return: text version of fst
         """
+
+        return ''.join(self.get_txt_chunks())[:-1]
+
+    def get_txt_chunks(self, chunk_size=TXT_CHUNK_SIZE):
+        """
+        Get text version of fst in chunks of about chunk_size lines, each
+        ending with a newline. This allows to write or pipe the fst without
+        building the whole text at once.
+
+        :param chunk_size: number of lines per chunk
+        :return: generator of text chunks
+        """
+
         txt_arc_list = list()
-        if self.start_state is not None:
-            txt_arc_list.append(
-                self._get_txt_arcs(self.states[self.start_state].arcs))
-        for state in self.states:
-            if state.id != self.start_state:
-                txt_arc_list.append(self._get_txt_arcs(state.arcs))
+        num_lines = 0
+        for state_id in _txt_state_order(self.num_states, self.start_state):
+            arcs = self.get_arcs(state_id)
+            txt_arc_list.append(self._get_txt_arcs(arcs))
+            num_lines += max(len(arcs), 1)
+            if num_lines >= chunk_size:
+                yield '\n'.join(txt_arc_list) + '\n'
+                txt_arc_list = list()
+                num_lines = 0
         for final_state in self.final_states:
             txt_arc_list.append(self._get_txt_arcs(final_state))
 
-        return '\n'.join(txt_arc_list)
+        if txt_arc_list:
+            yield '\n'.join(txt_arc_list) + '\n'
 
     def write_txt(self, filename):
         """
@@ -738,14 +1332,17 @@ class SimpleFST:
         """
 
         with open(filename, 'w') as fid:
-            fid.write(self.get_txt())
+            fid.writelines(self.get_txt_chunks())
 
     def write_fst(self, filename, determinize=False, minimize=True,
                   addselfloops=False, disambig_in=0, disambig_out=0,
                   rmepsilon=False, sort_type='ilabel', isyms=None,
                   osyms=None):
         """
-        Write FST in openfst format.
+        Write FST in openfst format. If no post processing (determinize,
+        minimize, addselfloops, rmepsilon) is requested, the binary format is
+        written directly, otherwise the binary is piped to the post
+        processing commands.
 
         :param filename: filename to write to
         :param determinize: determinize written fst
@@ -760,14 +1357,44 @@ class SimpleFST:
         :param osyms: filename of output symbols mapping (symbol id)
         """
 
-        with tempfile.NamedTemporaryFile() as fst_txt:
-            self.write_txt(fst_txt.name)
-            build_from_txt(
-                fst_txt.name, filename, isym_table=isyms, osym_table=osyms,
-                determinize=determinize, minimize=minimize,
-                addselfloops=addselfloops, disambig_in=disambig_in,
-                disambig_out=disambig_out, rmepsilon=rmepsilon,
-                sort_type=sort_type)
+        if not (determinize or minimize or addselfloops or rmepsilon):
+            self.write_binary(filename, sort_type, isyms, osyms)
+            return
+
+        build_from_fst(
+            None, filename, determinize=determinize, minimize=minimize,
+            addselfloops=addselfloops, disambig_in=disambig_in,
+            disambig_out=disambig_out, rmepsilon=rmepsilon,
+            sort_type=sort_type,
+            input_as_binary=lambda fid: self.write_binary(fid, None, isyms,
+                                                          osyms))
+
+    def write_binary(self, filename, sort_type='ilabel', isyms=None,
+                     osyms=None):
+        """
+        Write FST in openfst binary format without calling fstcompile.
+
+        :param filename: filename (or binary file object) to write to
+        :param sort_type: sort arcs, e.g. 'ilabel', 'olabel' or None
+        :param isyms: filename of input symbols mapping (symbol id), only
+                      used for labels which are not ints
+        :param osyms: filename of output symbols mapping (symbol id), only
+                      used for labels which are not ints
+        """
+
+        isym_table = read_symbol_table(isyms) if isyms else dict()
+        osym_table = read_symbol_table(osyms) if osyms else dict()
+        arcs = [arc for state in self.states for arc in state.arcs]
+        write_vector_fst(
+            filename,
+            [arc.src for arc in arcs], [arc.dst for arc in arcs],
+            [isym_table.get(arc.ilabel, arc.ilabel) for arc in arcs],
+            [osym_table.get(arc.olabel, arc.olabel) for arc in arcs],
+            [arc.weight or 0 for arc in arcs],
+            -1 if self.start_state is None else self.start_state,
+            [final_state.state_id for final_state in self.final_states],
+            [final_state.weight or 0 for final_state in self.final_states],
+            self.num_states, sort_type)
 
     def get_state_name(self, state_id):
         """
@@ -827,6 +1454,390 @@ class SimpleFST:
         return '\n'.join(text_arc_list)
 
 
+class CompactSimpleFST(SimpleFST):
+    """
+    SimpleFST storing the arcs in growable columns (src, dst, ilabel, olabel,
+    weight) instead of lists of Arc objects. Labels have to be non negative
+    ints. The arcs of each state are linked in the order they are added, the
+    arcs sorted by source state (CSR offsets) are computed as numpy arrays
+    when needed. The columns are array.array buffers allowing fast appends and
+    element access while building the fst.
+    """
+
+    def __init__(self):
+        """
+        Construct empty FST
+        """
+
+        self.final_states = list()
+        self.start_state = None
+        self.arc_index = list()
+        self.state_names = list()
+        self._arcs = {column: array(typecode) for column, typecode in
+                      [('src', 'i'), ('dst', 'i'), ('ilabel', 'i'),
+                       ('olabel', 'i'), ('weight', 'd'), ('next', 'i')]}
+        self._first_arc = array('i')
+        self._last_arc = array('i')
+        self._num_state_arcs = array('i')
+        self._csr = None
+
+    def add_state(self, name=''):
+        """
+        Add state to FST (states get integer state ids assigned, stating
+        from 0)
+
+        :param name: name assigned to the state
+        :return: integer state id
+        """
+
+        self._first_arc.append(-1)
+        self._last_arc.append(-1)
+        self._num_state_arcs.append(0)
+        self.state_names.append(name)
+        self.arc_index.append(None)
+        self._csr = None
+        return len(self.state_names) - 1
+
+    def add_arc(self, src, dst, ilabel, olabel, weight=None, mode='always'):
+        """
+        Add arc to state src going to state dst with input label ilabel,
+        output label olabel and weight weight.
+
+        :param src: source state id
+        :param dst: destination state id
+        :param ilabel: input label
+        :param olabel: output label
+        :param weight: weight for transition
+        :param mode: how to add arcs:
+                     'always: always add arcs, even if duplicated
+                     'if_not_exists': only add if arc dows not exist
+        """
+
+        assert src < self.num_states
+        assert dst < self.num_states
+        if mode == 'if_not_exists':
+            if self.find_arc(src, ilabel, olabel, dst):
+                return
+
+        arcs = self._arcs
+        arc_id = len(arcs['src'])
+        arcs['src'].append(src)
+        arcs['dst'].append(dst)
+        arcs['ilabel'].append(ilabel)
+        arcs['olabel'].append(olabel)
+        arcs['weight'].append(NAN if weight is None else weight)
+        arcs['next'].append(-1)
+        if self._last_arc[src] == -1:
+            self._first_arc[src] = arc_id
+        else:
+            arcs['next'][self._last_arc[src]] = arc_id
+        self._last_arc[src] = arc_id
+        self._num_state_arcs[src] += 1
+        self._csr = None
+        if self.arc_index[src] is not None:
+            self._index_arc_id(self.arc_index[src], arc_id)
+
+    def add_arcs(self, src, dst, ilabels, olabels, weights=None):
+        """
+        Add multiple arcs. This is the same as calling add_arc for each arc
+        in the given order.
+
+        :param src: list of source state ids
+        :param dst: list of destination state ids
+        :param ilabels: list of input labels
+        :param olabels: list of output labels
+        :param weights: list of weights for transitions (None: no weights)
+        """
+
+        src = np.asarray(src, dtype=np.int32)
+        dst = np.asarray(dst, dtype=np.int32)
+        num_arcs = len(src)
+        if num_arcs == 0:
+            return
+        assert src.max() < self.num_states and dst.max() < self.num_states
+        if weights is None:
+            weights = np.full(num_arcs, NAN)
+        else:
+            weights = np.array([NAN if weight is None else weight
+                                for weight in weights], dtype=np.float64)
+
+        # link the new arcs of each state in the given order and append them
+        # to the arcs already added to the state
+        arc_ids = self.num_arcs + np.arange(num_arcs, dtype=np.int32)
+        order = np.argsort(src, kind='stable')
+        src_sorted = src[order]
+        arc_ids_sorted = arc_ids[order]
+        same_state = src_sorted[1:] == src_sorted[:-1]
+        next_arc = np.full(num_arcs, -1, dtype=np.int32)
+        next_arc[arc_ids_sorted[:-1][same_state] - self.num_arcs] =\
+            arc_ids_sorted[1:][same_state]
+        is_first = np.concatenate([[True], ~same_state])
+        is_last = np.concatenate([~same_state, [True]])
+        states = src_sorted[is_first]
+        first_arc = np.frombuffer(self._first_arc, dtype=np.int32)
+        last_arc = np.frombuffer(self._last_arc, dtype=np.int32)
+        num_state_arcs = np.frombuffer(self._num_state_arcs, dtype=np.int32)
+        previous_arc = last_arc[states]
+        has_arcs = previous_arc != -1
+        previous_next_arc = np.frombuffer(self._arcs['next'], dtype=np.int32)
+        previous_next_arc[previous_arc[has_arcs]] =\
+            arc_ids_sorted[is_first][has_arcs]
+        first_arc[states[~has_arcs]] = arc_ids_sorted[is_first][~has_arcs]
+        last_arc[states] = arc_ids_sorted[is_last]
+        num_state_arcs[states] += np.diff(
+            np.append(np.flatnonzero(is_first), num_arcs)).astype(np.int32)
+        # release the buffers before resizing the columns
+        del first_arc, last_arc, num_state_arcs, previous_next_arc
+
+        for column, values in [('src', src), ('dst', dst),
+                               ('ilabel', ilabels), ('olabel', olabels),
+                               ('weight', weights), ('next', next_arc)]:
+            self._arcs[column].frombytes(np.asarray(
+                values, dtype=np.float64 if column == 'weight' else
+                np.int32).tobytes())
+        self._csr = None
+
+        for state_id in states.tolist():
+            if self.arc_index[state_id] is not None:
+                for arc_id in arc_ids[src == state_id].tolist():
+                    self._index_arc_id(self.arc_index[state_id], arc_id)
+
+    def _index_arc_id(self, arc_index, arc_id):
+        ilabel = self._arcs['ilabel'][arc_id]
+        arc_index[~ilabel] = arc_id
+        arc_index[(ilabel << 32) | self._arcs['olabel'][arc_id]] = arc_id
+
+    def _get_arc_ids(self, src):
+        arc_ids = list()
+        arc_id = self._first_arc[src]
+        next_arc = self._arcs['next']
+        while arc_id != -1:
+            arc_ids.append(arc_id)
+            arc_id = next_arc[arc_id]
+        return arc_ids
+
+    def _get_arc(self, arc_id):
+        arcs = self._arcs
+        weight = arcs['weight'][arc_id]
+        return Arc(arcs['src'][arc_id], arcs['dst'][arc_id],
+                   arcs['ilabel'][arc_id], arcs['olabel'][arc_id],
+                   None if weight != weight else weight)
+
+    def find_arc(self, src, ilabel=None, olabel=None, dst=None):
+        """
+        Find last arc originating from state src with input label ilabel
+        and output label olabel going to state dst. Lookups by ilabel,
+        (ilabel, olabel) or (ilabel, olabel, dst) in states with many arcs
+        use the arc index, all other lookups scan the arcs of the state.
+
+        :param src: source state id
+        :param ilabel: input label
+        :param olabel: output label
+        :param dst: destination state id
+        :return: Arc object instance
+        """
+
+        assert src < self.num_states
+        arcs = self._arcs
+        if ilabel is not None and (olabel is not None or dst is None) and \
+                self._num_state_arcs[src] >= COMPACT_ARC_INDEX_MIN_ARCS:
+            if self.arc_index[src] is None:
+                self.arc_index[src] = dict()
+                for arc_id in self._get_arc_ids(src):
+                    self._index_arc_id(self.arc_index[src], arc_id)
+            arc_id = self.arc_index[src].get(
+                ~ilabel if olabel is None else (ilabel << 32) | olabel)
+            if arc_id is None:
+                return None
+            if dst is None or arcs['dst'][arc_id] == dst:
+                return self._get_arc(arc_id)
+
+        for arc_id in reversed(self._get_arc_ids(src)):
+            if ((ilabel is None) or (arcs['ilabel'][arc_id] == ilabel)) and \
+                    ((olabel is None) or
+                     (arcs['olabel'][arc_id] == olabel)) and \
+                    ((dst is None) or (arcs['dst'][arc_id] == dst)):
+                return self._get_arc(arc_id)
+
+    def get_arcs(self, src):
+        """
+        Get all arcs originating from state src
+
+        :param src: source state id
+        :return: list of Arc object instances
+        """
+
+        assert src < self.num_states
+        return [self._get_arc(arc_id) for arc_id in self._get_arc_ids(src)]
+
+    def get_arc_arrays(self):
+        """
+        Get the arcs sorted by source state (keeping the order in which the
+        arcs of a state were added) and the CSR offsets of the states
+
+        :return: dict with arrays src, dst, ilabel, olabel and weight
+                 (nan for arcs without weight) and array of state offsets
+        """
+
+        if self._csr is None:
+            src = np.array(self._arcs['src'], dtype=np.int32)
+            order = np.argsort(src, kind='stable')
+            arcs = {column: np.array(self._arcs[column])[order]
+                    for column in ['dst', 'ilabel', 'olabel', 'weight']}
+            arcs['src'] = src[order]
+            offsets = np.zeros(self.num_states + 1, dtype=np.int64)
+            np.cumsum(np.array(self._num_state_arcs), out=offsets[1:])
+            self._csr = arcs, offsets
+        return self._csr
+
+    def get_txt_chunks(self, chunk_size=TXT_CHUNK_SIZE):
+        """
+        Get text version of fst in chunks of about chunk_size lines, each
+        ending with a newline. The lines of a chunk are built vectorised from
+        the arc arrays of a range of states.
+
+        :param chunk_size: number of lines per chunk
+        :return: generator of text chunks
+        """
+
+        arcs, offsets = self.get_arc_arrays()
+        state_ranges = [(0, self.num_states)]
+        if self.start_state is not None:
+            state_ranges = [(self.start_state, self.start_state + 1),
+                            (0, self.start_state),
+                            (self.start_state + 1, self.num_states)]
+        for begin_state, end_state in state_ranges:
+            while begin_state < end_state:
+                # at least one state, at most chunk_size arcs otherwise
+                chunk_end_state = min(end_state, max(
+                    begin_state + 1, np.searchsorted(
+                        offsets, offsets[begin_state] + chunk_size,
+                        side='right') - 1))
+                yield self._get_txt_lines(arcs, offsets, begin_state,
+                                          chunk_end_state)
+                begin_state = chunk_end_state
+
+        if self.final_states:
+            yield '\n'.join(_join_txt_columns(
+                [np.array([final_state.state_id
+                           for final_state in self.final_states], dtype=int)],
+                np.array([final_state.weight or NAN
+                          for final_state in self.final_states],
+                         dtype=float))) + '\n'
+
+    def _get_txt_lines(self, arcs, offsets, begin_state, end_state):
+        """
+        Get arcs of states begin_state, ..., end_state - 1 in txt format,
+        states without arcs are written as empty lines
+
+        :param arcs: dict with arc arrays (see get_arc_arrays)
+        :param offsets: offsets of the arcs of each state
+        :param begin_state: first state id
+        :param end_state: last state id + 1
+        :return: arcs in txt format
+        """
+
+        begin, end = offsets[begin_state], offsets[end_state]
+        txt_arcs = _join_txt_columns(
+            [arcs[column][begin:end]
+             for column in ['src', 'dst', 'ilabel', 'olabel']],
+            arcs['weight'][begin:end])
+        num_state_arcs = np.diff(offsets[begin_state:end_state + 1])
+        line_offsets = np.zeros(end_state - begin_state + 1, dtype=np.int64)
+        np.cumsum(np.maximum(num_state_arcs, 1), out=line_offsets[1:])
+        txt_lines = np.full(line_offsets[-1], '', dtype=object)
+        states = arcs['src'][begin:end] - begin_state
+        txt_lines[line_offsets[states] + np.arange(begin, end) -
+                  offsets[states + begin_state]] = txt_arcs
+        return '\n'.join(txt_lines) + '\n'
+
+    def write_binary(self, filename, sort_type='ilabel', isyms=None,
+                     osyms=None):
+        """
+        Write FST in openfst binary format without calling fstcompile.
+
+        :param filename: filename (or binary file object) to write to
+        :param sort_type: sort arcs, e.g. 'ilabel', 'olabel' or None
+        :param isyms: unused (labels are ints)
+        :param osyms: unused (labels are ints)
+        """
+
+        arcs, _ = self.get_arc_arrays()
+        write_vector_fst(
+            filename, arcs['src'], arcs['dst'], arcs['ilabel'],
+            arcs['olabel'], np.nan_to_num(arcs['weight']),
+            -1 if self.start_state is None else self.start_state,
+            [final_state.state_id for final_state in self.final_states],
+            [final_state.weight or 0 for final_state in self.final_states],
+            self.num_states, sort_type)
+
+    def get_state_name(self, state_id):
+        """
+        return name of state with id state id
+
+        :param state_id: state id
+        :return: state name
+        """
+
+        return self.state_names[state_id]
+
+    @property
+    def num_states(self):
+        """
+        Return number of states
+
+        :return: Number of states
+        """
+
+        return len(self.state_names)
+
+    @property
+    def num_arcs(self):
+        """
+        Return number of arcs
+
+        :return: Number of arcs
+        """
+
+        return len(self._arcs['src'])
+
+
+def _join_txt_columns(columns, weights):
+    """
+    Join integer columns and optional weights (nan or 0: no weight)
+    to lines of the fst text format
+
+    :param columns: list of integer arrays
+    :param weights: array of weights
+    :return: array of lines
+    """
+
+    lines = columns[0].astype(str)
+    for column in columns[1:]:
+        lines = np.char.add(np.char.add(lines, '\t'), column.astype(str))
+    has_weight = (weights == weights) & (weights != 0)
+    lines = lines.astype(object)
+    lines[has_weight] = np.char.add(
+        np.char.add(lines[has_weight].astype(str), '\t'),
+        weights[has_weight].astype(str))
+    return lines
+
+
+def _txt_state_order(num_states, start_state=None):
+    """
+    Order of the states in the fst text format (start state first)
+
+    :param num_states: number of states
+    :param start_state: start state id
+    :return: iterator over state ids
+    """
+
+    if start_state is None:
+        return iter(range(num_states))
+    return chain([start_state], range(start_state),
+                 range(start_state + 1, num_states))
+
+
 def build_fst_for_sequence(sequence):
     """
     Build a fst from a symbol sequence (list of symbols)
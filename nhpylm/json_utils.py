@@ -42,6 +42,17 @@
 ##
 ## ----------------------------------------------------------------------------
 
+import json
+import mmap
+import os
+import re
+
+INDEX_DEPTH = 4
+INDEX_SUFFIX = '.index'
+
+_JSON_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\],:]')
+
+
 def traverse_to_dict(data, path, delimiter='/'):
     """ Returns the dictionary at the end of the path defined by `path`
 
@@ -52,6 +63,9 @@ def traverse_to_dict(data, path, delimiter='/'):
     :return: dict at the end of the path
     """
 
+    if isinstance(data, JsonDatabase):
+        return data.get(path, delimiter)
+
     path = path.strip('/').split(delimiter)
     cur_dict = data[path[0]]
     for next_level in path[1:]:
@@ -93,9 +107,10 @@ def get_flist_for_channel(flist, ch):
     :return: A dict with the ids and the files for the specific channel
     """
 
-    assert ch in get_available_channels(flist), \
+    channels = get_available_channels(flist)
+    assert ch in channels, \
         'Could not find channel {ch}. Available channels are {chs}' \
-        .format(ch=ch, chs=get_available_channels(flist))
+        .format(ch=ch, chs=channels)
 
     ret_flist = dict()
     for utt in flist:
@@ -110,3 +125,171 @@ def get_flist_for_channel(flist, ch):
     assert len(ret_flist) > 0, \
         'Could not find any files for channel {c}'.format(c=str(ch))
     return ret_flist
+
+
+def build_index(json_file, depth=INDEX_DEPTH):
+    """ Scans a json file once and returns the byte ranges of all objects
+    and arrays up to the given depth, e.g. 'train/flists/wav/si_tr' for
+    depth 4. Elements inside of arrays are not indexed.
+
+    :param json_file: path to the json file
+    :param depth: maximum number of keys of an indexed path
+    :return: A dict with paths (keys joined with '/') as keys and
+        (begin, end) byte offsets in the json file as values
+    """
+
+    index = dict()
+    with open(json_file, 'rb') as fid, \
+            mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # stack entries: [path, begin, is object, key]
+        stack = list()
+        for match in _JSON_TOKEN.finditer(data):
+            token = match.group()
+            if token.startswith(b'"'):
+                if stack and stack[-1][2] and stack[-1][3] is None:
+                    stack[-1][3] = json.loads(token.decode())
+            elif token in (b'{', b'['):
+                if not stack:
+                    path = ''
+                elif stack[-1][0] is None or not stack[-1][2] \
+                        or len(stack) > depth:
+                    path = None
+                else:
+                    path = '/'.join(filter(None, [stack[-1][0],
+                                                  stack[-1][3]]))
+                stack.append([path, match.start(), token == b'{', None])
+            elif token in (b'}', b']'):
+                path, begin, _, _ = stack.pop()
+                if path is not None:
+                    index[path] = (begin, match.end())
+                if stack:
+                    stack[-1][3] = None
+            elif token == b',' and stack:
+                stack[-1][3] = None
+    return index
+
+
+class JsonDatabase:
+    """ Lazily loaded json database. A one-time index with the byte ranges
+    of all paths up to a given depth is stored next to the json file
+    (`<json_file>.index`, kept in memory only if it can not be written) and
+    rebuilt if the json file changes. Only the subtrees needed for a
+    requested path are loaded. Loaded subtrees are kept in memory until
+    clear_cache is called, paths below a loaded subtree are served from it.
+
+    Example:
+        >>> database = JsonDatabase('reverb.json')
+        >>> files = database.get('train/flists/wav/si_tr')
+        >>> channel_files = database.get_flist_for_channel(
+        ...     'train/flists/wav/si_tr', 'observed/CH1')
+    """
+
+    def __init__(self, json_file, index_file=None, depth=INDEX_DEPTH):
+        """
+        :param json_file: path to the json file
+        :param index_file: path to the index file
+            (None: json_file + INDEX_SUFFIX)
+        :param depth: maximum number of keys of an indexed path
+        """
+
+        self.json_file = json_file
+        self.index_file = index_file or json_file + INDEX_SUFFIX
+        self.depth = depth
+        self.index = self._load_index()
+        self._subtrees = dict()
+        self._channel_flists = dict()
+
+    def _load_index(self):
+        stat = os.stat(self.json_file)
+        source = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                  'depth': self.depth}
+        try:
+            with open(self.index_file) as fid:
+                index = json.load(fid)
+            if index['source'] == source:
+                return {path: tuple(byte_range)
+                        for path, byte_range in index['paths'].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        paths = build_index(self.json_file, self.depth)
+        temp_file = '{}.{}.tmp'.format(self.index_file, os.getpid())
+        try:
+            with open(temp_file, 'w') as fid:
+                json.dump({'source': source, 'paths': paths}, fid)
+            os.replace(temp_file, self.index_file)
+        except OSError:
+            # e.g. read-only database location: keep the index in memory
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+        return paths
+
+    def _load(self, path):
+        subtree = self._subtrees.get(path)
+        if subtree is None:
+            begin, end = self.index[path]
+            with open(self.json_file, 'rb') as fid:
+                fid.seek(begin)
+                subtree = json.loads(fid.read(end - begin).decode())
+            self._subtrees[path] = subtree
+        return subtree
+
+    def get(self, path, delimiter='/'):
+        """ Returns the data at the end of the path defined by `path`.
+        The data is taken from the deepest loaded subtree along the path,
+        otherwise only the deepest indexed subtree along the path is loaded.
+
+        :param path: A string defining the path with or without
+            leading and trailing slashes
+        :param delimiter: The delimiter to convert the string to a list
+        :return: data at the end of the path
+        """
+
+        keys = path.strip('/').split(delimiter)
+        indexed_prefixes = [num_keys for num_keys in range(len(keys), -1, -1)
+                            if '/'.join(keys[:num_keys]) in self.index]
+        if not indexed_prefixes:
+            raise KeyError(path)
+        num_keys = next((num_keys for num_keys in indexed_prefixes
+                         if '/'.join(keys[:num_keys]) in self._subtrees),
+                        indexed_prefixes[0])
+        indexed_path = '/'.join(keys[:num_keys])
+        data = self._load(indexed_path)
+        if num_keys == len(keys):
+            return data
+        return traverse_to_dict(data, '/'.join(keys[num_keys:]))
+
+    def keys(self, path=''):
+        """ Returns the keys of the object at `path`
+
+        :param path: A string defining the path
+        :return: list of keys
+        """
+
+        return list(self.get(path).keys())
+
+    def get_flist_for_channel(self, flist, ch):
+        """ Returns a flist containing only the files for a specific channel
+        (see get_flist_for_channel). The result is cached per flist and
+        channel.
+
+        :param flist: path to the file list
+        :param ch: The channel to get
+        :return: A dict with the ids and the files for the specific channel
+        """
+
+        key = (flist.strip('/'), ch)
+        channel_flist = self._channel_flists.get(key)
+        if channel_flist is None:
+            channel_flist = get_flist_for_channel(self.get(flist), ch)
+            self._channel_flists[key] = channel_flist
+        return channel_flist
+
+    def clear_cache(self):
+        """ Removes all loaded subtrees and file lists from memory
+        """
+
+        self._subtrees.clear()
+        self._channel_flists.clear()
@@ -44,8 +44,18 @@
 
 __author__ = 'walter'
 
-import .json_utils as ju
+from nhpylm import json_utils as ju
+from collections import OrderedDict
+from heapq import merge
+from itertools import chain, islice
+from multiprocessing import Pool
+from warnings import warn
 import os
+import pickle
+import tempfile
+
+SHARD_SIZE = 1000
+CACHE_SIZE = 65536
 
 def identity(x):
     """ identity function - returns a one element list containing the input parameter
@@ -55,51 +65,244 @@ def identity(x):
     """
     return [x]
 
-class word_to_grapheme():
+class cached_conversion():
+    """ Base class for word conversions keeping a bounded cache of converted words (the oldest words are dropped
+    first). Subclasses implement convert(word). The cache is not pickled, e.g. when the conversion is send to a
+    worker process.
+
+    :param cache_size: maximum number of cached words (0: no caching)
+    """
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = dict()
+
+    def convert(self, word):
+        raise NotImplementedError
+
+    def __call__(self, word):
+        units = self._cache.get(word)
+        if units is None:
+            units = self.convert(word)
+            if self.cache_size > 0:
+                if len(self._cache) >= self.cache_size:
+                    del self._cache[next(iter(self._cache))]
+                self._cache[word] = units
+        return list(units)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cache'] = dict()
+        return state
+
+class word_to_grapheme(cached_conversion):
     """ Word to grapheme conversion - splits a word into its letters, leaving fixed words unchanged
 
     :param fixed_words: words which should not be split
     :param join: True: return string with letter separated by whitespace, False: return list of letters
+    :param cache_size: maximum number of cached words
 
     :return: a callable instance of this class which takes a word as input and outputs a one element
              list with the corresponding grapheme sequence
     """
-    def __init__(self, fixed_words=(), join=True):
-        self.fixed_words = fixed_words
+    def __init__(self, fixed_words=(), join=True, cache_size=CACHE_SIZE):
+        super().__init__(cache_size)
+        self.fixed_words = frozenset(fixed_words)
         self.join = join
 
-    def __call__(self, word):
+    def convert(self, word):
         if word not in self.fixed_words:
             if self.join:
-                return [' '.join(list(word))]
+                return (' '.join(word),)
             else:
-                return list(word)
+                return tuple(word)
         else:
-            return [word]
+            return (word,)
 
-class word_to_phoneme():
+class word_to_phoneme(cached_conversion):
     """ Word to phoneme conversion - convert a word into one or multiple, phoneme sequences using a lexicon
 
     :param lexicon: dictionary with word to phoneme sequence mappings. The mappings can be a list of multiple sequences
+    :param cache_size: maximum number of cached words
 
     :return: a callable instance of this class which takes a word as input and outputs a list with
              one or multiple corresponding phoneme sequence
     """
-    def __init__(self, lexicon):
+    def __init__(self, lexicon, cache_size=CACHE_SIZE):
+        super().__init__(cache_size)
         self.lexicon = lexicon
 
-    def __call__(self, word):
+    def convert(self, word):
         phonemes = self.lexicon[word]
         if isinstance(phonemes, (list, tuple)):
-            return phonemes
+            return tuple(phonemes)
         else:
-            return [phonemes]
+            return (phonemes,)
+
+class transcription_converter():
+    """ Converts transcriptions like convert_transcription, but each distinct token is converted only once.
+    Tokens are mapped to integer ids and the converted words and units are looked up by id, e.g. to convert a whole
+    vocabulary once (add_tokens) and map many utterances afterwards.
+
+    :param word_to_word: function for word to word mapping
+    :param word_to_units: function for word to unit mapping
+
+    :return: a callable instance of this class which takes a transcription as input and outputs the word and unit
+             transcription (see convert_transcription)
+    """
+    def __init__(self, word_to_word=identity, word_to_units=identity):
+        self.word_to_word = word_to_word
+        self.word_to_units = word_to_units
+        self.token_ids = dict()
+        self.words = list()
+        self.units = list()
+
+    def add_tokens(self, tokens):
+        """ Convert all new tokens
+
+        :param tokens: iterable of tokens (e.g. the vocabulary)
+        :return: list of token ids
+        """
+        token_ids = list()
+        for token in tokens:
+            token_id = self.token_ids.get(token)
+            if token_id is None:
+                token_id = len(self.words)
+                self.token_ids[token] = token_id
+                words = self.word_to_word(token)[0].split()
+                self.words.append(words)
+                self.units.append([self.word_to_units(word) for word in words])
+            token_ids.append(token_id)
+        return token_ids
+
+    def to_ids(self, transcription):
+        """ Map a transcription to token ids, converting new tokens
+
+        :param transcription: transcription to be processed
+        :return: list of token ids
+        """
+        if isinstance(transcription, str):
+            transcription = transcription.split()
+        return self.add_tokens(transcription)
+
+    def __call__(self, transcription):
+        token_ids = self.to_ids(transcription)
+        words = [word for token_id in token_ids for word in self.words[token_id]]
+        units = [list(units) for token_id in token_ids for units in self.units[token_id]]
+        return words, units
+
+    def word_to_units_dict(self):
+        """ Returns the unit sequences of all converted words
+
+        :return: dict with word as key and the output of word_to_units as value
+        """
+        return {word: units for token_id in range(len(self.words))
+                for word, units in zip(self.words[token_id], self.units[token_id])}
+
+def _map(function, args, processes=1, chunksize=1):
+    """ Lazily apply function to each element of args in order, using a process pool
+
+    If function or the arguments can not be pickled (e.g. lambdas), a warning is issued and they are applied in this
+    process.
+
+    :param function: function to apply
+    :param args: iterable with function arguments
+    :param processes: number of worker processes (None: number of cpus, 1: run in this process)
+    :param chunksize: number of arguments send to a worker at once
+    :return: generator of results (in the order of args)
+    """
+
+    if processes != 1:
+        args = iter(args)
+        first_args = list(islice(args, 1))
+        try:
+            pickle.dumps((function, first_args))
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            warn('Can not send the arguments to worker processes, running in this process: {}'.format(e))
+            processes = 1
+        args = chain(first_args, args)
+
+    if processes == 1:
+        yield from map(function, args)
+        return
+
+    with Pool(processes) as pool:
+        yield from pool.imap(function, args, chunksize)
+
+
+def _kaldi_key(line):
+    return line.split(' ', 1)[0]
+
+
+def _merge_sorted_files(input_files, output_file, encoding='utf-8'):
+    """ Merge files with lines sorted by key (first field) into one sorted file
+
+    :param input_files: list of files with sorted lines
+    :param output_file: file to write the merged lines to
+    :param encoding: file encoding
+    """
+
+    fids = [open(input_file, encoding=encoding) for input_file in input_files]
+    try:
+        with open(output_file, 'w', encoding=encoding) as fid:
+            fid.writelines(merge(*fids, key=_kaldi_key))
+    finally:
+        for fid in fids:
+            fid.close()
+
+
+def write_spk2utt(utt2spk_file, spk2utt_file):
+    """ Create spk2utt from utt2spk (like utt2spk_to_spk2utt.pl)
+
+    :param utt2spk_file: utt2spk file to read
+    :param spk2utt_file: spk2utt file to write
+    """
+
+    spk2utt = OrderedDict()
+    with open(utt2spk_file, encoding='utf-8') as fid:
+        for line in fid:
+            utterance_id, speaker_id = line.split()
+            spk2utt.setdefault(speaker_id, []).append(utterance_id)
+
+    with open(spk2utt_file, 'w', encoding='utf-8') as fid:
+        fid.writelines('{} {}\n'.format(speaker_id, ' '.join(utterance_ids))
+                       for speaker_id, utterance_ids in spk2utt.items())
+
+
+def _write_data_dir_shard(args):
+    shard_dir, recording_ids, files_per_channel, transcriptions, channels, utt2spk_map, word_to_word, \
+        convert_command, always_add_channel_name = args
+
+    converter = transcription_converter(word_to_word)
+    lines = {'text': [], 'wav.scp': [], 'utt2spk': []}
+    for recording_id in recording_ids:
+        transcription = ' '.join(converter(transcriptions[recording_id])[0])
+        for channel in channels:
+            if always_add_channel_name or len(channels) > 1:
+                recording_id_channel = '-'.join([recording_id, channel])
+            else:
+                recording_id_channel = recording_id
+
+            lines['text'].append('{} {}\n'.format(recording_id_channel, transcription))
+
+            file = files_per_channel[channel][recording_id]
+            scp_format = '{} ' + convert_command + '\n'
+            lines['wav.scp'].append(scp_format.format(recording_id_channel, file))
+
+            speaker_id = utt2spk(recording_id_channel, **(utt2spk_map or {}))
+            lines['utt2spk'].append('{} {}\n'.format(recording_id_channel, speaker_id))
+
+    os.makedirs(shard_dir)
+    for name, shard_lines in lines.items():
+        with open(os.path.join(shard_dir, name), 'w', encoding='utf-8') as fid:
+            fid.writelines(sorted(shard_lines, key=_kaldi_key))
+    return shard_dir
+
 
 def create_data_dir(database, flist, channels, tlist, data_dir, utt2spk_map=None, word_to_word=identity,
-                    convert_command='{}', always_add_channel_name=False):
+                    convert_command='{}', always_add_channel_name=False, processes=1, shard_size=SHARD_SIZE):
     """ Create a data directory with input files for kaldi
 
-    :param database: dabase dictionary
+    :param database: dabase dictionary or json_utils.JsonDatabase
     :param flist: path to audio file list
     :param channels: path to specific channels
     :param tlist: path to transcriptions list
@@ -110,36 +313,35 @@ def create_data_dir(database, flist, channels, tlist, data_dir, utt2spk_map=None
     :param convert_command: command used to convert input file to wav
                             Example: '/net/ssd/software/kaldi/tools/sph2pipe_v2.5/sph2pipe -f wav {}|sox - -r 16k -t wav - |'
     :param always_add_channel_name: always add channel name to recording id
+    :param processes: number of worker processes (None: number of cpus, 1: run in this process)
+    :param shard_size: number of recordings processed by a worker at once
     """
 
     files = ju.traverse_to_dict(database, flist)
-    files_per_channel = {channel: ju.get_flist_for_channel(files, channel) for channel in channels}
+    if isinstance(database, ju.JsonDatabase):
+        files_per_channel = {channel: database.get_flist_for_channel(flist, channel) for channel in channels}
+    else:
+        files_per_channel = {channel: ju.get_flist_for_channel(files, channel) for channel in channels}
     transcriptions = ju.traverse_to_dict(database, tlist)
 
     os.makedirs(data_dir, exist_ok=True)
-    with open(os.path.join(data_dir, 'text'), 'w', encoding='utf-8') as fp_text, \
-         open(os.path.join(data_dir, 'wav.scp'), 'w') as fp_wav_scp, \
-         open(os.path.join(data_dir, 'utt2spk'), 'w') as fp_utt2spk:
-
-        for recording_id in sorted(files.keys()):
-            for channel in channels:
-                if always_add_channel_name or len(channels) > 1:
-                    recording_id_channel = '-'.join([recording_id, channel])
-                else:
-                    recording_id_channel = recording_id
-
-                transcription = ' '.join(convert_transcription(transcriptions[recording_id], word_to_word)[0])
-                fp_text.write('{} {}\n'.format(recording_id_channel, transcription))
+    recording_ids = sorted(files.keys())
+    with tempfile.TemporaryDirectory(dir=data_dir) as tmp_dir:
+        # each worker writes a sorted shard, the shards are merged afterwards
+        args = ((os.path.join(tmp_dir, str(begin)), shard,
+                 {channel: {recording_id: channel_files[recording_id] for recording_id in shard}
+                  for channel, channel_files in files_per_channel.items()},
+                 {recording_id: transcriptions[recording_id] for recording_id in shard},
+                 channels, utt2spk_map, word_to_word, convert_command, always_add_channel_name)
+                for begin in range(0, len(recording_ids), shard_size)
+                for shard in [recording_ids[begin:begin + shard_size]])
+        shard_dirs = list(_map(_write_data_dir_shard, args, processes))
 
-                file = files_per_channel[channel][recording_id]
-                scp_format = '{} ' + convert_command + '\n'
-                fp_wav_scp.write(scp_format.format(recording_id_channel, file))
+        for name in ['text', 'wav.scp', 'utt2spk']:
+            _merge_sorted_files([os.path.join(shard_dir, name) for shard_dir in shard_dirs],
+                                os.path.join(data_dir, name))
 
-                speaker_id = utt2spk(recording_id_channel, **utt2spk_map)
-                fp_utt2spk.write('{} {}\n'.format(recording_id_channel, speaker_id))
-
-    utt2spk_to_spk2utt_cmd = 'cat {} | utt2spk_to_spk2utt.pl > {}'.format(os.path.join(data_dir, 'utt2spk'), os.path.join(data_dir, 'spk2utt'))
-    os.system(utt2spk_to_spk2utt_cmd)
+    write_spk2utt(os.path.join(data_dir, 'utt2spk'), os.path.join(data_dir, 'spk2utt'))
 
 
 def utt2spk(recording_id, pos=None, split_key=None, join_key=''):
@@ -181,10 +383,19 @@ def convert_transcription(transcription, word_to_word=identity, word_to_units=id
 
     return words, units
 
-def create_dict_dir_from_database(database, flists, tlist, dict_dir, silence_units, optional_silence, word_to_units=identity, word_to_word=identity):
+def _word_to_units_shard(args):
+    transcriptions, word_to_word, word_to_units = args
+    converter = transcription_converter(word_to_word, word_to_units)
+    for transcription in transcriptions:
+        converter.to_ids(transcription)
+    return sorted(converter.word_to_units_dict().items())
+
+
+def create_dict_dir_from_database(database, flists, tlist, dict_dir, silence_units, optional_silence, word_to_units=identity,
+                                  word_to_word=identity, processes=1, shard_size=SHARD_SIZE):
     """ Create a dictionary directory with input files for kaldi
 
-    :param database: dabase dictionary
+    :param database: dabase dictionary or json_utils.JsonDatabase
     :param flists: list of paths to audio file lists
     :param tlist: path to transcriptions list
     :param dict_dir: dict dir to write output to
@@ -192,21 +403,35 @@ def create_dict_dir_from_database(database, flists, tlist, dict_dir, silence_uni
     :param optional_silence: optional silence unit
     :param word_to_units: function for word to unit mapping
     :param word_to_word: function for word to word mapping
+    :param processes: number of worker processes (None: number of cpus, 1: run in this process)
+    :param shard_size: number of recordings processed by a worker at once
     """
 
     # get file list
-    files = {}
+    recording_ids = set()
     for flist in flists:
-        files.update(ju.traverse_to_dict(database, flist))
+        recording_ids.update(ju.traverse_to_dict(database, flist).keys())
+    recording_ids = sorted(recording_ids)
     transcriptions = ju.traverse_to_dict(database, tlist)
 
-    # get word to unit dictionary
-    word_to_unit_dict = {word: units_list for recording_id in files for word, units_list in zip(*convert_transcription(transcriptions[recording_id], word_to_word, word_to_units))}
-    unit_set = set(unit for units_list in word_to_unit_dict.values() for units in units_list for unit in units.split())
-
     # create output directory
     os.makedirs(dict_dir, exist_ok=True)
 
+    # get word to unit dictionary of each shard and merge the sorted shards into the lexicon
+    args = (([transcriptions[recording_id] for recording_id in recording_ids[begin:begin + shard_size]],
+             word_to_word, word_to_units)
+            for begin in range(0, len(recording_ids), shard_size))
+    unit_set = set()
+    previous_word = None
+    with open(os.path.join(dict_dir, 'lexicon.txt'), 'w', encoding='utf-8') as fp:
+        for word, units_list in merge(*_map(_word_to_units_shard, args, processes), key=lambda entry: entry[0]):
+            if word == previous_word:
+                continue
+            previous_word = word
+            for units in units_list:
+                fp.write(word + '\t' + units + '\n')
+                unit_set.update(units.split())
+
     # write nonsilence, optional silence and silence units
     with open(os.path.join(dict_dir, 'nonsilence_phones.txt'), 'w', encoding='utf-8') as fp:
         fp.write('\n'.join(unit for unit in sorted(unit_set) if unit not in silence_units) + '\n')
@@ -217,28 +442,34 @@ def create_dict_dir_from_database(database, flists, tlist, dict_dir, silence_uni
     with open(os.path.join(dict_dir, 'optional_silence.txt'), 'w', encoding='utf-8') as fp:
         fp.write(optional_silence + '\n')
 
-    # write lexicon
-    with open(os.path.join(dict_dir, 'lexicon.txt'), 'w', encoding='utf-8') as fp:
-        fp.write('\n'.join(word + '\t' + units for word, units_list in sorted(word_to_unit_dict.items()) for units in units_list) + '\n')
-
     # write extra questions
     with open(os.path.join(dict_dir, 'extra_questions.txt'), 'w', encoding='utf-8') as fp:
         fp.write(' '.join(sorted(silence_units)) + '\n')
         fp.write(' '.join(unit for unit in sorted(unit_set) if unit not in silence_units) + '\n')
 
+
+def _convert_transcription_pair(args):
+    key, ref_args, res_args = args
+    if res_args is None:
+        return key, convert_transcription(*ref_args), None
+    return key, convert_transcription(*ref_args), convert_transcription(*res_args)
+
+
 def create_lattice_word_segmentation_from_text(textfile, database, tlist, segmentation_dir, word_to_word_ref=identity,
                                                word_to_units_ref=identity, word_to_word_res=identity,
-                                               word_to_units_res=identity):
+                                               word_to_units_res=identity, processes=1, chunksize=SHARD_SIZE):
     """ Create input files for Lattice Word Segmentation from text file (reference or one best)
 
     :param textfile: texfile with resulting transcription, one per line with preceeding recording id
-    :param database: dabase dictionary
+    :param database: dabase dictionary or json_utils.JsonDatabase
     :param tlist: path to transcriptions list
     :param segmentation_dir: segmentation dir to write segmentation input to
     :param word_to_word_ref: function for word to word mapping (reference)
     :param word_to_units_ref: function for word to units mapping (reference)
     :param word_to_word_res: function for word to word mapping (result)
     :param word_to_units_res: function for word to units mapping (result)
+    :param processes: number of worker processes (None: number of cpus, 1: run in this process)
+    :param chunksize: number of lines processed by a worker at once
     """
 
     transcriptions = ju.traverse_to_dict(database, tlist)
@@ -252,37 +483,39 @@ def create_lattice_word_segmentation_from_text(textfile, database, tlist, segmen
          open(textfile) as fp_input_text_file:
 
         fp_file_list_file.write(segmentation_dir + 'text.txt\n')
-        for line in fp_input_text_file:
-            split_line = line.split()
-
-            ref_transcription = convert_transcription(transcriptions[split_line[0]], word_to_word_ref, word_to_units_ref)
-
+        args = ((split_line[0], (transcriptions[split_line[0]], word_to_word_ref, word_to_units_ref),
+                 (split_line[1:], word_to_word_res, word_to_units_res))
+                for split_line in map(str.split, fp_input_text_file))
+        for recording_id, ref_transcription, input_transcription in _map(_convert_transcription_pair, args,
+                                                                          processes, chunksize):
             # check for duplicate
             ref_sequence = ' '.join(word[0] for word in ref_transcription[1])
             if ref_sequence in seen_ref_sequences:
-                seen_ref_sequences[ref_sequence].append(split_line[0])
+                seen_ref_sequences[ref_sequence].append(recording_id)
                 continue
             else:
-                seen_ref_sequences[ref_sequence] = [split_line[0]]
+                seen_ref_sequences[ref_sequence] = [recording_id]
 
             ref_transcription_joined = ' </unk> '.join(word[0] for word in ref_transcription[1])
             ref_transcription_joined += ' </unk> </s> </unk>'
             fp_ref_file.write(ref_transcription_joined + '\n')
 
-            input_transcription = convert_transcription(split_line[1:], word_to_word_res, word_to_units_res)
             input_transcription_joined = ' '.join(word[0] for word in input_transcription[1])
             fp_text_file.write(input_transcription_joined + '\n')
 
 def create_lattice_word_segmentation_from_lattices(latticefile, database, tlist, segmentation_dir,
-                                                   word_to_word_ref=identity, word_to_units_ref=identity):
+                                                   word_to_word_ref=identity, word_to_units_ref=identity,
+                                                   processes=1, chunksize=SHARD_SIZE):
     """ Create input files for Lattice Word Segmentation from lattices
 
     :param latticefile: file with resulting lattices
-    :param database: dabase dictionary
+    :param database: dabase dictionary or json_utils.JsonDatabase
     :param tlist: path to transcriptions list
     :param segmentation_dir: segmentation dir to write segmentation input to
     :param word_to_word_ref: function for word to word mapping (reference)
     :param word_to_units_ref: function for word to units mapping (reference)
+    :param processes: number of worker processes (None: number of cpus, 1: run in this process)
+    :param chunksize: number of lines processed by a worker at once
     """
 
     transcriptions = ju.traverse_to_dict(database, tlist)
@@ -294,11 +527,12 @@ def create_lattice_word_segmentation_from_lattices(latticefile, database, tlist,
          open(segmentation_dir + 'file_list_htk.txt', 'w') as fp_file_list_file, \
          open(latticefile) as fp_input_text_file:
 
-        for line in fp_input_text_file:
+        args = ((line, (transcriptions[os.path.splitext(os.path.split(line)[1])[0]], word_to_word_ref,
+                        word_to_units_ref), None)
+                for line in fp_input_text_file)
+        for line, ref_transcription, _ in _map(_convert_transcription_pair, args, processes, chunksize):
             recording_id = os.path.splitext(os.path.split(line)[1])[0]
 
-            ref_transcription = convert_transcription(transcriptions[recording_id], word_to_word_ref, word_to_units_ref)
-
             # check for duplicate
             ref_sequence = ' '.join(word[0] for word in ref_transcription[1])
             if ref_sequence in seen_ref_sequences:
@@ -43,8 +43,8 @@
 ## ----------------------------------------------------------------------------
 
 __author__ = 'walter'
+import numpy as np
 from nhpylm import fst
-from tqdm import tqdm
 
 
 class Lexicon:
@@ -56,19 +56,20 @@ class Lexicon:
           be a char or any other hashable object
     """
 
-    def __init__(self, eps, eow, eoc=None, sil=None):
+    def __init__(self, eps, eow, eoc=None, sil=None, compact=False):
         """
         Construct lexicon base class. Should be called
-        with super().__init__(eps, eow, eoc, sil) from child class
+        with super().__init__(eps, eow, eoc, sil, compact) from child class
 
         :param eps: eps symbol
         :param eow: end of word symbol
         :param eoc: end of characters symbol to terminate
                     character sequence for new word
         :param sil: character for space/pause/silence (if available)
+        :param compact: store the fst in arc columns (symbols have to be ints)
         """
 
-        self.lex = fst.SimpleFST()
+        self.lex = fst.CompactSimpleFST() if compact else fst.SimpleFST()
         self.start_state = self.lex.add_state()
         self.lex.set_start(self.start_state)
         self.lex.set_final(self.start_state)
@@ -323,7 +324,7 @@ class Linear(Lexicon):
     for the missing transitions.
     """
 
-    def __init__(self, eps, eow, eoc=None, sil=None):
+    def __init__(self, eps, eow, eoc=None, sil=None, compact=False):
         """
         Construct lexicon trie.
 
@@ -332,9 +333,10 @@ class Linear(Lexicon):
         :param eoc: end of characters symbol to terminate
                     character sequence for new word
         :param sil: character for space/pause/silence (if available)
+        :param compact: store the fst in arc columns (symbols have to be ints)
         """
 
-        super().__init__(eps, eow, eoc, sil)
+        super().__init__(eps, eow, eoc, sil, compact)
         self.prefixes = {(): True}
 
     def add_word(self, word, mode='linear'):
@@ -401,18 +403,18 @@ class Linear(Lexicon):
             #                 if no further prefix
             self._build_character_model_from_word_model(labels,
                                                         characters_loop_state)
+        elif mode == 'trie':
+            self._build_character_trie(labels, characters_loop_state)
         else:
+            from tqdm import tqdm
+
             # add tree for prefixes
             #   add each prefix with eoc
             #   add transition to character_loop_state if no longer a prefix
             progress = tqdm(desc='Adding prefixes', total=len(self.prefixes))
             for prefix, is_word in self.prefixes.items():
-                if mode == 'trie':
-                    character_sequence_end_state =\
-                        self._add_character_sequence_tri(prefix)
-                else:
-                    character_sequence_end_state =\
-                        self._add_character_sequence_linear(prefix)
+                character_sequence_end_state =\
+                    self._add_character_sequence_linear(prefix)
 
                 if not is_word:
                     self.lex.add_arc(character_sequence_end_state,
@@ -425,10 +427,296 @@ class Linear(Lexicon):
                 progress.update()
             progress.close()
 
+    def _build_character_trie(self, labels, characters_loop_state):
+        """
+        Build the character trie for all prefixes at once. The result is the
+        same as adding each prefix with _add_character_sequence_tri, a
+        transition with eoc to the start state if the prefix is not a word and
+        transitions with labels to characters_loop_state if the prefix is not
+        continued by the label. The arcs are generated as arrays and added in
+        the same order.
+
+        :param labels: list of symbols for all characters
+        :param characters_loop_state: state id of the character loop state
+        """
+
+        prefixes = list(self.prefixes)
+        num_prefixes = len(prefixes)
+        prefix_ids = {prefix: prefix_id
+                      for prefix_id, prefix in enumerate(prefixes)}
+        root = prefix_ids[()]
+        is_word = np.fromiter(self.prefixes.values(), bool, num_prefixes)
+        depth = np.fromiter(map(len, prefixes), np.int64, num_prefixes)
+        parent = np.fromiter(
+            (prefix_ids[prefix[:-1]] if prefix else -1 for prefix in prefixes),
+            np.int64, num_prefixes)
+
+        # a prefix is added with the first prefix (in insertion order) it is a
+        # prefix of, states along a prefix are added in order of their depth
+        first_prefix = np.arange(num_prefixes)
+        for prefix_depth in range(depth.max(), 0, -1):
+            in_depth = depth == prefix_depth
+            np.minimum.at(first_prefix, parent[in_depth],
+                          first_prefix[in_depth])
+        trie_order = np.lexsort((depth, first_prefix))
+        trie_order = trie_order[trie_order != root]
+
+        # assign states, following existing transitions from states not
+        # belonging to the character trie (e.g. the start state)
+        states = [None] * num_prefixes
+        states[root] = self.start_state
+        is_new = [False] * num_prefixes
+        new_prefixes = list()
+        num_states = self.lex.num_states
+        parents = parent.tolist()
+        for prefix_id in trie_order.tolist():
+            parent_id = parents[prefix_id]
+            character = prefixes[prefix_id][-1]
+            arc = None
+            if not is_new[parent_id]:
+                arc = self.lex.find_arc(states[parent_id], character,
+                                        character)
+            if arc:
+                states[prefix_id] = arc.dst
+            else:
+                states[prefix_id] = self.lex.add_state()
+                is_new[prefix_id] = True
+                new_prefixes.append(prefix_id)
+        assert self.lex.num_states == num_states + len(new_prefixes)
+        states = np.array(states, dtype=np.int64)
+
+        # labels not continuing a prefix
+        label_ids = dict()
+        for label in labels:
+            label_ids.setdefault(label, len(label_ids))
+        label_positions = np.array([label_ids[label] for label in labels],
+                                   dtype=np.int64)
+        continued = np.zeros((num_prefixes, len(label_ids)), dtype=bool)
+        child_labels = np.array(
+            [label_ids.get(prefix[-1], -1) if prefix else -1
+             for prefix in prefixes], dtype=np.int64)
+        is_child = child_labels >= 0
+        continued[parent[is_child], child_labels[is_child]] = True
+        loop_prefixes, loop_labels = np.nonzero(
+            ~continued[:, label_positions])
+
+        # trie arcs, eoc arcs and arcs to characters_loop_state ordered by
+        # the prefix they are added with
+        new_prefixes = np.array(new_prefixes, dtype=np.int64)
+        eoc_prefixes = np.flatnonzero(~is_word)
+        symbols = [prefix[-1] if prefix else self.eoc
+                   for prefix in prefixes] + [self.eoc] + list(labels)
+        eoc_symbol = num_prefixes
+        src = np.concatenate([states[parent[new_prefixes]],
+                              states[eoc_prefixes], states[loop_prefixes]])
+        dst = np.concatenate([
+            states[new_prefixes],
+            np.full(len(eoc_prefixes), self.start_state, dtype=np.int64),
+            np.full(len(loop_prefixes), characters_loop_state,
+                    dtype=np.int64)])
+        arc_symbols = np.concatenate([
+            new_prefixes, np.full(len(eoc_prefixes), eoc_symbol,
+                                  dtype=np.int64),
+            eoc_symbol + 1 + loop_labels])
+        order = np.lexsort((
+            np.concatenate([depth[new_prefixes],
+                            np.zeros(len(eoc_prefixes), dtype=np.int64),
+                            loop_labels]),
+            np.repeat([0, 1, 2], [len(new_prefixes), len(eoc_prefixes),
+                                  len(loop_prefixes)]),
+            np.concatenate([first_prefix[new_prefixes], eoc_prefixes,
+                            loop_prefixes])))
+        arc_symbols = [symbols[symbol_id]
+                       for symbol_id in arc_symbols[order].tolist()]
+        self.lex.add_arcs(src[order].tolist(), dst[order].tolist(),
+                          arc_symbols, arc_symbols)
+
+
+class Minimal(Lexicon):
+    """
+    A minimal deterministic lexicon built incrementally from words added in
+    lexicographic order of their character sequences (Daciuk et al.,
+    "Incremental construction of minimal acyclic finite-state automata").
+    The word label is placed on the first arc of the word not shared with
+    another word, all following arcs output eps. Once no further word can pass
+    through a state, it is replaced by an equivalent state if one was already
+    added, so common suffixes are shared and no determinization or
+    minimization of the fst is needed.
+
+    If labels are given, a minimal character model passing all character
+    sequences not being a word is built alongside (same as the character
+    model of Linear with mode 'trie').
+    """
+
+    def __init__(self, eps, eow, eoc=None, sil=None, compact=False,
+                 labels=None):
+        """
+        Construct minimal lexicon.
+
+        :param eps: eps symbol
+        :param eow: end of word symbol
+        :param eoc: end of characters symbol to terminate
+                    character sequence for new word
+        :param sil: character for space/pause/silence (if available)
+        :param compact: store the fst in arc columns (symbols have to be ints)
+        :param labels: list of symbols for all characters for the character
+                       model (excluding special symbols like eps, eow or
+                       eos_label), None: no character model
+        """
+
+        super().__init__(eps, eow, eoc, sil, compact)
+        self.labels = labels
+        if labels is not None:
+            self.characters_loop_state = self._add_characters_loop(labels)
+        self.finished = False
+        self._previous = None
+        self._output_depth = None
+        # states not yet registered along the last word: list of arcs
+        # [ilabel, olabel, dst] for the word model and [list of [label, dst],
+        # is_word] for the character model, dst of the last arc is None
+        self._word_path = [[]]
+        self._character_path = [[[], True]]
+        self._word_register = dict()
+        self._character_register = dict()
+
+    def add_word(self, word):
+        """
+        Add entry for given word. Words have to be added in lexicographic
+        order of their character sequences.
+
+        :param word: tuple (word, character sequence) with word being the
+                     word symbol and character sequence being
+                     a list of character symbols (without eos)
+        """
+
+        if self.finished:
+            raise RuntimeError('Words cannot be added after finish()')
+        characters = tuple(word[1])
+        depth = 0
+        if self._previous is not None:
+            if characters < self._previous:
+                raise ValueError(
+                    'Words have to be added in lexicographic order of their '
+                    'character sequences, got {} after {}'.format(
+                        characters, self._previous))
+            for previous_character, character in zip(self._previous,
+                                                     characters):
+                if previous_character != character:
+                    break
+                depth += 1
+            self._move_previous_output(depth)
+
+        self._register_states(depth)
+        for character in characters[depth:]:
+            self._word_path[-1].append([character, self.eps, None])
+            self._word_path.append(list())
+            if self.labels is not None:
+                self._character_path[-1][0].append([character, None])
+                self._character_path.append([[], False])
+
+        # the first arc not shared with the previous word gets the word label
+        if depth < len(characters):
+            self._word_path[depth][-1][1] = word[0]
+            output = self.eps
+        else:
+            output = word[0]
+        self._word_path[-1].append([self.eow, output, self.start_state])
+        if self.sil is not None:
+            self._word_path[-1].append([self.sil, output, self.start_state])
+        self._character_path[-1][1] = True
+        self._previous = characters
+        self._output_depth = depth
+
+    def finish(self):
+        """
+        Register all remaining states and add the arcs of the start state.
+        No words can be added afterwards.
+        """
+
+        if self.finished:
+            return
+        self._register_states(0)
+        for ilabel, olabel, dst in self._word_path[0]:
+            self.lex.add_arc(self.start_state, dst, ilabel, olabel)
+        if self.labels is not None:
+            self._add_character_arcs(self.start_state,
+                                     *self._character_path[0])
+        self.finished = True
+
+    def _move_previous_output(self, depth):
+        """
+        Move the word label of the previous word to the arc at depth if it is
+        placed on an arc shared with the next word.
+
+        :param depth: number of characters shared with the next word
+        """
+
+        if self._output_depth >= depth:
+            return
+        word_arc = self._word_path[self._output_depth][-1]
+        output = word_arc[1]
+        word_arc[1] = self.eps
+        if depth < len(self._previous):
+            self._word_path[depth][-1][1] = output
+        else:
+            for word_arc in self._word_path[depth][
+                    -(1 if self.sil is None else 2):]:
+                word_arc[1] = output
+        self._output_depth = depth
+
+    def _register_states(self, depth):
+        """
+        Replace or register all states along the last word deeper than depth
+
+        :param depth: depth of the last state to keep
+        """
+
+        while len(self._word_path) > depth + 1:
+            arcs = tuple(map(tuple, self._word_path.pop()))
+            state = self._word_register.get(arcs)
+            if state is None:
+                state = self.lex.add_state()
+                for ilabel, olabel, dst in arcs:
+                    self.lex.add_arc(state, dst, ilabel, olabel)
+                self._word_register[arcs] = state
+            self._word_path[-1][-1][2] = state
+
+        while len(self._character_path) > depth + 1:
+            children, is_word = self._character_path.pop()
+            signature = (tuple(map(tuple, children)), is_word)
+            state = self._character_register.get(signature)
+            if state is None:
+                state = self.lex.add_state()
+                self._add_character_arcs(state, children, is_word)
+                self._character_register[signature] = state
+            self._character_path[-1][0][-1][1] = state
+
+    def _add_character_arcs(self, state, children, is_word):
+        """
+        Add arcs of a character model state: arcs to the states of the
+        following characters, a transition with eoc to the start state if the
+        character sequence is not a word and transitions with the remaining
+        labels to the character loop state.
+
+        :param state: state id
+        :param children: list of (label, state id) of following characters
+        :param is_word: True if the character sequence is a word
+        """
+
+        for label, dst in children:
+            self.lex.add_arc(state, dst, label, label)
+        if not is_word:
+            self.lex.add_arc(state, self.start_state, self.eoc, self.eoc)
+        continued = {label for label, _ in children}
+        for label in self.labels:
+            if label not in continued:
+                self.lex.add_arc(state, self.characters_loop_state, label,
+                                 label)
+
 
 def build_fst_for_lexicon(lexicon, eps, eow, build_character_model=False,
                           mode='trie', labels=None, sow=None, eoc=None,
-                          sil=None):
+                          sil=None, compact=False):
     """
     Build a lexicon fst for given lexicon
 
@@ -443,10 +731,13 @@ def build_fst_for_lexicon(lexicon, eps, eow, build_character_model=False,
     :param sow: start of character sequence symbol
     :param eoc: end of character sequence symbol
     :param sil: character for space/pause/silence (if available)
+    :param compact: store the fst in arc columns (symbols have to be ints)
     :return: lexicon fst of type linear
     """
 
-    fst_lexicon = Linear(eps, eow, eoc, sil)
+    from tqdm import tqdm
+
+    fst_lexicon = Linear(eps, eow, eoc, sil, compact)
 
     progress = tqdm(desc='Adding words', total=len(lexicon))
     for word in lexicon.items():
@@ -458,3 +749,32 @@ def build_fst_for_lexicon(lexicon, eps, eow, build_character_model=False,
         fst_lexicon.build_character_model(labels, mode=mode, sow=sow)
 
     return fst_lexicon
+
+
+def build_minimal_fst_for_lexicon(lexicon, eps, eow, labels=None, eoc=None,
+                                  sil=None, compact=False):
+    """
+    Build a minimal deterministic lexicon fst for given lexicon
+
+    :param lexicon: dictionary containing word to label sequence mappings
+                   (key: word, value: label sequence)
+    :param eps: eps symbol
+    :param eow: end of word symbol
+    :param labels: list of labels for character model, None: no character
+                   model
+    :param eoc: end of character sequence symbol
+    :param sil: character for space/pause/silence (if available)
+    :param compact: store the fst in arc columns (symbols have to be ints)
+    :return: lexicon fst of type minimal
+    """
+
+    from tqdm import tqdm
+
+    fst_lexicon = Minimal(eps, eow, eoc, sil, compact, labels)
+
+    for word in tqdm(sorted(lexicon.items(), key=lambda word: tuple(word[1])),
+                     desc='Adding words'):
+        fst_lexicon.add_word(word)
+    fst_lexicon.finish()
+
+    return fst_lexicon
@@ -42,25 +42,40 @@
 ##
 ## ----------------------------------------------------------------------------
 
-import subprocess
 from warnings import warn
 import os
+import signal
 
 DEBUG_MODE = False
-DEFAULT_ENV = os.environ.copy()
+# None: commands inherit the environment of this process
+DEFAULT_ENV = None
+# maximum number of commands running at the same time
+MAX_PARALLEL_PROCESSES = os.cpu_count() or 1
+# size of chunks when streaming stdout (in bytes)
+STREAM_CHUNK_SIZE = 2 ** 16
+
 
 def run_processes(cmds, sleep_time=0.1, ignore_return_code=False,
                   environment=DEFAULT_ENV, warn_on_ignore=True,
-                  inputs=None):
-    """ Starts multiple processes, waits and returns the outputs when available
+                  inputs=None, max_parallel=None, timeout=None,
+                  stdouts=None):
+    """ Runs multiple processes, waits and returns the outputs when available
 
     :param cmd: A list with the commands to call
-    :param sleep_time: Intervall to poll the running processes (in seconds)
+    :param sleep_time: unused (kept for compatibility)
     :param ignore_return_code: If true, ignores non zero return codes.
         Otherwise an exception is thrown.
     :param environment: environment (e.g. path variable) for commands
     :param warn_on_ignore: warn if return code is ignored but non zero
-    :param inputs: A list with the text inputs to be piped to the called commands
+    :param inputs: A list with the inputs to be piped to the called commands:
+        a text, an iterable of text (or bytes) chunks written one after
+        another or a function writing to the (binary) stdin of the command
+    :param max_parallel: maximum number of commands running at the same time
+        (None: MAX_PARALLEL_PROCESSES)
+    :param timeout: timeout in seconds for each command, commands running
+        longer are killed and treated like a non zero return code
+    :param stdouts: A list with the destinations for the (binary) stdout of
+        each command (see run_process_async), None: return stdout as text
     :return: Stdout, Stderr and return code for each process
     """
 
@@ -70,24 +85,15 @@ def run_processes(cmds, sleep_time=0.1, ignore_return_code=False,
         inputs = len(cmds) * [None]
     else:
         inputs = inputs if isinstance(inputs, list) else [inputs]
+    if stdouts is None:
+        stdouts = len(cmds) * [None]
+    else:
+        stdouts = stdouts if isinstance(stdouts, list) else [stdouts]
 
     if DEBUG_MODE:
         [print('Calling: {}'.format(cmd)) for cmd in cmds]
-    pipes = [subprocess.Popen(cmd,
-                              stdin=subprocess.PIPE,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE,
-                              shell=True,
-                              universal_newlines=True,
-                              env=environment) for cmd in cmds]
-    return_codes = len(cmds) * [None]
-    stdout = len(cmds) * [None]
-    stderr = len(cmds) * [None]
-
-    # Recover output as the processes finish
-    for i, p in enumerate(pipes):
-        stdout[i], stderr[i] = p.communicate(inputs[i])
-        return_codes[i] = p.returncode
+    stdout, stderr, return_codes = _run_coroutine(run_processes_async(
+        cmds, inputs, environment, max_parallel, timeout, stdouts))
 
     raise_error_txt = ''
     for idx, code in enumerate(return_codes):
@@ -106,3 +112,176 @@ def run_processes(cmds, sleep_time=0.1, ignore_return_code=False,
         raise EnvironmentError(raise_error_txt)
 
     return stdout, stderr, return_codes
+
+
+async def run_processes_async(cmds, inputs=None, environment=DEFAULT_ENV,
+                              max_parallel=None, timeout=None, stdouts=None):
+    """ Runs multiple processes with at most max_parallel at the same time
+
+    :param cmds: A list with the commands to call
+    :param inputs: A list with the inputs for the commands
+        (see run_process_async)
+    :param environment: environment (e.g. path variable) for commands
+    :param max_parallel: maximum number of commands running at the same time
+        (None: MAX_PARALLEL_PROCESSES)
+    :param timeout: timeout in seconds for each command
+    :param stdouts: A list with the destinations for stdout of each command
+        (see run_process_async)
+    :return: Stdout, Stderr and return code for each process
+    """
+
+    if inputs is None:
+        inputs = len(cmds) * [None]
+    if stdouts is None:
+        stdouts = len(cmds) * [None]
+    import asyncio
+
+    semaphore = asyncio.Semaphore(max_parallel or MAX_PARALLEL_PROCESSES)
+
+    async def run(cmd, cmd_input, stdout):
+        async with semaphore:
+            return await run_process_async(cmd, cmd_input, environment,
+                                           timeout, stdout)
+
+    results = await asyncio.gather(*map(run, cmds, inputs, stdouts))
+    stdout = [result[0] for result in results]
+    stderr = [result[1] for result in results]
+    return_codes = [result[2] for result in results]
+    return stdout, stderr, return_codes
+
+
+async def run_process_async(cmd, inputs=None, environment=DEFAULT_ENV,
+                            timeout=None, stdout=None):
+    """ Runs a (shell) command, writes the input and reads stdout and stderr
+    while it is running
+
+    :param cmd: command to call
+    :param inputs: input piped to the command: a text, an iterable of text (or
+        bytes) chunks written one after another or a function writing to the
+        (binary) stdin of the command (called in a thread)
+    :param environment: environment (e.g. path variable) for the command
+    :param timeout: timeout in seconds, the command (including all processes
+        it started) is killed afterwards and its return code is the negative
+        kill signal
+    :param stdout: destination for the (binary) stdout: a file name, a binary
+        file object or a function called with each chunk,
+        None: return stdout as text
+    :return: Stdout (None if streamed to stdout), Stderr and return code
+    """
+
+    import asyncio
+
+    stdin = asyncio.subprocess.PIPE
+    stdin_fd = None
+    if inputs is None:
+        stdin = asyncio.subprocess.DEVNULL
+    elif callable(inputs):
+        stdin, stdin_fd = os.pipe()
+    # own process group to be able to kill all commands of a pipe
+    process = await asyncio.create_subprocess_shell(
+        cmd, stdin=stdin, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE, env=environment,
+        start_new_session=True)
+
+    async def write():
+        if stdin_fd is not None:
+            os.close(stdin)
+            await asyncio.get_running_loop().run_in_executor(
+                None, _write_to_fd, inputs, stdin_fd)
+            return
+        try:
+            for chunk in [inputs] if isinstance(inputs, (str, bytes))\
+                    else inputs:
+                process.stdin.write(
+                    chunk.encode() if isinstance(chunk, str) else chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # process exited early, its return code is checked by the caller
+            pass
+        finally:
+            process.stdin.close()
+
+    async def read():
+        if stdout is None:
+            return (await process.stdout.read()).decode()
+        fid = open(stdout, 'wb') if isinstance(stdout, str) else stdout
+        try:
+            while True:
+                chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if callable(fid):
+                    fid(chunk)
+                else:
+                    fid.write(chunk)
+        finally:
+            if fid is not stdout:
+                fid.close()
+
+    async def communicate():
+        tasks = [read(), process.stderr.read()]
+        if inputs is not None:
+            tasks.append(write())
+        cmd_stdout, cmd_stderr = (await asyncio.gather(*tasks))[:2]
+        await process.wait()
+        return cmd_stdout, cmd_stderr.decode(errors='replace')
+
+    try:
+        cmd_stdout, cmd_stderr = await asyncio.wait_for(communicate(),
+                                                        timeout)
+    except asyncio.TimeoutError:
+        await _kill(process)
+        cmd_stdout, cmd_stderr = None, 'Timeout after {} seconds'.format(
+            timeout)
+    except BaseException:
+        await _kill(process)
+        raise
+
+    return cmd_stdout, cmd_stderr, process.returncode
+
+
+async def _kill(process):
+    """ Kill the process group of process and wait for the process
+
+    :param process: asyncio process started in a new session
+    """
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+
+def _write_to_fd(write, fd):
+    """ Call write with a binary file object for the file descriptor fd
+
+    :param write: function writing to a binary file object
+    :param fd: file descriptor (closed afterwards)
+    """
+
+    try:
+        with open(fd, 'wb') as fid:
+            write(fid)
+    except BrokenPipeError:
+        # process exited early, its return code is checked by the caller
+        pass
+
+
+def _run_coroutine(coroutine):
+    """ Run coroutine in a new event loop, in a separate thread if an event
+    loop is already running in this thread (e.g. in a notebook)
+
+    :param coroutine: coroutine to run
+    :return: result of the coroutine
+    """
+
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
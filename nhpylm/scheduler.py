@@ -0,0 +1,238 @@
+## ----------------------------------------------------------------------------
+##
+##   File: scheduler.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+__author__ = 'walter'
+
+import math
+import threading
+
+
+class ConvergenceScheduler:
+    """
+    Schedules the hyperparameter resampling of train_with_list_of_sentences
+    and stops the training once the log likelihood of held-out sentences no
+    longer improves.
+
+    Every eval_interval iterations the average log likelihood per word of the
+    held-out sentences is calculated (multi threaded). After each evaluation
+    improving less than min_improvement the interval between hyperparameter
+    resamplings is doubled (up to max_resample_interval) and after patience
+    such evaluations in a row the training is stopped.
+
+    With background=True the evaluation runs on a snapshot of the model in a
+    background thread while the training continues. Its result is used at
+    the next update, i.e. resampling and stopping decisions lag one
+    iteration behind.
+
+    :param heldout_sentences: list of word sentences to evaluate, not used
+                              for training (their words are not added to the
+                              dictionary of the model)
+    :param eval_interval: number of iterations between evaluations
+    :param min_improvement: minimum improvement of the average log
+                            likelihood per word
+    :param patience: number of evaluations without improvement before
+                     stopping (None: never stop)
+    :param max_resample_interval: maximum number of iterations between
+                                  hyperparameter resamplings
+    :param num_threads: number of threads for the evaluation
+    :param background: evaluate in a background thread
+    """
+
+    def __init__(self, heldout_sentences, eval_interval=1,
+                 min_improvement=1e-3, patience=3, max_resample_interval=8,
+                 num_threads=1, background=True):
+        if not heldout_sentences:
+            raise ValueError('ConvergenceScheduler needs held-out sentences')
+        self.heldout_sentences = heldout_sentences
+        self.eval_interval = eval_interval
+        self.min_improvement = min_improvement
+        self.patience = patience
+        self.max_resample_interval = max_resample_interval
+        self.num_threads = num_threads
+        self.background = background
+        self.resample_interval = 1
+        self.history = list()
+        self.hyperparameter_trajectory = list()
+        self._num_words = sum(len(sentence) + 1
+                              for sentence in heldout_sentences)
+        self._best_loglikelihood = -math.inf
+        self._num_without_improvement = 0
+        self._last_resampling = 0
+        self._thread = None
+        self._pending = None
+
+    def start(self, lm, iteration=0, state=None):
+        """ Evaluates the initial model or restores the state of a scheduler
+        to resume training
+
+        :param lm: NHPYLM_wrapper to train
+        :param iteration: number of iterations already done
+        :param state: state returned by get_state after the update of the
+                      iteration lm was saved at (None: new training)
+        """
+
+        if state is None:
+            self._last_resampling = iteration
+            self._record(iteration, self.evaluate(lm))
+            return
+
+        self.resample_interval = state['resample_interval']
+        self.history = list(state['history'])
+        self.hyperparameter_trajectory = list(
+            state['hyperparameter_trajectory'])
+        self._best_loglikelihood = state['best_loglikelihood']
+        self._num_without_improvement = state['num_without_improvement']
+        self._last_resampling = state['last_resampling']
+        if state['pending'] is not None:
+            # lm is the model of the pending evaluation, its result is
+            # recorded at the next update as without interruption
+            self._pending = (state['pending'],
+                             dict(loglikelihood=self.evaluate(lm)))
+
+    def get_state(self):
+        """ Returns the state of the scheduler (e.g. to be stored in a
+        checkpoint, see start)
+
+        :return: picklable dict
+        """
+
+        return dict(resample_interval=self.resample_interval,
+                    history=list(self.history),
+                    hyperparameter_trajectory=list(
+                        self.hyperparameter_trajectory),
+                    best_loglikelihood=self._best_loglikelihood,
+                    num_without_improvement=self._num_without_improvement,
+                    last_resampling=self._last_resampling,
+                    pending=None if self._pending is None
+                    else self._pending[0])
+
+    def evaluate(self, lm):
+        """ Returns the average log likelihood per word of the held-out
+        sentences
+
+        :param lm: NHPYLM_wrapper
+        :return: average log likelihood per word
+        """
+
+        loglikelihoods = lm.word_lists_loglikelihoods(
+            self.heldout_sentences, self.num_threads)
+        return loglikelihoods.sum() / self._num_words
+
+    def should_resample(self, iteration):
+        """ Returns True if the hyperparameters are to be resampled after the
+        given iteration
+        """
+
+        return iteration - self._last_resampling >= self.resample_interval
+
+    def update(self, iteration, lm, resampled):
+        """ Records the hyperparameters and evaluates the model (see
+        background)
+
+        :param iteration: number of finished iterations
+        :param lm: NHPYLM_wrapper
+        :param resampled: True if the hyperparameters were resampled
+        :return: True if the training should stop
+        """
+
+        if resampled:
+            self._last_resampling = iteration
+            self.hyperparameter_trajectory.append(
+                (iteration, lm.hyperparameter))
+        stop = self.wait()
+        if stop or iteration % self.eval_interval:
+            return stop
+        if not self.background:
+            return self._record(iteration, self.evaluate(lm))
+
+        # consistent snapshot, the model is rebuilt and evaluated in the
+        # background
+        cls, args, state = lm.__reduce__()
+        result = dict()
+
+        def evaluate_snapshot():
+            try:
+                snapshot = cls(*args)
+                snapshot.set_state(state)
+                result['loglikelihood'] = self.evaluate(snapshot)
+            except Exception as error:
+                result['error'] = error
+
+        self._pending = (iteration, result)
+        self._thread = threading.Thread(target=evaluate_snapshot, daemon=True)
+        self._thread.start()
+        return False
+
+    def wait(self):
+        """ Waits for the pending background evaluation and records its
+        result
+
+        :return: True if the training should stop
+        """
+
+        if self._pending is None:
+            return False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        (iteration, result), self._pending = self._pending, None
+        if 'error' in result:
+            raise result['error']
+        return self._record(iteration, result['loglikelihood'])
+
+    def _record(self, iteration, loglikelihood):
+        improvement = loglikelihood - self._best_loglikelihood
+        self._best_loglikelihood = max(self._best_loglikelihood,
+                                       loglikelihood)
+        self.history.append(dict(iteration=iteration,
+                                 loglikelihood=loglikelihood,
+                                 resample_interval=self.resample_interval))
+        if improvement < self.min_improvement:
+            self._num_without_improvement += 1
+            self.resample_interval = min(2 * self.resample_interval,
+                                         self.max_resample_interval)
+        else:
+            self._num_without_improvement = 0
+        return (self.patience is not None and
+                self._num_without_improvement >= self.patience)
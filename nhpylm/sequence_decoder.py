@@ -44,12 +44,21 @@
 
 __author__ = 'walter'
 
+from collections import OrderedDict
 from nhpylm.process_caller import run_processes
+import nhpylm.fst
 from nhpylm.fst import build_fst_for_sequence, fstcompile_cmd, fstaddselfloops_cmd, fstcompose_cmd
-from nhpylm.fst import fstshortestpath_cmd, fstprint_cmd
-from nhpylm.kaldi import get_kaldi_env
+from nhpylm.fst import fstshortestpath_cmd, fstprint_cmd, SimpleFST
+from nhpylm.array_fst import ArrayFST, ComposeFST, shortest_paths
+from nhpylm.array_fst import viterbi_beam_search
+
+
+def __getattr__(name):
+    # KALDI_ENV is shared with and created on first use by nhpylm.fst
+    if name == 'KALDI_ENV':
+        return nhpylm.fst.KALDI_ENV
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
 
-KALDI_ENV = get_kaldi_env()
 
 def decode_sequence(sequence, eow, eoc, phi, L_G=None, L=None, G=None, phicompose=False):
     """
@@ -81,9 +90,235 @@ def decode_sequence(sequence, eow, eoc, phi, L_G=None, L=None, G=None, phicompos
     cmd += fstprint_cmd(pipe=False)
 
     res = list()
-    for line in run_processes(cmd, inputs=build_fst_for_sequence(sequence).get_txt(), environment=KALDI_ENV)[0][0].split('\n'):
+    for line in run_processes(cmd, inputs=build_fst_for_sequence(sequence).get_txt_chunks(), environment=nhpylm.fst.KALDI_ENV)[0][0].split('\n'):
         split_line = line.split('\t')
         if len(split_line) > 3:
             res.append(split_line[3])
 
     return res
+
+
+def _load_fst(fst):
+    # ArrayFST and lazy fsts (e.g. LanguageModelFST) are used as they are
+    if fst is None or hasattr(fst, 'arcs'):
+        return fst
+    if isinstance(fst, SimpleFST):
+        return ArrayFST.from_simple_fst(fst)
+    return ArrayFST.read(fst)
+
+
+def decode_sequence_in_process(sequence, eow, eoc, phi, L_G=None, L=None,
+                               G=None, phicompose=False, nshortest=1, eps=0):
+    """
+    A simple in-process sequence decoder, equivalent to decode_sequence but
+    without calling the kaldi/OpenFst binaries. Decode an input sequence
+    given a lexicon fst and a language model fst into a sequence of integers
+
+    :param sequence: sequence of input labels to decode
+    :param eow: end of word symbol (has to match with lexicon)
+    :param eoc: end of character sequence symbol (has fo match with lexicon and language model)
+    :param phi: phi symbol for fallback transitions (has to match lexicon and language model)
+    :param L_G: path to binary fst or ArrayFST with composition of L and G
+    :param L: path to binary fst or ArrayFST for lexicon
+    :param G: path to binary fst, ArrayFST or LanguageModelFST for language model
+    :param phicompose: true: do normal composition of I with L and phi composition of I_L with G,
+                       false: do normal composition of I with L_G
+    :param nshortest: number of best decoding results
+    :param eps: epsilon symbol
+    :return: integer sequence of decoding result,
+             list of (weight, integer sequence) tuples if nshortest > 1
+    """
+
+    I = ArrayFST.from_simple_fst(build_fst_for_sequence(sequence))
+    if not phicompose:
+        I = I.add_self_loops([eow, eoc, phi], [eow, eoc, phi])
+        decoding_fst = ComposeFST(I, _load_fst(L_G), eps=eps)
+    else:
+        I = I.add_self_loops([eow, eoc], [eow, eoc])
+        decoding_fst = ComposeFST(ComposeFST(I, _load_fst(L), eps=eps),
+                                  _load_fst(G), phi=phi, eps=eps)
+
+    res = [(weight, [arc.olabel for arc in path if arc.olabel != eps])
+           for weight, path in shortest_paths(decoding_fst, nshortest)]
+
+    if nshortest == 1:
+        return res[0][1] if res else list()
+    return res
+
+
+_worker_graphs = dict()
+
+
+def _init_decode_worker(L_G, L, G):
+    _worker_graphs.update(L_G=_load_fst(L_G), L=_load_fst(L), G=_load_fst(G))
+
+
+def _decode_worker(args):
+    sequence, kwargs = args
+    return decode_sequence_in_process(sequence, **kwargs, **_worker_graphs)
+
+
+def decode_batch(sequences, eow, eoc, phi, L_G=None, L=None, G=None,
+                 phicompose=False, nshortest=1, eps=0, processes=None,
+                 chunksize=16):
+    """
+    Decode many input sequences with decode_sequence_in_process using a
+    process pool. The graphs are loaded once per worker and identical input
+    sequences are only decoded once.
+
+    :param sequences: list of sequences of input labels to decode
+    :param eow: end of word symbol (has to match with lexicon)
+    :param eoc: end of character sequence symbol (has fo match with lexicon and language model)
+    :param phi: phi symbol for fallback transitions (has to match lexicon and language model)
+    :param L_G: path to binary fst or ArrayFST with composition of L and G
+    :param L: path to binary fst or ArrayFST for lexicon
+    :param G: path to binary fst, ArrayFST or LanguageModelFST for language model
+    :param phicompose: true: do normal composition of I with L and phi composition of I_L with G,
+                       false: do normal composition of I with L_G
+    :param nshortest: number of best decoding results
+    :param eps: epsilon symbol
+    :param processes: number of worker processes (None: number of cpus,
+                      1: decode in this process)
+    :param chunksize: number of sequences send to a worker at once
+    :return: list with decoding result of decode_sequence_in_process for
+             each input sequence (in the order of the input sequences)
+    """
+
+    unique_sequences = list(OrderedDict.fromkeys(
+        tuple(sequence) for sequence in sequences))
+    kwargs = dict(eow=eow, eoc=eoc, phi=phi, phicompose=phicompose,
+                  nshortest=nshortest, eps=eps)
+    args = [(sequence, kwargs) for sequence in unique_sequences]
+
+    if processes == 1:
+        graphs = dict(L_G=_load_fst(L_G), L=_load_fst(L), G=_load_fst(G))
+        results = [decode_sequence_in_process(sequence, **kwargs, **graphs)
+                   for sequence in unique_sequences]
+    else:
+        from multiprocessing import Pool
+
+        with Pool(processes, initializer=_init_decode_worker,
+                  initargs=(L_G, L, G)) as pool:
+            results = pool.map(_decode_worker, args, chunksize)
+
+    results = dict(zip(unique_sequences, results))
+    return [results[tuple(sequence)] for sequence in sequences]
+
+
+def _build_observation_graph(H, L, G, L_G, phi, eps, max_states=100000):
+    if L_G is not None:
+        return ComposeFST(_load_fst(H), _load_fst(L_G), eps=eps,
+                          max_states=max_states)
+    return ComposeFST(ComposeFST(_load_fst(H), _load_fst(L), eps=eps,
+                                 max_states=max_states),
+                      _load_fst(G), phi=phi, eps=eps, max_states=max_states)
+
+
+def decode_observations(log_likelihoods, phi, H, L=None, G=None, L_G=None,
+                        observation_labels=None, beam=16., max_active=7000,
+                        acoustic_scale=1., eps=0, disambig=(),
+                        decoding_fst=None):
+    """
+    In-process frame synchronous beam search decoder for observation log
+    likelihoods. The search runs on the lazy composition of a monophone fst
+    (see fst.build_monophone_fst), the lexicon and the language model
+    (phi composition) without calling the kaldi/OpenFst binaries.
+
+    :param log_likelihoods: NumPy array (frames x observations) with the
+                            observation log likelihoods of each frame
+    :param phi: phi symbol for fallback transitions (has to match lexicon and language model)
+    :param H: path to binary fst, SimpleFST or ArrayFST for the monophones
+              with observation ids as input labels
+    :param L: path to binary fst, SimpleFST or ArrayFST for lexicon
+    :param G: path to binary fst, SimpleFST, ArrayFST or LanguageModelFST
+              for language model
+    :param L_G: path to binary fst, SimpleFST or ArrayFST with composition of
+                L and G (used instead of L and G)
+    :param observation_labels: input label of each column of log_likelihoods
+                               (None: the column index is the input label)
+    :param beam: pruning beam
+    :param max_active: maximum number of active tokens per frame
+    :param acoustic_scale: scale of the log likelihoods
+    :param eps: epsilon symbol
+    :param disambig: input labels of H which do not consume a frame, e.g. the
+                     end of word self loops (eow, eoc)
+    :param decoding_fst: already composed (lazy) decoding fst, used instead of
+                         H, L, G and L_G to share expanded states between calls
+    :return: (weight, integer sequence) tuple of decoding result,
+             (inf, []) if no final state was reached
+    """
+
+    if decoding_fst is None:
+        decoding_fst = _build_observation_graph(H, L, G, L_G, phi, eps)
+    result = viterbi_beam_search(decoding_fst, log_likelihoods,
+                                 observation_labels, beam, max_active,
+                                 acoustic_scale, eps, disambig)
+    if result is None:
+        return float('inf'), list()
+    weight, path = result
+    return weight, [arc.olabel for arc in path if arc.olabel != eps]
+
+
+def _init_observation_worker(H, L, G, L_G, phi, eps, max_states):
+    _worker_graphs.update(decoding_fst=_build_observation_graph(
+        H, L, G, L_G, phi, eps, max_states))
+
+
+def _decode_observation_worker(args):
+    log_likelihoods, kwargs = args
+    return decode_observations(log_likelihoods, H=None, **kwargs,
+                               **_worker_graphs)
+
+
+def decode_observations_batch(log_likelihoods, phi, H, L=None, G=None,
+                              L_G=None, observation_labels=None, beam=16.,
+                              max_active=7000, acoustic_scale=1., eps=0,
+                              disambig=(), processes=None, chunksize=1,
+                              max_states=100000):
+    """
+    Decode many utterances with decode_observations using a process pool.
+    The graphs are loaded and lazily composed once per worker, expanded
+    states are reused by all utterances decoded by that worker (up to
+    max_states per composition, see ComposeFST).
+
+    :param log_likelihoods: list of NumPy arrays (frames x observations) with
+                            the observation log likelihoods of each utterance
+    :param phi: phi symbol for fallback transitions (has to match lexicon and language model)
+    :param H: path to binary fst, SimpleFST or ArrayFST for the monophones
+    :param L: path to binary fst, SimpleFST or ArrayFST for lexicon
+    :param G: path to binary fst, SimpleFST, ArrayFST or LanguageModelFST
+              for language model
+    :param L_G: path to binary fst, SimpleFST or ArrayFST with composition of
+                L and G (used instead of L and G)
+    :param observation_labels: input label of each column of log_likelihoods
+    :param beam: pruning beam
+    :param max_active: maximum number of active tokens per frame
+    :param acoustic_scale: scale of the log likelihoods
+    :param eps: epsilon symbol
+    :param disambig: input labels of H which do not consume a frame
+    :param processes: number of worker processes (None: number of cpus,
+                      1: decode in this process)
+    :param chunksize: number of utterances send to a worker at once
+    :param max_states: maximum number of expanded states kept in memory by
+                       each lazy composition
+    :return: list with decoding result of decode_observations for each
+             utterance (in the order of the input)
+    """
+
+    kwargs = dict(phi=phi, observation_labels=observation_labels, beam=beam,
+                  max_active=max_active, acoustic_scale=acoustic_scale,
+                  eps=eps, disambig=disambig)
+    if processes == 1:
+        decoding_fst = _build_observation_graph(H, L, G, L_G, phi, eps,
+                                                max_states)
+        return [decode_observations(utterance, H=None, **kwargs,
+                                    decoding_fst=decoding_fst)
+                for utterance in log_likelihoods]
+
+    from multiprocessing import Pool
+
+    with Pool(processes, initializer=_init_observation_worker,
+              initargs=(H, L, G, L_G, phi, eps, max_states)) as pool:
+        return pool.map(_decode_observation_worker,
+                        [(utterance, kwargs) for utterance in log_likelihoods],
+                        chunksize)
@@ -73,7 +73,8 @@ setup(
             include_dirs=['nhpylm/c_core/NHPYLM/',
                           'nhpylm/c_core/NHPYLM/ext_deps'],
             library_dirs=['nhpylm/c_core/NHPYLM/build'],
-            extra_compile_args=['-std=c++11'],
+            extra_compile_args=['-std=c++11', '-pthread'],
+            extra_link_args=['-pthread'],
             libraries=['NHPYLM']
     )], annotate=True)
 )
\ No newline at end of file
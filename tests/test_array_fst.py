@@ -0,0 +1,225 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_array_fst.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from math import inf
+import numpy as np
+from nhpylm.array_fst import ArrayFST, ComposeFST, compose, shortest_paths
+from nhpylm.array_fst import viterbi_beam_search
+from nhpylm.fst import build_fst_from_arc_list, build_monophone_fst
+from nhpylm.sequence_decoder import decode_sequence_in_process, decode_batch
+from nhpylm.sequence_decoder import decode_observations
+from nhpylm.sequence_decoder import decode_observations_batch
+
+EOW, EOC, PHI = 3, 6, 1
+A, B = 10, 11
+WORD_AB, WORD_A, WORD_B = 20, 21, 22
+OBSERVATIONS = [30, 31]
+
+
+def build_monophones():
+    monophones = dict()
+    for observation, monophone in zip(OBSERVATIONS, [A, B]):
+        monophones[monophone] = {
+            -1: {'transitions': ((0, 1),)},
+            0: {'transitions': ((0, 0.5), (-1, 0.5)),
+                'observations': ((observation, 1),)}}
+    H = build_monophone_fst(monophones, 0)
+    H.add_self_loops(0, EOW, EOW)
+    return ArrayFST.from_simple_fst(H)
+
+
+def build_lexicon():
+    return ArrayFST.from_simple_fst(build_fst_from_arc_list([
+        (0, 1, A, 0), (1, 2, B, 0), (2, 0, EOW, WORD_AB),
+        (0, 3, A, 0), (3, 0, EOW, WORD_A),
+        (0, 4, B, 0), (4, 0, EOW, WORD_B), (0,)]))
+
+
+class TestArrayFST(unittest.TestCase):
+
+    def test_read_write(self):
+        fst = build_lexicon()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fst.write(os.path.join(tmp_dir, 'L.fst'))
+            read_fst = ArrayFST.read(os.path.join(tmp_dir, 'L.fst'))
+        self.assertEqual(read_fst.start, fst.start)
+        self.assertEqual(read_fst.final(0), 0)
+        self.assertEqual(read_fst.final(1), inf)
+        for state in range(fst.num_states):
+            self.assertEqual(sorted(read_fst.arcs(state)),
+                             sorted(fst.arcs(state)))
+
+    def test_compose_shortest_path(self):
+        left = ArrayFST(3, 0, [0, 0, 1], [1, 2, 2], [1, 1, 2], [1, 2, 3],
+                        [1., 0.5, 1.], [2])
+        right = ArrayFST(2, 0, [0, 0, 1], [1, 1, 1], [1, 2, 3], [4, 5, 0],
+                         [0., 1., 0.], [1])
+        paths = shortest_paths(ComposeFST(left, right), 3)
+        self.assertEqual([weight for weight, _ in paths], [1.5, 2.])
+        self.assertEqual([arc.olabel for arc in paths[0][1]], [5])
+        self.assertEqual([arc.olabel for arc in paths[1][1]], [4, 0])
+        composed = compose(left, right)
+        self.assertEqual(composed.num_states, 3)
+        self.assertEqual(shortest_paths(composed, 3)[1][0], 2.)
+
+        bounded = ComposeFST(left, right, max_states=1)
+        self.assertEqual(shortest_paths(bounded, 3), paths)
+        self.assertEqual(len(bounded._arcs), 1)
+
+    def test_compose_epsilon_filter(self):
+        # left a:eps, b:x and right eps:y, x:z: the epsilon moves can be
+        # interleaved in two orders but only one path may be generated
+        left = ArrayFST(3, 0, [0, 1], [1, 2], [1, 2], [0, 3], [1., 1.], [2])
+        right = ArrayFST(3, 0, [0, 1], [1, 2], [0, 3], [4, 5], [1., 1.], [2])
+        paths = shortest_paths(ComposeFST(left, right), 3)
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(paths[0][0], 4.)
+        self.assertEqual([(arc.ilabel, arc.olabel) for arc in paths[0][1]],
+                         [(1, 0), (0, 4), (2, 5)])
+        self.assertEqual(len(shortest_paths(compose(left, right), 3)), 1)
+
+    def test_phi_compose(self):
+        left = ArrayFST(2, 0, [0], [1], [2], [2], None, [1])
+        right = ArrayFST(3, 0, [0, 0, 1], [1, 2, 2], [PHI, 3, 2],
+                         [0, 3, 2], [0.5, 0., 1.], [1, 2], [0.25, 0.])
+        paths = shortest_paths(ComposeFST(left, right, phi=PHI), 1)
+        self.assertEqual(paths[0][0], 1.5)
+        self.assertEqual(ComposeFST(left, right, phi=PHI).final((1, 0, 0)),
+                         0.75)
+        self.assertEqual(shortest_paths(ComposeFST(left, right), 1), [])
+
+    def test_decode_sequence(self):
+        G = ArrayFST(1, 0, [0, 0, 0], [0, 0, 0], [WORD_AB, WORD_A, WORD_B],
+                     [WORD_AB, WORD_A, WORD_B], [1., 0.1, 0.2], [0])
+        L_G = compose(build_lexicon(), G)
+        self.assertEqual(
+            decode_sequence_in_process([A, B], EOW, EOC, PHI, L_G=L_G),
+            [WORD_A, WORD_B])
+        self.assertEqual(
+            decode_sequence_in_process([A, B], EOW, EOC, PHI, L_G=L_G,
+                                       nshortest=2)[1],
+            (1., [WORD_AB]))
+
+        G = ArrayFST(2, 0, [0, 0, 1, 1], [0, 1, 0, 0],
+                     [WORD_AB, PHI, WORD_A, WORD_B],
+                     [WORD_AB, 0, WORD_A, WORD_B], [1., 0.5, 0.1, 0.2], [0])
+        self.assertEqual(
+            decode_sequence_in_process([A, B], EOW, EOC, PHI,
+                                       L=build_lexicon(), G=G,
+                                       phicompose=True),
+            [WORD_AB])
+
+    def test_decode_batch(self):
+        G = ArrayFST(1, 0, [0, 0, 0], [0, 0, 0], [WORD_AB, WORD_A, WORD_B],
+                     [WORD_AB, WORD_A, WORD_B], [1., 0.1, 0.2], [0])
+        L_G = compose(build_lexicon(), G)
+        sequences = [[A, B], [B], [A, B], [A]]
+        expected = [decode_sequence_in_process(sequence, EOW, EOC, PHI,
+                                               L_G=L_G)
+                    for sequence in sequences]
+        self.assertEqual(decode_batch(sequences, EOW, EOC, PHI, L_G=L_G,
+                                      processes=2), expected)
+        self.assertEqual(decode_batch(sequences, EOW, EOC, PHI, L_G=L_G,
+                                      processes=1), expected)
+
+    def test_decode_observations(self):
+        H, L = build_monophones(), build_lexicon()
+        G = ArrayFST(2, 0, [0, 0, 1, 1], [0, 1, 0, 0],
+                     [WORD_AB, PHI, WORD_A, WORD_B],
+                     [WORD_AB, 0, WORD_A, WORD_B], [3., 0.5, 0.1, 0.2], [0])
+        random_state = np.random.RandomState(0)
+        log_likelihoods = [np.log(random_state.dirichlet([1, 1], size))
+                           for size in [4, 6, 7]]
+        log_likelihoods[0][:, 0] = [0, 0, -5, -5]
+        log_likelihoods[0][:, 1] = [-5, -5, 0, 0]
+        results = decode_observations_batch(log_likelihoods, PHI, H, L, G,
+                                            observation_labels=OBSERVATIONS,
+                                            disambig=[EOW], processes=2)
+        self.assertEqual(results[0][1], [WORD_A, WORD_B])
+
+        for utterance, result in zip(log_likelihoods, results):
+            # exhaustive search on the observation fst
+            num_frames = len(utterance)
+            O = ArrayFST(num_frames + 1, 0, np.repeat(range(num_frames), 2),
+                         np.repeat(range(1, num_frames + 1), 2),
+                         num_frames * OBSERVATIONS, num_frames * OBSERVATIONS,
+                         -utterance.ravel(), [num_frames])
+            O = O.add_self_loops([EOW], [EOW])
+            graph = ComposeFST(ComposeFST(H, L), G, phi=PHI)
+            weight, path = shortest_paths(ComposeFST(O, graph))[0]
+            self.assertAlmostEqual(result[0], weight, places=4)
+            self.assertEqual(result[1], [arc.olabel for arc in path
+                                         if arc.olabel != 0])
+            self.assertEqual(
+                decode_observations(utterance, PHI, H, L, G,
+                                    observation_labels=OBSERVATIONS,
+                                    disambig=[EOW]),
+                result)
+
+        self.assertEqual(
+            decode_observations(log_likelihoods[0], PHI, H, L, G,
+                                observation_labels=OBSERVATIONS,
+                                disambig=[EOW], beam=4., max_active=5)[1],
+            [WORD_A, WORD_B])
+        self.assertEqual(decode_observations(np.zeros((0, 2)), PHI, H, L, G,
+                                             disambig=[EOW]),
+                         (0, []))
+
+    def test_viterbi_beam_search(self):
+        H = build_monophones()
+        graph = ComposeFST(H, build_lexicon())
+        log_likelihoods = np.log([[0.9, 0.1], [0.8, 0.2], [0.1, 0.9]])
+        expected = viterbi_beam_search(graph, log_likelihoods, OBSERVATIONS,
+                                       disambig=[EOW])
+        self.assertEqual(viterbi_beam_search(graph, log_likelihoods,
+                                             OBSERVATIONS, disambig=[EOW],
+                                             max_states=1),
+                         expected)
+        with self.assertRaisesRegex(ValueError, str(OBSERVATIONS[1])):
+            viterbi_beam_search(graph, log_likelihoods, OBSERVATIONS[:1],
+                                disambig=[EOW])
+
@@ -0,0 +1,144 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_checkpoint.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import os
+import pickle
+import tempfile
+import unittest
+from nhpylm.c_core.nhpylm import NHPYLM_wrapper as NHPYLM
+from nhpylm.c_core.nhpylm import get_random_state, set_random_state
+from nhpylm.checkpoint import Checkpointer
+from nhpylm.scheduler import ConvergenceScheduler
+
+symbols = ['A', 'B']
+sentences = [['AB', 'A', 'BBA'], ['A', 'AB'], ['BBA', 'B', 'AB', 'A']] * 4
+
+
+def model_summary(lm):
+    return (lm.word_model_word_count, lm.word_model_table_count,
+            lm.character_model_table_count, lm.hyperparameter,
+            lm.word_sequence_likelihood(['AB', 'A'], True))
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.lm = NHPYLM(symbols, 2, 3)
+        self.lm.train_with_list_of_sentences(sentences, 2)
+
+    def test_pickle(self):
+        lm = pickle.loads(pickle.dumps(self.lm))
+        self.assertEqual(model_summary(lm), model_summary(self.lm))
+        self.assertEqual(lm.string_ids, self.lm.string_ids)
+
+        # both copies continue identically with the same random state
+        random_state = get_random_state()
+        lm.train_with_list_of_sentences(sentences, 2)
+        other_lm = pickle.loads(pickle.dumps(self.lm))
+        set_random_state(random_state)
+        other_lm.train_with_list_of_sentences(sentences, 2)
+        self.assertEqual(model_summary(lm), model_summary(other_lm))
+
+    def test_checkpointer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpointer = Checkpointer(directory, interval=2, keep_last=2)
+            lm = NHPYLM(symbols, 2, 3)
+            lm.train_with_list_of_sentences(sentences, 7, checkpointer)
+            self.assertEqual([iteration for iteration, _ in
+                              checkpointer.checkpoints()], [4, 6])
+            checkpoint = checkpointer.load()
+            self.assertEqual(checkpoint['iteration'], 6)
+
+            # resume twice from the checkpoint of iteration 6
+            os.remove(checkpointer.checkpoints()[0][1])
+            summaries = []
+            for _ in range(2):
+                lm = NHPYLM(symbols, 2, 3)
+                self.assertEqual(checkpointer.restore(lm), 6)
+                self.assertEqual(model_summary(lm),
+                                 model_summary(checkpoint['lm']))
+                lm.train_with_list_of_sentences(sentences, 8, checkpointer)
+                self.assertEqual(checkpointer.checkpoints()[-1][0], 8)
+                os.remove(checkpointer.checkpoints()[-1][1])
+                summaries.append(model_summary(lm))
+            self.assertEqual(summaries[0], summaries[1])
+
+    def test_checkpointer_scheduler(self):
+        def train(iterations, checkpointer):
+            scheduler = ConvergenceScheduler(sentences[:3], patience=100)
+            lm = NHPYLM(symbols, 2, 3)
+            lm.train_with_list_of_sentences(sentences, iterations,
+                                            checkpointer, scheduler)
+            return scheduler
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpointer = Checkpointer(directory, keep_last=None)
+            scheduler = train(8, checkpointer)
+            expected = checkpointer.load(
+                dict(checkpointer.checkpoints())[5])['extra']['scheduler']
+            self.assertEqual(expected['pending'], 5)
+            self.assertEqual(expected['history'], scheduler.history[:5])
+
+            # resume twice from the checkpoint of iteration 5 with new
+            # schedulers, the pending evaluation of iteration 5 is repeated
+            for path in dict(checkpointer.checkpoints()).values():
+                if path != dict(checkpointer.checkpoints())[5]:
+                    os.remove(path)
+            states = []
+            for _ in range(2):
+                resumed_scheduler = train(8, checkpointer)
+                self.assertEqual(resumed_scheduler.history[:6],
+                                 scheduler.history[:6])
+                self.assertEqual(len(resumed_scheduler.history), 9)
+                states.append(resumed_scheduler.get_state())
+                for iteration, path in checkpointer.checkpoints():
+                    if iteration > 5:
+                        os.remove(path)
+            self.assertEqual(states[0], states[1])
+
+    def test_keep_last(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError):
+                Checkpointer(directory, keep_last=0)
+
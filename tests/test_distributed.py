@@ -0,0 +1,153 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_distributed.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import os
+import unittest
+from multiprocessing import Process
+from multiprocessing.connection import Listener
+import numpy as np
+from nhpylm.c_core.nhpylm import NHPYLM_wrapper as NHPYLM
+from nhpylm.distributed import train_distributed, run_worker, _shard_bounds
+
+symbols = ['A', 'B']
+
+
+class TestTrainDistributed(unittest.TestCase):
+
+    def setUp(self):
+        self.lm_kwargs = dict(symbols=symbols, word_model_order=2,
+                              character_model_order=2)
+        lm = NHPYLM(**self.lm_kwargs)
+        sentences = ['ABAAB', 'AAB', 'ABAB', 'BAAB', 'AB', 'ABABAB'] * 5
+        self.characters = [lm.sym2id(c) for c in ''.join(sentences)]
+        self.sentence_offsets = np.cumsum(
+            [0] + [len(sentence) for sentence in sentences])
+
+    def test_shard_bounds(self):
+        bounds = _shard_bounds(self.sentence_offsets, 3)
+        self.assertEqual(len(bounds), 3)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], len(self.sentence_offsets) - 1)
+        for (_, end), (begin, _) in zip(bounds[:-1], bounds[1:]):
+            self.assertEqual(end, begin)
+
+    def test_train_distributed(self):
+        lm, word_ends, loglikelihoods = train_distributed(
+            self.lm_kwargs, self.characters, self.sentence_offsets,
+            iterations=3, num_workers=3, local_sweeps=2, max_word_length=4)
+        self.assertEqual(len(loglikelihoods), 3)
+        self.assertTrue(all(np.isfinite(loglikelihoods)))
+        self.assertEqual(len(word_ends), len(self.characters))
+        self.assertTrue(all(word_ends[self.sentence_offsets[1:] - 1]))
+        num_sentences = len(self.sentence_offsets) - 1
+        self.assertEqual(lm.word_model_word_count[1],
+                         sum(word_ends) + num_sentences)
+
+        # continue with the segmentation of a previous run
+        lm, new_word_ends, _ = train_distributed(
+            self.lm_kwargs, self.characters, self.sentence_offsets,
+            word_ends, iterations=1, num_workers=2,
+            resample_hyperparameters=False)
+        self.assertEqual(lm.word_model_word_count[1],
+                         sum(new_word_ends) + num_sentences)
+
+    def _sweep_identical_shards(self, seeds):
+        # two workers sampling identical shards (one sweep and exchange)
+        characters = np.tile(self.characters, 2).astype(np.int32)
+        num_characters = len(self.characters)
+        num_sentences = len(self.sentence_offsets) - 1
+        sentence_offsets = np.concatenate(
+            [self.sentence_offsets, self.sentence_offsets[1:] +
+             num_characters]).astype(np.int32)
+        bounds = [(0, num_sentences), (num_sentences, 2 * num_sentences)]
+        authkey = os.urandom(32)
+        with Listener(('localhost', 0), authkey=authkey) as listener:
+            processes = [Process(target=run_worker,
+                                 args=(listener.address, authkey))
+                         for _ in seeds]
+            for process in processes:
+                process.start()
+            connections = [listener.accept() for _ in seeds]
+            try:
+                for connection, worker_bounds, seed in zip(connections,
+                                                           bounds, seeds):
+                    connection.send((self.lm_kwargs, characters,
+                                     sentence_offsets, None, worker_bounds,
+                                     4, 1, seed))
+                for connection in connections:
+                    connection.send(('sweep', 1))
+                deltas = [connection.recv()[0] for connection in connections]
+                for worker, connection in enumerate(connections):
+                    connection.send(('apply', deltas[:worker] +
+                                     deltas[worker + 1:]))
+                    connection.send(('word_model_word_count',))
+                word_counts = [connection.recv()
+                               for connection in connections]
+                for connection in connections:
+                    connection.send(('stop',))
+            finally:
+                for connection in connections:
+                    connection.close()
+                for process in processes:
+                    process.join()
+
+        word_ends = np.concatenate([delta[3] for delta in deltas])
+        lm = NHPYLM(**self.lm_kwargs)
+        lm.resegment_sentences(characters, sentence_offsets, word_ends)
+        return word_ends[:num_characters], word_ends[num_characters:], \
+            word_counts, lm.word_model_word_count
+
+    def test_worker_random_state(self):
+        first, second, _, _ = self._sweep_identical_shards([5, 5])
+        self.assertEqual(list(first), list(second))
+        first, second, _, _ = self._sweep_identical_shards([5, 6])
+        self.assertNotEqual(list(first), list(second))
+
+    def test_worker_replicas(self):
+        _, _, word_counts, coordinator_word_count = \
+            self._sweep_identical_shards([1, 2])
+        # counts above the lowest level do not depend on the seating
+        for word_count in word_counts:
+            self.assertEqual(word_count[1:], coordinator_word_count[1:])
+
@@ -0,0 +1,253 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_fst.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import io
+import os
+import struct
+import tempfile
+import time
+import unittest
+from nhpylm.fst import (SimpleFST, CompactSimpleFST, FstCache, FstPipeline,
+                        ARC_INDEX_MIN_ARCS, COMPACT_ARC_INDEX_MIN_ARCS,
+                        write_vector_fst)
+
+
+class TestSimpleFST(unittest.TestCase):
+
+    fst_type = SimpleFST
+    num_labels = 2 * ARC_INDEX_MIN_ARCS
+
+    def setUp(self):
+        self.fst = self.fst_type()
+        for _ in range(3):
+            self.fst.add_state()
+        for label in range(self.num_labels):
+            self.fst.add_arc(0, 1, label, label % 2)
+            self.fst.add_arc(0, 2, label, label % 2, 1.)
+
+    def test_find_arc(self):
+        arc = self.fst.find_arc(0, 3)
+        self.assertEqual((arc.dst, arc.ilabel, arc.olabel), (2, 3, 1))
+        self.assertEqual(self.fst.find_arc(0, 3, 1, 1).weight, None)
+        self.assertIsNone(self.fst.find_arc(0, 3, 0))
+        self.assertEqual(self.fst.find_arc(0, olabel=0).ilabel,
+                         self.num_labels - 2)
+        self.assertIsNone(self.fst.find_arc(1, 3))
+
+    def test_add_arc_if_not_exists(self):
+        num_arcs = self.fst.num_arcs
+        self.fst.add_arc(0, 1, 3, 1, mode='if_not_exists')
+        self.assertEqual(self.fst.num_arcs, num_arcs)
+        self.fst.add_arc(0, 1, 3, 0, mode='if_not_exists')
+        self.assertEqual(self.fst.num_arcs, num_arcs + 1)
+        self.assertEqual(self.fst.find_arc(0, 3).olabel, 0)
+
+    def test_add_arcs(self):
+        fst = self.fst_type()
+        for _ in range(3):
+            fst.add_state()
+        arcs = [arc for state_id in range(3) for arc in
+                self.fst.get_arcs(state_id)]
+        fst.add_arcs([arc.src for arc in arcs], [arc.dst for arc in arcs],
+                     [arc.ilabel for arc in arcs],
+                     [arc.olabel for arc in arcs],
+                     [arc.weight for arc in arcs])
+        self.assertEqual(fst.get_txt(), self.fst.get_txt())
+        self.assertEqual(fst.find_arc(0, 3, 1, 1),
+                         self.fst.find_arc(0, 3, 1, 1))
+
+
+class TestCompactSimpleFST(TestSimpleFST):
+
+    fst_type = CompactSimpleFST
+    num_labels = 2 * COMPACT_ARC_INDEX_MIN_ARCS
+
+    def test_get_txt(self):
+        fst = SimpleFST()
+        for _ in range(3):
+            fst.add_state()
+        for arc in self.fst.get_arcs(0):
+            fst.add_arc(arc.src, arc.dst, arc.ilabel, arc.olabel, arc.weight)
+        for simple_fst in [self.fst, fst]:
+            simple_fst.set_start(0)
+            simple_fst.set_final(2, 0.5)
+        self.assertEqual(self.fst.get_txt(), fst.get_txt())
+
+
+class TestWriteVectorFst(unittest.TestCase):
+
+    def test_binary_format(self):
+        fid = io.BytesIO()
+        write_vector_fst(fid, [1, 0, 0], [2, 1, 2], [5, 3, 1], [6, 4, 2],
+                         [0.5, 1., 2.], start=0, final_states=[2],
+                         final_weights=[0.25])
+        data = fid.getvalue()
+
+        # OpenFst header: magic number, fst type, arc type, version, flags,
+        # properties, start state, number of states and number of arcs
+        self.assertEqual(struct.unpack_from('<i', data, 0), (2125659606,))
+        self.assertEqual(struct.unpack_from('<i6s', data, 4), (6, b'vector'))
+        self.assertEqual(struct.unpack_from('<i8s', data, 14),
+                         (8, b'standard'))
+        version, flags, properties, start, num_states, num_arcs = \
+            struct.unpack_from('<iiQqqq', data, 26)
+        self.assertEqual((version, flags, start, num_states, num_arcs),
+                         (2, 0, 0, 3, 3))
+        # expanded, mutable and input label sorted
+        self.assertEqual(properties, 0x1 | 0x2 | 0x10000000)
+
+        # first state: final weight, number of arcs and the arcs (input
+        # label, output label, weight, next state) sorted by input label
+        offset = 26 + struct.calcsize('<iiQqqq')
+        final, num_state_arcs = struct.unpack_from('<fq', data, offset)
+        self.assertEqual((final, num_state_arcs), (float('inf'), 2))
+        self.assertEqual(
+            [struct.unpack_from('<iifi', data, offset + 12 + 16 * idx)
+             for idx in range(2)], [(1, 2, 2., 2), (3, 4, 1., 1)])
+        self.assertEqual(len(data), offset + 3 * 12 + 3 * 16)
+        self.assertEqual(struct.unpack_from('<fq', data, len(data) - 12),
+                         (0.25, 0))
+
+
+class TestFstCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = FstCache(os.path.join(self.tmp_dir.name, 'cache'),
+                              max_size=8)
+        self.input_file = os.path.join(self.tmp_dir.name, 'input')
+        with open(self.input_file, 'w') as fid:
+            fid.write('abc')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _run(self, option, output_file='output', inputs=None):
+        output_file = os.path.join(self.tmp_dir.name, output_file)
+        self.cache.run(
+            lambda input_files, output_file: 'cat {0} - > {1}; '
+            'echo {2} >> {1}'.format(input_files[0], output_file, option),
+            output_file, [self.input_file], inputs)
+        with open(output_file) as fid:
+            return fid.read()
+
+    def test_run(self):
+        self.assertEqual(self._run(1, inputs='d'), 'abcd1\n')
+        self.assertEqual(self._run(1, 'other_output', inputs=['d']),
+                         'abcd1\n')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self._run(2), 'abc2\n')
+        with open(self.input_file, 'w') as fid:
+            fid.write('abcd')
+        self.assertEqual(self._run(1), 'abcd1\n')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+
+    def test_input_boundaries(self):
+        self.cache.max_size = 2 ** 20
+        self.assertEqual(self._run(1, inputs='d'), 'abcd1\n')
+        with open(self.input_file, 'w') as fid:
+            fid.write('abcd')
+        # same bytes split differently between the inputs
+        self.assertEqual(self._run(1), 'abcd1\n')
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_callable_input(self):
+        calls = list()
+
+        def write_input(fid):
+            calls.append(None)
+            fid.write(b'd')
+
+        self.assertEqual(self._run(1, inputs=write_input), 'abcd1\n')
+        self.assertEqual(len(calls), 1)
+
+    def test_evict(self):
+        self._run(1)
+        self._run(2)
+        # only the last output (5 bytes) fits into the cache
+        self._run(1)
+        self._run(2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 4))
+        self._run(2)
+        self.assertEqual(self.cache.hits, 1)
+
+
+class TestFstPipeline(unittest.TestCase):
+
+    def test_run(self):
+        finished = list()
+
+        def step(name, duration=0.2):
+            time.sleep(duration)
+            finished.append(name)
+            return name
+
+        pipeline = FstPipeline(max_workers=2)
+        pipeline.add_step('L', step, 'L')
+        pipeline.add_step('G', step, 'G')
+        pipeline.add_step('L_G', step, 'L_G', depends_on=['L', 'G'])
+        pipeline.add_step('I', step, 'I', duration=0)
+        start = time.time()
+        timings = pipeline.run()
+        # L and G run in parallel, I waits for a free worker
+        self.assertLess(time.time() - start, 0.6)
+        self.assertEqual(finished[-1], 'L_G')
+        self.assertGreaterEqual(pipeline.timings['L_G'][0],
+                                max(pipeline.timings['L'][1],
+                                    pipeline.timings['G'][1]))
+        self.assertEqual(set(timings), {'L', 'G', 'L_G', 'I'})
+        self.assertEqual(pipeline.results['L_G'], 'L_G')
+
+    def test_run_error(self):
+        def fail():
+            raise EnvironmentError('failed')
+
+        pipeline = FstPipeline()
+        pipeline.add_step('L', fail)
+        pipeline.add_step('L_G', time.sleep, 0, depends_on='L')
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+        self.assertNotIn('L_G', pipeline.results)
+        with self.assertRaises(ValueError):
+            pipeline.add_step('G', time.sleep, 0, depends_on=['H'])
@@ -0,0 +1,81 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_imports.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import subprocess
+import sys
+import unittest
+
+# Generous upper bound for importing the python modules (without numpy) so
+# that regressions like an eager kaldi environment setup are noticed
+IMPORT_TIME_BUDGET = 0.5
+MODULES = ['nhpylm.fst', 'nhpylm.sequence_decoder', 'nhpylm.lexicon',
+           'nhpylm.process_caller']
+DEFERRED_MODULES = ['tqdm', 'asyncio', 'multiprocessing', 'concurrent.futures',
+                    'nhpylm.display_pdf']
+
+IMPORT_SCRIPT = """
+import sys
+import time
+import numpy
+start = time.perf_counter()
+import {modules}
+import_time = time.perf_counter() - start
+loaded = [module for module in {deferred!r} if module in sys.modules]
+kaldi_env = any('KALDI_ENV' in vars(sys.modules[module]) for module in
+                ('nhpylm.fst', 'nhpylm.sequence_decoder'))
+print(import_time, ','.join(loaded), kaldi_env, sep='|')
+"""
+
+
+class TestImports(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        script = IMPORT_SCRIPT.format(modules=', '.join(MODULES),
+                                      deferred=DEFERRED_MODULES)
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         universal_newlines=True)
+        import_time, loaded, kaldi_env = output.strip().split('|')
+        self.assertEqual(loaded, '')
+        self.assertEqual(kaldi_env, 'False')
+        self.assertLess(float(import_time), IMPORT_TIME_BUDGET)
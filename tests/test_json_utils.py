@@ -0,0 +1,119 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_json_utils.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Jahn Heymann
+##
+## ----------------------------------------------------------------------------
+
+import json
+import os
+import tempfile
+import unittest
+from nhpylm import json_utils as ju
+
+DATABASE = {
+    'train': {'flists': {'wav': {'set': {
+        'a01': {'observed': {'CH1': 'a01_1.wav', 'CH2': 'a01_2.wav'}},
+        'a02': {'observed': {'CH1': 'a02_1.wav', 'CH2': 'a02_2.wav'}}}}}},
+    'flists': ['train/flists/wav/set'],
+    'orth': {'a01': 'A "QUOTED" WORD {', 'a02': 'B [C]'}
+}
+
+
+class TestJsonDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self.tmp_dir.name, 'db.json')
+        with open(self.json_file, 'w') as fid:
+            json.dump(DATABASE, fid, indent=4)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_index(self):
+        index = ju.build_index(self.json_file, depth=2)
+        self.assertEqual(sorted(index), ['', 'flists', 'orth', 'train',
+                                         'train/flists'])
+        with open(self.json_file) as fid:
+            data = fid.read()
+        begin, end = index['orth']
+        self.assertEqual(json.loads(data[begin:end]), DATABASE['orth'])
+
+    def test_get(self):
+        database = ju.JsonDatabase(self.json_file)
+        self.assertTrue(os.path.exists(self.json_file + ju.INDEX_SUFFIX))
+        for path in ['orth', '/train/flists/wav/set/', 'flists',
+                     'train/flists/wav/set/a01/observed']:
+            self.assertEqual(database.get(path),
+                             ju.traverse_to_dict(DATABASE, path))
+            self.assertEqual(ju.traverse_to_dict(database, path),
+                             ju.traverse_to_dict(DATABASE, path))
+        self.assertEqual(list(database._subtrees),
+                         ['orth', 'train/flists/wav/set', 'flists'])
+        self.assertEqual(
+            database.get_flist_for_channel('train/flists/wav/set',
+                                           'observed/CH2'),
+            ju.get_flist_for_channel(DATABASE['train']['flists']['wav']
+                                     ['set'], 'observed/CH2'))
+        with self.assertRaises(KeyError):
+            database.get('train/flists/mp3')
+
+        # paths below a loaded subtree are not loaded again
+        database.clear_cache()
+        database.get('train')
+        self.assertEqual(database.get('train/flists/wav/set/a01'),
+                         ju.traverse_to_dict(DATABASE,
+                                             'train/flists/wav/set/a01'))
+        self.assertEqual(list(database._subtrees), ['train'])
+
+        # index is reused and rebuilt if the database changes
+        self.assertEqual(ju.JsonDatabase(self.json_file).index,
+                         database.index)
+        with open(self.json_file, 'w') as fid:
+            json.dump({'orth': DATABASE['orth']}, fid)
+        self.assertEqual(ju.JsonDatabase(self.json_file).keys(), ['orth'])
+
+    def test_unwritable_index(self):
+        index_file = os.path.join(self.tmp_dir.name, 'missing', 'db.index')
+        database = ju.JsonDatabase(self.json_file, index_file)
+        self.assertFalse(os.path.exists(index_file))
+        self.assertEqual(database.get('orth'), DATABASE['orth'])
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['db.json'])
@@ -0,0 +1,140 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_kaldi_data_preparation.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+import warnings
+from nhpylm import kaldi_data_preparation as kdp
+
+DATABASE = {
+    'flists': {'set': {
+        'spk2-b': {'observed': {'CH1': 'b_1.wav', 'CH2': 'b_2.wav'}},
+        'spk1-a': {'observed': {'CH1': 'a_1.wav', 'CH2': 'a_2.wav'}},
+        'spk1-c': {'observed': {'CH1': 'c_1.wav', 'CH2': 'c_2.wav'}}}},
+    'orth': {'spk1-a': 'HELLO WORLD', 'spk2-b': 'WORLD', 'spk1-c': 'HI'}
+}
+
+
+def read_files(directory):
+    files = dict()
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name)) as fid:
+            files[name] = fid.read()
+    return files
+
+
+class TestKaldiDataPreparation(unittest.TestCase):
+
+    def test_create_data_dir(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for processes in [1, 2]:
+                data_dir = os.path.join(tmp_dir, str(processes))
+                kdp.create_data_dir(
+                    DATABASE, 'flists/set', ['observed/CH2', 'observed/CH1'],
+                    'orth', data_dir, {'pos': [0], 'split_key': '-'},
+                    processes=processes, shard_size=2)
+                files = read_files(data_dir)
+                self.assertEqual(list(files),
+                                 ['spk2utt', 'text', 'utt2spk', 'wav.scp'])
+                self.assertEqual(
+                    files['spk2utt'],
+                    'spk1 spk1-a-observed/CH1 spk1-a-observed/CH2 '
+                    'spk1-c-observed/CH1 spk1-c-observed/CH2\n'
+                    'spk2 spk2-b-observed/CH1 spk2-b-observed/CH2\n')
+                self.assertEqual(files['text'].splitlines()[:2],
+                                 ['spk1-a-observed/CH1 HELLO WORLD',
+                                  'spk1-a-observed/CH2 HELLO WORLD'])
+                self.assertEqual(files['wav.scp'].splitlines()[-1],
+                                 'spk2-b-observed/CH2 b_2.wav')
+            self.assertEqual(read_files(os.path.join(tmp_dir, '1')),
+                             read_files(os.path.join(tmp_dir, '2')))
+
+    def test_create_dict_dir_from_database(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for processes in [1, 2]:
+                kdp.create_dict_dir_from_database(
+                    DATABASE, ['flists/set'], 'orth',
+                    os.path.join(tmp_dir, str(processes)), ['SIL'], 'SIL',
+                    kdp.word_to_grapheme(), processes=processes,
+                    shard_size=1)
+            files = read_files(os.path.join(tmp_dir, '2'))
+            self.assertEqual(files['lexicon.txt'],
+                             'HELLO\tH E L L O\nHI\tH I\nWORLD\tW O R L D\n')
+            self.assertEqual(files['nonsilence_phones.txt'].split(),
+                             ['D', 'E', 'H', 'I', 'L', 'O', 'R', 'W'])
+            self.assertEqual(read_files(os.path.join(tmp_dir, '1')), files)
+
+    def test_unpicklable_functions(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for processes in [1, 2]:
+                data_dir = os.path.join(tmp_dir, str(processes))
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter('always')
+                    kdp.create_data_dir(
+                        DATABASE, 'flists/set', ['observed/CH1'], 'orth',
+                        data_dir, word_to_word=lambda word: [word.lower()],
+                        processes=processes, shard_size=2)
+                self.assertEqual(len(caught), processes - 1)
+                self.assertEqual(read_files(data_dir)['text'].splitlines(),
+                                 ['spk1-a hello world', 'spk1-c hi',
+                                  'spk2-b world'])
+
+    def test_transcription_converter(self):
+        word_to_units = kdp.word_to_phoneme(
+            {'HELLO': ['HH AH L OW', 'HH EH L OW'], 'WORLD': 'W ER L D'},
+            cache_size=1)
+        converter = kdp.transcription_converter(kdp.identity, word_to_units)
+        for transcription in ['HELLO WORLD WORLD', ['WORLD', 'HELLO']]:
+            self.assertEqual(
+                converter(transcription),
+                kdp.convert_transcription(transcription, kdp.identity,
+                                          word_to_units))
+        self.assertEqual(converter.to_ids('WORLD HELLO HELLO'), [1, 0, 0])
+        self.assertEqual(converter.word_to_units_dict()['WORLD'],
+                         ['W ER L D'])
+        self.assertEqual(list(word_to_units._cache), ['HELLO'])
+        units = word_to_units('HELLO')
+        units.append('X')
+        self.assertEqual(word_to_units('HELLO'), ['HH AH L OW', 'HH EH L OW'])
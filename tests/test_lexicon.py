@@ -0,0 +1,98 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_lexicon.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import unittest
+from nhpylm.lexicon import Linear, Minimal, build_minimal_fst_for_lexicon
+
+
+class TestLinear(unittest.TestCase):
+
+    def setUp(self):
+        self.labels = [10, 11, 12]
+        self.lexicon = {100: [10, 11], 101: [10, 11, 12], 102: [12, 13],
+                        11: [11]}
+
+    def _build(self, compact=False):
+        lexicon = Linear(0, 3, 6, 7, compact)
+        for word in self.lexicon.items():
+            lexicon.add_word(word)
+        return lexicon
+
+    def test_build_character_model_trie(self):
+        # reference: add the prefixes one after another
+        expected = self._build()
+        characters_loop_state = expected._add_characters_loop(self.labels)
+        for prefix, is_word in expected.prefixes.items():
+            end_state = expected._add_character_sequence_tri(prefix)
+            if not is_word:
+                expected.lex.add_arc(end_state, expected.start_state, 6, 6)
+            for label in self.labels:
+                if prefix + (label,) not in expected.prefixes:
+                    expected.lex.add_arc(end_state, characters_loop_state,
+                                         label, label)
+
+        for compact in [False, True]:
+            lexicon = self._build(compact)
+            lexicon.build_character_model(self.labels, mode='trie')
+            self.assertEqual(lexicon.get_txt(), expected.get_txt())
+
+
+class TestMinimal(unittest.TestCase):
+
+    def test_add_word(self):
+        lexicon = build_minimal_fst_for_lexicon(
+            {100: [10, 11], 101: [12, 11], 102: [10]}, 0, 3)
+        # common suffix [11, eow] is shared, word labels are placed on the
+        # first arc not shared with another word
+        self.assertEqual(lexicon.lex.num_states, 4)
+        self.assertEqual(lexicon.lex.find_arc(0, 12).olabel, 101)
+        state = lexicon.lex.find_arc(0, 10, 0).dst
+        self.assertEqual(lexicon.lex.find_arc(state, 3).olabel, 102)
+        self.assertEqual(lexicon.lex.find_arc(state, 11).olabel, 100)
+
+    def test_add_word_unsorted(self):
+        lexicon = Minimal(0, 3)
+        lexicon.add_word((100, [11]))
+        with self.assertRaises(ValueError):
+            lexicon.add_word((101, [10, 12]))
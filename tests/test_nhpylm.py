@@ -42,8 +42,16 @@
 ##
 ## ----------------------------------------------------------------------------
 
+import io
+import os
+import struct
+import tempfile
 import unittest
+import numpy as np
 from nhpylm.c_core.nhpylm import NHPYLM_wrapper as NHPYLM
+from nhpylm.c_core.nhpylm import deduplicate_id_sentences
+from nhpylm.array_fst import ArrayFST, LanguageModelFST, shortest_paths
+from nhpylm.fst import write_language_model_fst
 
 symbols = ['A', 'B']
 
@@ -157,4 +165,241 @@ class TestNHPYLM(unittest.TestCase):
         ll = self.lm.word_sequence_likelihood(word_list, True)
         print(ll/3)
         self.assertGreater(ll, -2)
-        self.assertGreater(-1, ll)
\ No newline at end of file
+        self.assertGreater(-1, ll)
+
+    def test_pruned_context_map(self):
+        word_list = [['A', 'A'], ['B', 'A']]
+        id_list = self.lm.word_list_to_id_list(word_list)
+        self.lm.add_id_sentence_to_lm(id_list)
+        context_map = self.lm.get_pruned_context_map()
+        self.assertEqual(context_map, list(range(len(context_map))))
+        context_map = self.lm.get_pruned_context_map(min_customers=10)
+        for context_id in context_map[self.lm.root_context_id:-1]:
+            self.assertEqual(context_id, self.lm.root_context_id)
+        self.assertEqual(self.lm.word_model_context_count, [1, 3])
+
+    def test_prune_contexts(self):
+        word_list = [['A', 'A'], ['B', 'A']]
+        id_list = self.lm.word_list_to_id_list(word_list)
+        self.lm.add_id_sentence_to_lm(id_list)
+        self.lm.prune_contexts(min_customers=10)
+        self.assertEqual(self.lm.word_model_context_count, [1, 0])
+        self.assertEqual(self.lm.word_model_word_count[0], 3)
+        self.lm.rm_id_sentence_from_lm(id_list)
+        self.assertEqual(self.lm.word_model_word_count[0], 0)
+
+    def test_to_fst_arrays(self):
+        word_list = [['A', 'A'], ['B', 'A']]
+        id_list = self.lm.word_list_to_id_list(word_list)
+        self.lm.add_id_sentence_to_lm(id_list)
+        _, arc_list = self.lm.to_fst_text_format()
+        (src, dst, labels, weights), start, final = self.lm.to_fst_arrays()
+        self.assertEqual(start, self.lm.start_context_id)
+        self.assertEqual(final, arc_list[-1][0])
+        self.assertEqual(len(src), len(arc_list) - 1)
+        for idx, arc in enumerate(arc_list[:-1]):
+            self.assertEqual((src[idx], dst[idx], labels[idx]), arc[:3])
+            self.assertAlmostEqual(weights[idx], arc[4], places=5)
+
+    def test_segment_sentences(self):
+        word_list = [['A', 'A'], ['B', 'A']]
+        id_list = self.lm.word_list_to_id_list(word_list)
+        self.lm.add_id_sentence_to_lm(id_list)
+        characters = [self.lm.sym2id(c) for c in 'AABAB']
+        segmentations = [[['A', 'A'], ['B', 'A']], [['A', 'A', 'B', 'A']],
+                         [['A'], ['A'], ['B'], ['A']], [['A', 'A', 'B'], ['A']]]
+        best_ll = max(self.lm.word_sequence_likelihood(segmentation, True)
+                      for segmentation in segmentations)
+        word_ends, ll = self.lm.segment_sentences(
+            characters, [0, 4, 5], max_word_length=4, viterbi=True)
+        self.assertEqual(list(word_ends[:4]), [0, 1, 0, 1])
+        self.assertAlmostEqual(ll, best_ll + self.lm.word_sequence_likelihood(
+            [['B']], True))
+        self.assertEqual(self.lm.word_model_word_count[1], 3)
+
+        word_ends, _ = self.lm.segment_sentences(characters, [0, 4, 5])
+        self.assertEqual(self.lm.word_model_word_count[1],
+                         3 + sum(word_ends) + 2)
+        word_ends, _ = self.lm.segment_sentences(characters, [0, 4, 5],
+                                                 word_ends, num_threads=2)
+        self.assertEqual(word_ends[-1], 1)
+        self.assertEqual(self.lm.word_model_word_count[1],
+                         3 + sum(word_ends) + 2)
+
+    def test_segment_sentences_invalid_input(self):
+        characters = [self.lm.sym2id(c) for c in 'AABA']
+        for offsets in [[], [1, 4], [0, 3, 2, 4], [0, 5], [0, 2]]:
+            with self.assertRaises(ValueError):
+                self.lm.segment_sentences(characters, offsets)
+        with self.assertRaises(ValueError):
+            self.lm.segment_sentences(characters, [0, 4], max_word_length=0)
+        with self.assertRaises(ValueError):
+            self.lm.segment_sentences(characters, [0, 4], [0, 1])
+        self.assertEqual(sum(self.lm.word_model_word_count), 0)
+
+    def test_resegment_sentences_invalid_input(self):
+        characters = [self.lm.sym2id(c) for c in 'AABA']
+        with self.assertRaises(ValueError):
+            self.lm.resegment_sentences(characters, [0, 2, 6], [0, 1, 0, 1])
+        with self.assertRaises(ValueError):
+            self.lm.resegment_sentences(characters, [0, 4], [0, 1, 0, 1],
+                                        [0, 1])
+        with self.assertRaises(ValueError):
+            self.lm.resegment_sentences(characters, [0, 4], [1])
+        self.lm.resegment_sentences(characters, [0, 2, 4], [0, 1, 0, 1])
+        self.assertEqual(self.lm.word_model_word_count[1], 4)
+
+    def test_deduplicate_id_sentences(self):
+        word_ids, sentence_offsets, counts = deduplicate_id_sentences(
+            [[5, 8, 5], [5, 9, 5], [5, 8, 5], [5, 8, 5]])
+        self.assertEqual(list(word_ids), [5, 8, 5, 5, 9, 5])
+        self.assertEqual(list(sentence_offsets), [0, 3, 6])
+        self.assertEqual(list(counts), [3, 1])
+
+    def test_weighted_sentences(self):
+        lm = NHPYLM(symbols, 2, 2)
+        sentence = self.lm.word_list_to_id_list(['AB', 'A', 'AB'])
+        self.assertEqual(sentence, lm.word_list_to_id_list(['AB', 'A', 'AB']))
+        for _ in range(20):
+            self.lm.add_id_sentence_to_lm(sentence)
+        lm.add_id_sentence_to_lm(sentence, 20)
+        self.assertEqual(lm.word_model_word_count[1], 80)
+        self.assertEqual(lm.word_model_word_count[1],
+                         self.lm.word_model_word_count[1])
+        self.assertEqual(lm.word_model_context_count,
+                         self.lm.word_model_context_count)
+        self.assertTrue(sum(lm.word_model_table_count) < 80)
+
+        lm.rm_id_sentence_from_lm(sentence, 15)
+        self.assertEqual(lm.word_model_word_count[1], 20)
+        lm.add_weighted_id_sentences_to_lm(sentence, [0, len(sentence)], [5],
+                                           remove=True)
+        self.assertEqual(sum(lm.word_model_word_count), 0)
+        self.assertEqual(sum(lm.character_model_word_count), 0)
+        self.assertEqual(lm.word_model_context_count[1], 0)
+
+        lm.add_id_sentence_list_to_lm([sentence] * 3 + [sentence[:-2]])
+        self.assertEqual(lm.word_model_word_count[1], 14)
+
+        with self.assertRaises(ValueError):
+            lm.add_id_sentence_to_lm(sentence, -1)
+        with self.assertRaises(ValueError):
+            lm.rm_id_sentence_from_lm(sentence, -1)
+        with self.assertRaises(ValueError):
+            lm.add_weighted_id_sentences_to_lm(sentence, [0, len(sentence)],
+                                               [-1])
+        self.assertEqual(lm.word_model_word_count[1], 14)
+
+    def test_word_sequences_loglikelihoods(self):
+        word_lists = [['A', 'A'], ['B', 'A'], ['AB']]
+        self.lm.add_id_sentence_list_to_lm(
+            self.lm.word_lists_to_id_lists(word_lists[:2]))
+        loglikelihoods = self.lm.word_sequences_loglikelihoods(
+            self.lm.word_lists_to_id_lists(word_lists), num_threads=2)
+        self.assertEqual(len(loglikelihoods), 3)
+        for loglikelihood, word_list in zip(loglikelihoods, word_lists):
+            self.assertAlmostEqual(
+                loglikelihood, self.lm.word_sequence_likelihood(word_list,
+                                                                True))
+        self.assertEqual(len(self.lm.word_sequences_loglikelihoods([])), 0)
+
+    def test_word_lists_loglikelihoods(self):
+        word_lists = [['AB', 'A'], ['BAB', 'A', 'BAB']]
+        self.lm.add_id_sentence_to_lm(self.lm.word_list_to_id_list(['AB']))
+        lexicon = self.lm.get_word_id_to_char_id()
+        loglikelihoods = self.lm.word_lists_loglikelihoods(word_lists)
+        self.assertEqual(self.lm.get_word_id_to_char_id(), lexicon)
+        for loglikelihood, word_list in zip(loglikelihoods, word_lists):
+            self.assertAlmostEqual(
+                loglikelihood,
+                self.lm.word_sequence_likelihood(word_list, True))
+
+    def test_substring_word_probabilities(self):
+        word_list = [['A', 'A'], ['B', 'A']]
+        id_list = self.lm.word_list_to_id_list(word_list)
+        self.lm.add_id_sentence_to_lm(id_list)
+        sentence = 'AAB'
+        characters = [self.lm.sym2id(c) for c in sentence]
+        probabilities = self.lm.substring_word_probabilities(
+            characters, [0, 3], max_word_length=2)
+        self.assertEqual(probabilities.shape, (1, 3, 2))
+        self.assertEqual(probabilities[0, 2, 1], 0)
+        for begin in range(3):
+            for length in range(1, min(2, 3 - begin) + 1):
+                self.assertAlmostEqual(
+                    np.log(probabilities[0, begin, length - 1]),
+                    self.lm.word_sequence_likelihood(
+                        [sentence[begin:begin + length]]))
+
+    def test_language_model_fst(self):
+        word_list = [['A', 'A'], ['B', 'A']]
+        id_list = self.lm.word_list_to_id_list(word_list)
+        self.lm.add_id_sentence_to_lm(id_list)
+        eos_word = 100
+        (src, dst, labels, weights), start, final = self.lm.to_fst_arrays(
+            eos_word=eos_word)
+        G = ArrayFST(max(src.max(), dst.max()) + 1, start, src, dst, labels,
+                     labels, weights, [final])
+        lazy_G = LanguageModelFST(self.lm, eos_word=eos_word, max_states=2)
+        self.assertEqual(lazy_G.start, start)
+        for state in set(src):
+            self.assertEqual(lazy_G.arcs(state), G.arcs(state))
+            self.assertEqual(lazy_G.matches(state, 1), G.matches(state, 1))
+            self.assertLessEqual(len(lazy_G._states), 2)
+        self.assertEqual(lazy_G.final(final), 0)
+        self.assertEqual(shortest_paths(lazy_G, 2), shortest_paths(G, 2))
+
+    def test_write_language_model_fst(self):
+        word_list = [['A', 'A'], ['B', 'A']]
+        self.lm.add_id_sentence_to_lm(self.lm.word_list_to_id_list(word_list))
+        (src, dst, labels, weights), start, final = self.lm.to_fst_arrays()
+        fid = io.BytesIO()
+        write_language_model_fst(self.lm, fid)
+        data = fid.getvalue()
+
+        # OpenFst header (magic number, fst type, arc type, version, flags,
+        # properties, start state, number of states and number of arcs)
+        self.assertEqual(struct.unpack_from('<ii6si8s', data),
+                         (2125659606, 6, b'vector', 8, b'standard'))
+        version, _, _, fst_start, num_states, num_arcs = \
+            struct.unpack_from('<iiQqqq', data, 26)
+        self.assertEqual((version, fst_start, num_arcs),
+                         (2, start, len(src)))
+        self.assertEqual(num_states, max(src.max(), dst.max(), final) + 1)
+
+        # first state: final weight, number of arcs and its first arc
+        offset = 26 + struct.calcsize('<iiQqqq')
+        final_weight, num_state_arcs = struct.unpack_from('<fq', data, offset)
+        self.assertEqual(final_weight, float('inf'))
+        self.assertGreater(num_state_arcs, 0)
+        self.assertEqual(num_state_arcs, np.sum(src == 0))
+        ilabel, olabel, weight, next_state = struct.unpack_from(
+            '<iifi', data, offset + 12)
+        first_arc = np.flatnonzero(src == 0)[np.argmin(labels[src == 0])]
+        self.assertEqual((ilabel, olabel, next_state),
+                         (labels[first_arc], labels[first_arc],
+                          dst[first_arc]))
+        self.assertAlmostEqual(weight, weights[first_arc], places=5)
+
+    def test_lexicon_arrays(self):
+        word_list = [['A', 'A'], ['B', 'A'], ['B']]
+        id_list = self.lm.word_list_to_id_list(word_list)
+        self.lm.add_id_sentence_to_lm(id_list)
+        word_ids, offsets, character_ids = self.lm.get_lexicon_arrays()
+        self.assertEqual(word_ids.tolist(), sorted(set(id_list[1:-1])))
+        for idx, word_id in enumerate(word_ids):
+            self.assertEqual(
+                character_ids[offsets[idx]:offsets[idx + 1]].tolist(),
+                self.lm.id2word(word_id)[self.lm.character_order-1:-1])
+        self.assertEqual(
+            self.lm.get_word_id_to_char_id(),
+            {word_id: self.lm.id2word(word_id)[self.lm.character_order-1:-1]
+             for word_id in word_ids.tolist()})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'symbols.txt')
+            self.lm.write_symbol_table(filename)
+            with open(filename) as fid:
+                lines = fid.read().splitlines()
+        self.assertEqual(lines, ['{} {}'.format(symbol, idx) for idx, symbol
+                                 in enumerate(self.lm.string_ids)])
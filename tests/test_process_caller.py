@@ -0,0 +1,105 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_process_caller.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from nhpylm.process_caller import run_processes
+
+
+class TestRunProcesses(unittest.TestCase):
+
+    def test_text_input(self):
+        stdout, _, return_codes = run_processes('cat', inputs='a\nb\n')
+        self.assertEqual(stdout, ['a\nb\n'])
+        self.assertEqual(return_codes, [0])
+
+    def test_streamed_input(self):
+        chunks = ('{}\n'.format(line) for line in range(100000))
+        stdout, _, _ = run_processes(['wc -l', 'wc -c'], inputs=[
+            chunks, lambda fid: fid.write(b'\x00' * 1000000)])
+        self.assertEqual([int(count) for count in stdout], [100000, 1000000])
+
+    def test_streamed_input_error(self):
+        def chunks():
+            yield 'a\n'
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            run_processes('cat', inputs=[chunks()])
+
+    def test_max_parallel(self):
+        start = time.time()
+        run_processes(4 * ['sleep 0.2'], max_parallel=2)
+        self.assertGreater(time.time() - start, 0.4)
+
+    def test_timeout(self):
+        with self.assertRaises(EnvironmentError):
+            run_processes('sleep 10', timeout=0.1)
+        _, stderr, return_codes = run_processes(
+            ['sleep 10', 'true'], timeout=0.1, ignore_return_code=True,
+            warn_on_ignore=False)
+        self.assertLess(return_codes[0], 0)
+        self.assertEqual(return_codes[1], 0)
+        self.assertIn('Timeout', stderr[0])
+
+    def test_stdout_streaming(self):
+        chunks = list()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'stdout')
+            stdout, _, _ = run_processes(
+                ['head -c 100000 /dev/zero', 'printf abc'],
+                stdouts=[chunks.append, filename])
+            with open(filename, 'rb') as fid:
+                self.assertEqual(fid.read(), b'abc')
+        self.assertEqual(stdout, [None, None])
+        self.assertEqual(b''.join(chunks), bytes(100000))
+
+    def test_running_event_loop(self):
+        async def run():
+            return run_processes('echo a')[0]
+
+        self.assertEqual(asyncio.run(run()), ['a\n'])
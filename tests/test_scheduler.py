@@ -0,0 +1,107 @@
+## ----------------------------------------------------------------------------
+##
+##   File: test_scheduler.py
+##   Copyright (c) <2013> <University of Paderborn>
+##   Permission is hereby granted, free of charge, to any person
+##   obtaining a copy of this software and associated documentation
+##   files (the "Software"), to deal in the Software without restriction,
+##   including without limitation the rights to use, copy, modify and
+##   merge the Software, subject to the following conditions:
+##
+##   1.) The Software is used for non-commercial research and
+##       education purposes.
+##
+##   2.) The above copyright notice and this permission notice shall be
+##       included in all copies or substantial portions of the Software.
+##
+##   3.) Publication, Distribution, Sublicensing, and/or Selling of
+##       copies or parts of the Software requires special agreements
+##       with the University of Paderborn and is in general not permitted.
+##
+##   4.) Modifications or contributions to the software must be
+##       published under this license. The University of Paderborn
+##       is granted the non-exclusive right to publish modifications
+##       or contributions in future versions of the Software free of charge.
+##
+##   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+##   EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+##   OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+##   NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+##   HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+##   WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+##   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+##   OTHER DEALINGS IN THE SOFTWARE.
+##
+##   Persons using the Software are encouraged to notify the
+##   Department of Communications Engineering at the University of Paderborn
+##   about bugs. Please reference the Software in your publications
+##   if it was used for them.
+##
+##
+##   Author: Oliver Walter
+##
+## ----------------------------------------------------------------------------
+
+import unittest
+from nhpylm.c_core.nhpylm import NHPYLM_wrapper as NHPYLM
+from nhpylm.scheduler import ConvergenceScheduler
+
+symbols = ['A', 'B']
+sentences = [['AB', 'A', 'BBA'], ['A', 'AB'], ['BBA', 'B', 'AB', 'A']] * 4
+heldout_sentences = [['AB', 'A'], ['BBA', 'AB'], ['BBBA', 'A']]
+
+
+class TestConvergenceScheduler(unittest.TestCase):
+
+    def test_early_stopping(self):
+        lm = NHPYLM(symbols, 2, 3)
+        scheduler = ConvergenceScheduler(heldout_sentences,
+                                         min_improvement=10., patience=3,
+                                         max_resample_interval=2,
+                                         background=False)
+        iterations = lm.train_with_list_of_sentences(sentences, 50,
+                                                     scheduler=scheduler)
+        self.assertEqual(iterations, 3)
+        self.assertEqual(len(scheduler.history), 4)
+        self.assertEqual(scheduler.resample_interval, 2)
+        # resampled after iteration 1 (interval 1) and 3 (interval 2)
+        self.assertEqual([iteration for iteration, _ in
+                          scheduler.hyperparameter_trajectory], [1, 3])
+        self.assertAlmostEqual(scheduler.history[-1]['loglikelihood'],
+                               scheduler.evaluate(lm))
+
+    def test_no_stopping(self):
+        lm = NHPYLM(symbols, 2, 3)
+        scheduler = ConvergenceScheduler(heldout_sentences, eval_interval=2,
+                                         patience=None)
+        iterations = lm.train_with_list_of_sentences(sentences, 5,
+                                                     scheduler=scheduler)
+        self.assertEqual(iterations, 5)
+        self.assertEqual([entry['iteration'] for entry in scheduler.history],
+                         [0, 2, 4])
+
+    def test_background_evaluation(self):
+        lm = NHPYLM(symbols, 2, 3)
+        scheduler = ConvergenceScheduler(heldout_sentences,
+                                         min_improvement=10., patience=3)
+        iterations = lm.train_with_list_of_sentences(sentences, 50,
+                                                     scheduler=scheduler)
+        # the result of the evaluation after iteration 3 stops the training
+        # after iteration 4
+        self.assertEqual(iterations, 4)
+        self.assertEqual([entry['iteration'] for entry in scheduler.history],
+                         [0, 1, 2, 3])
+        self.assertEqual(scheduler.history[-1]['resample_interval'], 4)
+
+    def test_heldout_sentences_required(self):
+        with self.assertRaises(ValueError):
+            ConvergenceScheduler([])
+
+    def test_heldout_words_not_added(self):
+        lm = NHPYLM(symbols, 2, 3)
+        scheduler = ConvergenceScheduler(heldout_sentences, patience=None)
+        lm.train_with_list_of_sentences(sentences, 2, scheduler=scheduler)
+        lexicon = lm.get_word_id_to_char_id()
+        scheduler.evaluate(lm)
+        self.assertEqual(lm.get_word_id_to_char_id(), lexicon)
+        self.assertEqual(lm.word2id('BBBA'), lm.word2id('BBBBBB'))